@@ -1,23 +1,100 @@
 from __future__ import print_function
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+import random
+import sys
 
+from divvy.benchmark import report
+from divvy.benchmark.multiprocess_benchmark import MultiProcessBenchmark
 from divvy.benchmark.twisted_benchmark import TwistedBenchmark
+from divvy.benchmark.workload import DISTRIBUTIONS, SHAPES
 from divvy.benchmark.threaded_benchmark import ThreadedBenchmark
+from divvy.recording import count_trace
+from divvy.testing import FakeDivvyServer
+
+
+# the configuration suggested for the benchmark in README.md
+FAKE_SERVER_RULES = """
+[type=benchmark ip=*]
+creditLimit = 5
+resetSeconds = 60
+actorField = ip
+"""
+
+
+def _positive_float(s):
+    value = float(s)
+    if not value > 0:
+        raise ArgumentTypeError("must be greater than 0: {}".format(s))
+    return value
 
 
 def main():
     desc = "Benchmarks Divvy rate limiter service using divvy-client-python."
     parser = ArgumentParser(description=desc)
-    parser.add_argument("host", help="Divvy server hostname")
-    parser.add_argument("port", help="Divvy server port", type=int)
+    parser.add_argument("host", nargs="?", help="Divvy server hostname")
+    parser.add_argument("port", nargs="?", help="Divvy server port", type=int)
+    parser.add_argument("--fake-server", action="store_true", default=False,
+                        help="Instead of host and port, benchmark against a "
+                        "local fake Divvy server, started in a subprocess")
     parser.add_argument("--twisted", action="store_true", default=False,
                         help="Use the Twisted implementation")
+    parser.add_argument("--batch-writes", action="store_true", default=False,
+                        help="With --twisted, write the requests made in the "
+                        "same reactor iteration together")
     parser.add_argument("-n", dest="count", metavar="requests",
-                        type=int, default=1000,
-                        help="Number of requests to perform")
+                        type=int, default=None,
+                        help="Number of requests to perform (default 1000, "
+                        "or with --replay, the whole trace)")
     parser.add_argument("-c", dest="threads", metavar="concurrency",
                         type=int, default=4,
                         help="Number of multiple requests to make at a time")
+    parser.add_argument("--processes", metavar="N", type=int, default=1,
+                        help="Run the benchmark in N worker processes, each "
+                        "with the given concurrency")
+    parser.add_argument("--rate", metavar="R", type=float, default=None,
+                        help="Send R requests per second on a fixed "
+                        "timetable, regardless of how quickly responses "
+                        "arrive, and time each request from when it was "
+                        "due to be sent")
+    parser.add_argument("--poisson", action="store_true", default=False,
+                        help="With --rate, space requests randomly as a "
+                        "Poisson process rather than evenly")
+    parser.add_argument("--max-lateness", metavar="seconds", type=float,
+                        default=None,
+                        help="With --rate, drop requests that can't be sent "
+                        "within this many seconds of their scheduled time")
+    parser.add_argument("--keys", metavar="K", type=int, default=None,
+                        help="Number of distinct keys to send requests for "
+                        "(default: one for every ten requests)")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS,
+                        default="uniform",
+                        help="How often each key is chosen")
+    parser.add_argument("--zipf-exponent", metavar="S", type=float,
+                        default=1.0,
+                        help="With --distribution zipf, the exponent S: the "
+                        "key of rank r gets traffic in proportion to 1/r^S")
+    parser.add_argument("--hot-keys", metavar="FRACTION", type=float,
+                        default=0.01,
+                        help="With --distribution hotspot, the fraction of "
+                        "keys that are hot")
+    parser.add_argument("--hot-traffic", metavar="FRACTION", type=float,
+                        default=0.9,
+                        help="With --distribution hotspot, the fraction of "
+                        "requests that go to hot keys")
+    parser.add_argument("--shapes", metavar="SHAPE[,SHAPE...]",
+                        type=lambda s: tuple(s.split(",")),
+                        default=("benchmark",),
+                        help="Kinds of HIT arguments to send, in turn: {}"
+                        .format(", ".join(sorted(SHAPES))))
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed for choosing keys")
+    parser.add_argument("--replay", metavar="FILE", default=None,
+                        help="Send the checks recorded in a trace file, "
+                        "with their original arguments and timing")
+    parser.add_argument("--speed", metavar="X", type=_positive_float,
+                        default=1.0,
+                        help="With --replay, replay the trace X times "
+                        "faster than it was recorded")
     parser.add_argument("-r", dest="reconnect_rate", metavar="conn_reqs",
                         type=int, default=None,
                         help="Cycle each connection after this many requests")
@@ -27,8 +104,39 @@ def main():
     parser.add_argument("-s", dest="socket_timeout", metavar="timeout",
                         type=float, default=1.0,
                         help="Max seconds to wait for each response")
+    parser.add_argument("--output", choices=["text", "json", "csv"],
+                        default="text",
+                        help="Print results as human-readable text, or as "
+                        "JSON or CSV, without progress updates")
+    parser.add_argument("--compare", metavar="baseline.json", default=None,
+                        help="Compare results with those of an earlier run "
+                        "saved with --output json, and exit with status 1 if "
+                        "throughput or response times are significantly "
+                        "worse")
     args = parser.parse_args()
 
+    server = None
+    if args.fake_server:
+        server = FakeDivvyServer(FAKE_SERVER_RULES)
+        args.host, args.port = server.start_process()
+    elif args.host is None or args.port is None:
+        parser.error("host and port are required, unless --fake-server")
+
+    for shape in args.shapes:
+        if shape not in SHAPES:
+            parser.error("unknown shape: {}".format(shape))
+    if args.seed is None:
+        # chosen here so that every process uses the same keys
+        args.seed = random.randrange(1 << 32)
+
+    if args.count is None:
+        args.count = count_trace(args.replay) if args.replay else 1000
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = report.read_json(f)
+
     if args.twisted:
         if args.reconnect_rate:
             msg = "Reconnect interval is not supported with --twisted."
@@ -43,14 +151,51 @@ def main():
         else:
             desc = "1 thread"
 
-    print("Benchmarking {} requests to Divvy at {}:{}, using {}".format(
-        args.count, args.host, args.port, desc))
+    if args.processes > 1:
+        desc = "{} processes with {} each".format(args.processes, desc)
 
-    if args.twisted:
-        b = TwistedBenchmark(args)
+    if args.replay:
+        if args.rate:
+            raise Exception("--rate can't be used with --replay.")
+        desc = "{}, replaying {} at {:g}x speed".format(
+            desc, args.replay, args.speed)
+    elif args.rate:
+        desc = "{}, at {:g} requests per second".format(desc, args.rate)
+    elif args.max_lateness is not None:
+        raise Exception("--max-lateness requires --rate or --replay.")
+    if args.poisson and not args.rate:
+        raise Exception("--poisson requires --rate.")
+
+    if args.output == "text":
+        print("Benchmarking {} requests to Divvy at {}:{}, using {}".format(
+            args.count, args.host, args.port, desc))
+
+    engine_class = TwistedBenchmark if args.twisted else ThreadedBenchmark
+    if args.processes > 1:
+        b = MultiProcessBenchmark(args, engine_class)
     else:
-        b = ThreadedBenchmark(args)
-    b.run()
+        b = engine_class(args)
+
+    try:
+        if args.output == "text":
+            b.run()
+        else:
+            b.execute()
+            if args.output == "json":
+                report.write_json(b.summary(), sys.stdout)
+            else:
+                report.write_csv(b.summary(), sys.stdout)
+    finally:
+        if server:
+            server.stop()
+
+    if baseline:
+        regressions = report.compare(baseline, b.summary())
+        # keep machine-readable output clean
+        out = sys.stdout if args.output == "text" else sys.stderr
+        report.print_comparison(baseline, b.summary(), regressions, file=out)
+        if regressions:
+            sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,7 @@
+from divvy.cache import DenialCache
 from divvy.client import DivvyClient
+from divvy.coalescing import CoalescedResponse, Coalescer
+from divvy.connection import Connection, ConnectionPool
 from divvy.protocol import Response
 from divvy.exceptions import (
     DivvyError, ConnectionError, InputError,
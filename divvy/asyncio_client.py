@@ -0,0 +1,310 @@
+import asyncio
+from collections import deque
+import logging
+
+from divvy.batching import WriteBatcher
+from divvy.circuit_breaker import BaseCircuitBreakerClient
+from divvy.coalescing import CoalescedResponse
+from divvy.exceptions import ConnectionError, TimeoutError
+from divvy.instrumentation import Histogram
+from divvy.protocol import Translator
+
+
+log = logging.getLogger(__name__)
+
+
+class DivvyProtocol(asyncio.Protocol):
+    """
+    asyncio handler for network communication with a Divvy server.
+
+    Requests are pipelined: every HIT is written as soon as it is issued, and
+    replies are matched to requests in order, using a FIFO of futures.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.translator = client.translator
+        self.transport = None
+        self.batcher = None
+        self.pending_responses = deque()
+        self._buffer = b''
+
+    @property
+    def connected(self):
+        return self.transport is not None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        client = self.client
+        if client.batch_writes:
+            self.batcher = WriteBatcher(
+                transport.writelines, asyncio.get_running_loop().call_later,
+                client.batch_delay, client.batch_bytes, client.batch_sizes)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.batcher is not None:
+            self.batcher.discard()
+        reason = ConnectionError("Connection lost: {}".format(exc or "closed"))
+        while self.pending_responses:
+            future = self.pending_responses.popleft()
+            if not future.done():
+                future.set_exception(reason)
+        self.client._connection_lost(self)
+
+    def check_rate_limit(self, line, future):
+        """Writes a HIT command and queues the future that will receive the
+        server's reply."""
+        if self.transport is None:
+            # the connection was lost after the caller got hold of it
+            future.set_exception(ConnectionError("Connection lost"))
+            return
+        self.pending_responses.append(future)
+        if self.batcher is not None:
+            self.batcher.write(line)
+        else:
+            self.transport.write(line)
+
+    def data_received(self, data):
+        results, self._buffer = self.translator.parse_replies(
+            self._buffer + data)
+        for result in results:
+            self.reply_received(result)
+
+    def reply_received(self, result):
+        """Delivers a parsed reply, a divvy.Response or the DivvyError raised
+        while parsing it, to the oldest pending request."""
+        if not self.pending_responses:
+            log.error("DivvyClient: unexpected reply %r", result)
+            return
+        future = self.pending_responses.popleft()
+        if future.done():
+            # the caller timed out or went away; the reply is discarded
+            # rather than delivered to the next caller in line
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+class DivvyClient(object):
+    def __init__(self, host='localhost', port=8321, timeout=1.0,
+                 encoding='utf-8', initial_delay=0.1, max_delay=30.0,
+                 factor=2.0, denial_cache=None, batch_writes=False,
+                 batch_delay=0.0, batch_bytes=65536, coalescer=None):
+        """
+        Configures a client that can speak to a Divvy rate limiting server
+        from an asyncio event loop.
+
+        The connection is opened on first use (or by calling connect()), and
+        is automatically re-established, with exponential backoff between
+        initial_delay and max_delay seconds, if it is lost.
+
+        If a divvy.cache.DenialCache is given, checks that are known to be
+        denied until their reset time are answered without a round trip.
+
+        If batch_writes is set, the checks made in the same event loop
+        iteration, or within batch_delay seconds, are written together, as
+        soon as batch_bytes are waiting or at the end of the iteration; see
+        divvy.batching.WriteBatcher. The number of checks in each write is
+        recorded in the batch_sizes Histogram.
+
+        If a divvy.coalescing.Coalescer is given, checks made with
+        coalesce=True share one round trip with any identical check that is
+        already waiting for its reply.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.encoding = encoding
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.denial_cache = denial_cache
+        self.coalescer = coalescer
+        self.translator = Translator(encoding)
+        self.batch_writes = batch_writes
+        self.batch_delay = batch_delay
+        self.batch_bytes = batch_bytes
+        self.batch_sizes = (Histogram(lowest=1, highest=1 << 16)
+                            if batch_writes else None)
+
+        self.protocol = None
+        self.running = True
+        self._connecting = None
+
+    @property
+    def connected(self):
+        return self.protocol is not None and self.protocol.connected
+
+    async def connect(self):
+        """Waits until the client is connected to the server."""
+        await self._get_protocol()
+
+    async def check_rate_limit(self, timeout=None, coalesce=False,
+                               **hit_args):
+        """
+        Perform a check-and-decrement of quota.
+
+        Args:
+             timeout: Seconds to wait for a reply, including any time spent
+                waiting for a connection. Defaults to the client's timeout.
+             coalesce: If the client has a Coalescer, share the reply to an
+                identical check that is already waiting for one, and the
+                timeout of the check that was sent. The reply is then a
+                divvy.coalescing.CoalescedResponse.
+             **hit_args: Zero or more key-value pairs to specify the
+                operation being performed, which will be evaluated by the
+                server against its configuration.
+
+        Returns:
+            divvy.Response with these fields:
+                is_allowed: one of true, false, indicating whether quota
+                    was available.
+                current_credit: number of credit(s) available at the end
+                    of this command.
+                next_reset_seconds: time, in seconds, until credit next
+                    resets.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        line = self.translator.build_hit(**hit_args)
+        if self.denial_cache is not None:
+            response = self.denial_cache.get(line)
+            if response is not None:
+                return response
+        if coalesce and self.coalescer is not None:
+            return await self._check_coalesced(line, timeout)
+        return await self._request(line, timeout)
+
+    async def _check_coalesced(self, line, timeout):
+        coalescer = self.coalescer
+        flight = coalescer.join(line)
+        if flight is None:
+            flight = coalescer.begin(line)
+            task = asyncio.ensure_future(self._request(line, timeout))
+            task.add_done_callback(
+                lambda t: self._flight_landed(line, flight, t))
+        future = asyncio.get_running_loop().create_future()
+        flight.waiters.append(future)
+        return await future
+
+    def _flight_landed(self, line, flight, task):
+        self.coalescer.end(line, flight)
+        for future in flight.waiters:
+            if future.done():
+                continue
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(
+                    CoalescedResponse(task.result(), flight.weight))
+
+    async def _request(self, line, timeout):
+        try:
+            response = await asyncio.wait_for(self._check(line), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                "No reply from server within {} seconds".format(timeout))
+        if self.denial_cache is not None:
+            self.denial_cache.update(line, response)
+        return response
+
+    async def _check(self, line):
+        protocol = await self._get_protocol()
+        future = asyncio.get_running_loop().create_future()
+        protocol.check_rate_limit(line, future)
+        return await future
+
+    async def _get_protocol(self):
+        if not self.running:
+            raise ConnectionError("Client is closed")
+        if self.connected:
+            return self.protocol
+        if self._connecting is None or self._connecting.done():
+            self._connecting = asyncio.ensure_future(self._connect_loop())
+        return await asyncio.shield(self._connecting)
+
+    async def _connect_loop(self):
+        loop = asyncio.get_running_loop()
+        delay = self.initial_delay
+        while True:
+            try:
+                _, protocol = await loop.create_connection(
+                    lambda: DivvyProtocol(self), self.host, self.port)
+            except OSError as e:
+                if not self.running:
+                    raise ConnectionError("Client is closed")
+                log.error("DivvyClient: connection failed %s", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * self.factor, self.max_delay)
+                continue
+            if not self.running:
+                protocol.transport.close()
+                raise ConnectionError("Client is closed")
+            self.protocol = protocol
+            return protocol
+
+    def _connection_lost(self, protocol):
+        if protocol is not self.protocol:
+            return
+        self.protocol = None
+        log.info("DivvyClient: connection lost")
+        if self.running:
+            self._connecting = asyncio.ensure_future(self._connect_loop())
+            # retrieve failures so they are not reported as unhandled
+            self._connecting.add_done_callback(
+                lambda f: f.cancelled() or f.exception())
+
+    def close(self):
+        """Closes the connection and stops reconnecting."""
+        self.running = False
+        if self._connecting is not None and not self._connecting.done():
+            self._connecting.cancel()
+        if self.protocol is not None and self.protocol.transport is not None:
+            self.protocol.transport.close()
+
+
+class CircuitBreakerClient(BaseCircuitBreakerClient):
+    """
+    Wraps a DivvyClient with a divvy.circuit_breaker.CircuitBreaker.
+
+    Checks that fail with ConnectionError or TimeoutError count as failures
+    and are answered by the breaker's policy instead of raising. While the
+    breaker is open, checks are answered by the policy immediately. Other
+    errors are raised as usual.
+
+    The background probe waits up to probe_timeout seconds for the client to
+    connect.
+    """
+
+    def __init__(self, client, breaker=None, probe_timeout=1.0):
+        super().__init__(client, breaker)
+        self.probe_timeout = probe_timeout
+
+    async def check_rate_limit(self, timeout=None, **hit_args):
+        response = self._admit(hit_args)
+        if response is not None:
+            return response
+        try:
+            response = await self.client.check_rate_limit(timeout, **hit_args)
+        except self.FAILURES as e:
+            return self._failed(e, hit_args)
+        return self._succeeded(response)
+
+    def _start_probe(self):
+        asyncio.ensure_future(self._probe())
+
+    async def _probe(self):
+        try:
+            await asyncio.wait_for(self.client.connect(), self.probe_timeout)
+        except Exception:
+            self._probed(False)
+        else:
+            self._probed(True)
+
+
+__all__ = ["CircuitBreakerClient", "DivvyClient"]
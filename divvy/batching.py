@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+
+
+class WriteBatcher(object):
+    """Coalesces the HIT commands written to one connection.
+
+    Commands written in the same event loop tick are buffered, and written
+    together with one write_sequence() call by a callback that call_later()
+    schedules delay seconds later; a delay of 0 writes them at the end of
+    the tick. Once max_bytes are buffered, they are written straight away.
+
+    write_sequence is a transport's writeSequence() (Twisted) or writelines()
+    (asyncio), and call_later the matching reactor.callLater() or
+    loop.call_later(). If sizes, a divvy.instrumentation.Histogram, is given,
+    the number of commands in each write is recorded in it.
+    """
+
+    def __init__(self, write_sequence, call_later, delay=0.0,
+                 max_bytes=65536, sizes=None):
+        self.write_sequence = write_sequence
+        self.call_later = call_later
+        self.delay = delay
+        self.max_bytes = max_bytes
+        self.sizes = sizes
+        self._lines = []
+        self._bytes = 0
+        self._call = None
+
+    def write(self, line):
+        self._lines.append(line)
+        self._bytes += len(line)
+        self._buffered()
+
+    def write_lines(self, lines):
+        self._lines.extend(lines)
+        self._bytes += sum(len(line) for line in lines)
+        self._buffered()
+
+    def _buffered(self):
+        if self._bytes >= self.max_bytes:
+            self.flush()
+        elif self._call is None:
+            self._call = self.call_later(self.delay, self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self._call = None
+        self.flush()
+
+    def flush(self):
+        """Writes the buffered commands now."""
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+        if not self._lines:
+            return
+        lines, self._lines = self._lines, []
+        self._bytes = 0
+        if self.sizes is not None:
+            self.sizes.record(len(lines))
+        self.write_sequence(lines)
+
+    def discard(self):
+        """Drops the buffered commands, when the connection is lost."""
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+        self._lines = []
+        self._bytes = 0
@@ -6,19 +6,52 @@ import sys
 import time
 from threading import Lock
 
+from divvy.benchmark.workload import Workload
+from divvy.instrumentation import Histogram
+from divvy.recording import read_trace
+
 
 Jiffies = namedtuple("Jiffies", ["user", "system"])
 
 
 class Benchmark(object):
+    # identifies the client implementation in machine-readable output
+    name = None
+    # scheduled requests sent this many seconds after their intended time
+    # are counted as late
+    LATE_THRESHOLD = 0.001
+    # percentiles of response time included in summary()
+    SUMMARY_PERCENTILES = (50, 66, 75, 80, 90, 95, 98, 99, 99.9, 100)
+
     def __init__(self, args):
         self.host = args.host
         self.port = args.port
         self.timeout = args.socket_timeout
         self.time_limit = args.time_limit
 
+        # Open-loop mode: requests are sent on a timetable of `rate` per
+        # second, rather than as soon as the previous request finishes.
+        self.rate = getattr(args, 'rate', None)
+        self.poisson = getattr(args, 'poisson', False)
+        self.max_lateness = getattr(args, 'max_lateness', None)
+        self.next_send_time = None
+        self.late_count = 0
+        self.dropped_count = 0
+
+        # Replay mode: requests are sent with the arguments and timing of a
+        # recorded trace, sped up by a factor of `speed`.
+        self.replay = getattr(args, 'replay', None)
+        self.speed = getattr(args, 'speed', 1.0)
+        self.trace = None
+        if self.replay:
+            shard, shards = getattr(args, 'replay_shard', (0, 1))
+            self.trace = read_trace(self.replay, shard=shard, shards=shards)
+
         self.start_time = None
         self.end_time = None
+        self.start_jiffies = None
+        self.end_jiffies = None
+        self.verbose = True
 
         self.lock = Lock()
 
@@ -27,7 +60,8 @@ class Benchmark(object):
         self.running_count = 0
         self.finished_count = 0
         self.error_count = 0
-        self.response_times = []
+        # response times, in milliseconds, from 1 microsecond to 1 hour
+        self.response_times = Histogram(lowest=0.001, highest=3600000.0)
 
         if args.count > 10:
             self.update_interval = int(round(args.count / 10.0))
@@ -36,13 +70,18 @@ class Benchmark(object):
             self.update_interval = args.count + 1
             self.next_update = args.count + 1
 
-        # Random IP addresses to use with Divvy's example config.ini
-
-        def _random_ip():
-            return '.'.join([str(random.randrange(256)) for _ in range(4)])
-
-        unique_ips = int(args.count / 10)
-        self.ip_addresses = [_random_ip() for _ in range(unique_ips)]
+        # By default, random IP addresses to use with Divvy's example
+        # config.ini, one for every ten requests
+        key_count = getattr(args, 'keys', None) or int(args.count / 10)
+        self.workload = Workload(
+            key_count,
+            distribution=getattr(args, 'distribution', 'uniform'),
+            zipf_exponent=getattr(args, 'zipf_exponent', 1.0),
+            hot_keys=getattr(args, 'hot_keys', 0.01),
+            hot_traffic=getattr(args, 'hot_traffic', 0.9),
+            shapes=getattr(args, 'shapes', ('benchmark',)),
+            seed=getattr(args, 'seed', None),
+            stream=getattr(args, 'stream', 0))
 
     def run(self):
         self.start()
@@ -50,6 +89,33 @@ class Benchmark(object):
         self.print_update()
         self.finish()
 
+    def execute(self):
+        """Runs the benchmark to completion without printing anything, for
+        example in a worker process. Results are available from results()."""
+        self.verbose = False
+        self.start()
+        self._run()
+        self.stop()
+
+    def results(self):
+        """Returns the outcome of the benchmark as a dict of picklable
+        values."""
+        jiffies = None
+        if self.start_jiffies and self.end_jiffies:
+            jiffies = Jiffies(
+                user=self.end_jiffies.user - self.start_jiffies.user,
+                system=self.end_jiffies.system - self.start_jiffies.system)
+        return {
+            'finished_count': self.finished_count,
+            'error_count': self.error_count,
+            'response_times': self.response_times.to_dict(),
+            'jiffies': jiffies,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'late_count': self.late_count,
+            'dropped_count': self.dropped_count,
+        }
+
     def abort(self):
         """Ends the benchmark early, by telling the worker threads that there
         aren't any more requests to process."""
@@ -70,12 +136,58 @@ class Benchmark(object):
         except ValueError as e:
             return None
 
+    @property
+    def open_loop(self):
+        """True if requests are sent on a timetable, by rate or replay,
+        rather than as soon as the previous request finishes."""
+        return bool(self.rate or self.trace is not None)
+
+    def schedule_send(self):
+        """In open-loop mode, returns the time at which the next request is
+        intended to be sent and its arguments, as a tuple, and advances the
+        timetable. Arrivals are evenly spaced, exponentially distributed if
+        poisson is set, or follow the trace being replayed. Returns None,
+        and stops the benchmark, if the trace has run out. The caller must
+        hold self.lock."""
+        if self.trace is not None:
+            try:
+                offset, params = next(self.trace)
+            except StopIteration:
+                self.pending_count = 0
+                return None
+            return self.start_time + offset / self.speed, params
+        if self.next_send_time is None:
+            self.next_send_time = self.start_time
+        intended = self.next_send_time
+        if self.poisson:
+            self.next_send_time += random.expovariate(self.rate)
+        else:
+            self.next_send_time += 1.0 / self.rate
+        return intended, self.rate_limit_params()
+
+    def begin_scheduled_send(self, intended):
+        """Called when a scheduled request is about to be sent. Returns
+        False, and counts the request as dropped, if it is more than
+        max_lateness seconds behind its intended time; otherwise counts it as
+        late if it is more than LATE_THRESHOLD seconds behind, and returns
+        True."""
+        lateness = time.time() - intended
+        with self.lock:
+            if self.max_lateness is not None and \
+                    lateness > self.max_lateness:
+                self.dropped_count += 1
+                return False
+            if lateness > self.LATE_THRESHOLD:
+                self.late_count += 1
+        return True
+
     def rate_limit_params(self):
-        client_ip = random.choice(self.ip_addresses)
-        return {"type": "benchmark", "ip": client_ip}
+        return self.workload.params()
 
     def print_update(self):
         """When appropriate, prints a status update for the user."""
+        if not self.verbose:
+            return
         with self.lock:
             f = self.finished_count
             if f >= self.next_update:
@@ -88,23 +200,9 @@ class Benchmark(object):
             return
         elapsed_time = self.end_time - self.start_time
         rps = float((self.finished_count + self.error_count) / elapsed_time)
-        mean = sum(self.response_times) / float(len(self.response_times))
-        ss = sum((x - mean) ** 2 for x in self.response_times)
-        stddev = (ss / len(self.response_times)) ** 0.5
-
-        if self.start_jiffies and self.end_jiffies:
-            jiffy_hz = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
-            jiffies = Jiffies(
-                user=self.end_jiffies.user - self.start_jiffies.user,
-                system=self.end_jiffies.system - self.start_jiffies.system
-            )
-            cpu_pct = Jiffies(
-                user=float(jiffies.user) / jiffy_hz / elapsed_time * 100.0,
-                system=float(jiffies.system) / jiffy_hz / elapsed_time * 100.0
-            )
-            show_cpu = True
-        else:
-            show_cpu = False
+        mean = self.response_times.mean
+        stddev = self.response_times.stddev
+        cpu_pct = self.cpu_percent()
 
         print("")
         self._print_summary_line("Server hostname", self.host)
@@ -116,26 +214,102 @@ class Benchmark(object):
         self._print_summary_line("Errors", self.error_count)
         self._print_summary_line("Requests per second",
                                  "{:.3f} per second (mean)".format(rps))
+        if self.replay:
+            self._print_summary_line(
+                "Replayed trace", "{} at {:g}x speed".format(
+                    self.replay, self.speed))
+        else:
+            self._print_summary_line("Workload", self.workload.describe())
+        if self.rate:
+            self._print_summary_line(
+                "Target rate", "{:.3f} per second ({})".format(
+                    self.rate, "Poisson" if self.poisson else "fixed"))
+        if self.open_loop:
+            self._print_summary_line("Late sends", self.late_count)
+            self._print_summary_line("Dropped sends", self.dropped_count)
         self._print_summary_line("Time per request",
                                  "{:.3f} ms (mean)".format(mean))
         self._print_summary_line("Standard deviation",
                                  "{:.3f} ms".format(stddev))
-        if show_cpu:
+        if cpu_pct:
             self._print_summary_line("User CPU consumed",
                                      "{:.1f}%".format(cpu_pct.user))
             self._print_summary_line("System CPU consumed",
                                      "{:.1f}%".format(cpu_pct.system))
 
+    def cpu_percent(self):
+        """Returns the user and system CPU time consumed during the test, as
+        percentages of its elapsed time, or None if that isn't known."""
+        if not (self.start_jiffies and self.end_jiffies):
+            return None
+        elapsed_time = self.end_time - self.start_time
+        jiffy_hz = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+        jiffies = Jiffies(
+            user=self.end_jiffies.user - self.start_jiffies.user,
+            system=self.end_jiffies.system - self.start_jiffies.system
+        )
+        return Jiffies(
+            user=float(jiffies.user) / jiffy_hz / elapsed_time * 100.0,
+            system=float(jiffies.system) / jiffy_hz / elapsed_time * 100.0
+        )
+
+    def config(self):
+        """Returns a dict describing how the benchmark was run. Subclasses
+        may extend it."""
+        return {
+            'implementation': self.name,
+            'host': self.host,
+            'port': self.port,
+            'count': self.desired_count,
+            'time_limit': self.time_limit,
+            'socket_timeout': self.timeout,
+            'rate': self.rate,
+            'poisson': self.poisson,
+            'max_lateness': self.max_lateness,
+            'workload': None if self.replay else self.workload.config(),
+            'replay': self.replay,
+            'speed': self.speed if self.replay else None,
+        }
+
+    def summary(self):
+        """Returns everything that print_summary() and print_histogram()
+        show, as a dict of JSON-friendly values. Times are in milliseconds,
+        except elapsed_time, which is in seconds. response_times holds the
+        whole latency histogram, so that later runs can be compared against
+        this one."""
+        elapsed_time = self.end_time - self.start_time
+        total = self.finished_count + self.error_count
+        cpu_pct = self.cpu_percent()
+        times = self.response_times
+        return {
+            'config': self.config(),
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'elapsed_time': elapsed_time,
+            'finished_count': self.finished_count,
+            'error_count': self.error_count,
+            'late_count': self.late_count,
+            'dropped_count': self.dropped_count,
+            'requests_per_second':
+                total / elapsed_time if elapsed_time > 0 else None,
+            'mean': times.mean,
+            'stddev': times.stddev,
+            'min': times.min,
+            'max': times.max,
+            'percentiles': dict((str(pct), times.percentile(pct))
+                                for pct in self.SUMMARY_PERCENTILES),
+            'user_cpu_percent': cpu_pct.user if cpu_pct else None,
+            'system_cpu_percent': cpu_pct.system if cpu_pct else None,
+            'response_times': times.to_dict(),
+        }
+
     def print_histogram(self):
         """Prints data about response times at various percentiles."""
         def _print_percentile(pct, suffix=""):
-            pos = int(round((pct / 100.0) * len(self.response_times))) - 1
-            time_ms = "{:.3f}".format(self.response_times[pos])
+            time_ms = "{:.3f}".format(self.response_times.percentile(pct))
             print("{}%{} ms {}".format(
                 str(pct).rjust(3), time_ms.rjust(10), suffix))
 
-        self.response_times.sort()
-
         print("")
         print("Percentage of requests served within a certain time:")
         _print_percentile(50)
@@ -162,14 +336,19 @@ class Benchmark(object):
         """Completes execution of the benchmark: Allows all work to finish, and
         prints a summary of results. Subclasses should not override this
         method, but instead implement _finish()."""
-        self._finish()
-        self.end_time = time.time()
-        self.end_jiffies = self.get_cpu_jiffies()
+        self.stop()
         if self.finished_count + self.error_count > 0:
             self.print_summary()
         if self.finished_count + self.error_count > 1:
             self.print_histogram()
 
+    def stop(self):
+        """Allows all work to finish, and records the end time and CPU
+        usage."""
+        self._finish()
+        self.end_time = time.time()
+        self.end_jiffies = self.get_cpu_jiffies()
+
     def _run(self):
         """Subclasses must implement this method, which actually executes the
         benchmark."""
@@ -0,0 +1,140 @@
+from __future__ import print_function
+import copy
+import multiprocessing
+import sys
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from divvy.benchmark import Benchmark, Jiffies
+from divvy.instrumentation import Histogram
+
+
+def _run_worker(engine_class, args, results):
+    """Runs one engine in a worker process and reports back its results."""
+    b = engine_class(args)
+    b.execute()
+    results.put(b.results())
+
+
+class MultiProcessBenchmark(Benchmark):
+    """Runs several copies of another benchmark engine, each in its own
+    process, so that the client isn't limited to one CPU core. The request
+    budget (and in open-loop mode, the target rate) is split evenly between
+    the processes, and each observes the time limit on its own. Counts,
+    latencies and CPU usage are merged into a single report."""
+
+    def __init__(self, args, engine_class):
+        super(MultiProcessBenchmark, self).__init__(args)
+        self.engine_class = engine_class
+        self.process_count = args.processes
+        self.concurrency = args.threads
+        self.args = args
+        # Fresh interpreters, rather than forks, so that no reactor or socket
+        # state is shared with the parent.
+        self.context = multiprocessing.get_context('spawn')
+        self.result_queue = self.context.Queue()
+        self.processes = []
+        self.worker_jiffies = Jiffies(user=0, system=0)
+        self.worker_times = []
+
+    def get_cpu_jiffies(self):
+        """Counts the CPU time consumed by the worker processes while they
+        ran their benchmarks, as reported so far."""
+        return self.worker_jiffies
+
+    def _start(self):
+        count = self.desired_count
+        for i in range(self.process_count):
+            args = copy.copy(self.args)
+            args.count = count // self.process_count + \
+                (1 if i < count % self.process_count else 0)
+            args.processes = 1
+            # every process uses the same keys, in its own order
+            args.stream = i
+            if args.rate:
+                # each process sends its share of the target rate
+                args.rate = float(args.rate) * args.count / count
+            if args.replay:
+                # each process replays every process_count'th check
+                args.replay_shard = (i, self.process_count)
+            if args.count < 1:
+                continue
+            p = self.context.Process(
+                target=_run_worker,
+                args=(self.engine_class, args, self.result_queue))
+            p.start()
+            self.processes.append(p)
+
+    def _run(self):
+        collected = 0
+        try:
+            while collected < len(self.processes):
+                try:
+                    results = self.result_queue.get(timeout=0.10)
+                except Empty:
+                    if not any(p.is_alive() for p in self.processes):
+                        # a worker died without reporting
+                        break
+                    continue
+                self._merge(results)
+                collected += 1
+        except KeyboardInterrupt:
+            self.abort()
+        if collected < len(self.processes):
+            # on stderr, so as not to corrupt --output json
+            print("{} of {} worker processes did not report results".format(
+                len(self.processes) - collected, len(self.processes)),
+                file=sys.stderr)
+
+    def _merge(self, results):
+        with self.lock:
+            self.finished_count += results['finished_count']
+            self.error_count += results['error_count']
+            self.late_count += results['late_count']
+            self.dropped_count += results['dropped_count']
+            self.pending_count -= \
+                results['finished_count'] + results['error_count']
+            self.response_times.merge(
+                Histogram.from_dict(results['response_times']))
+            self.worker_times.append(
+                (results['start_time'], results['end_time']))
+            jiffies = results['jiffies']
+            if jiffies:
+                self.worker_jiffies = Jiffies(
+                    user=self.worker_jiffies.user + jiffies.user,
+                    system=self.worker_jiffies.system + jiffies.system)
+        self.print_update()
+
+    def abort(self):
+        super(MultiProcessBenchmark, self).abort()
+        for p in self.processes:
+            p.terminate()
+
+    def stop(self):
+        """Times the test from the first worker's start to the last
+        worker's end, leaving out the time spent starting processes."""
+        super(MultiProcessBenchmark, self).stop()
+        if self.worker_times:
+            self.start_time = min(start for start, _ in self.worker_times)
+            self.end_time = max(end for _, end in self.worker_times)
+
+    def _finish(self):
+        for p in self.processes:
+            p.join()
+
+    def config(self):
+        config = super(MultiProcessBenchmark, self).config()
+        config.update(implementation=self.engine_class.name,
+                      processes=self.process_count,
+                      concurrency=self.concurrency)
+        return config
+
+    def _print_summary(self):
+        self._print_summary_line(
+            "Implementation",
+            "Multi-process ({})".format(self.engine_class.__name__))
+        self._print_summary_line("Processes", self.process_count)
+        self._print_summary_line("Concurrency level",
+                                 "{} per process".format(self.concurrency))
@@ -0,0 +1,152 @@
+from __future__ import print_function
+from collections import namedtuple
+import csv
+import json
+import math
+import sys
+
+from divvy.instrumentation import Histogram
+
+
+# A result that got worse. metric names what was compared, such as
+# "requests_per_second" or "p99"; change is relative, e.g. 0.1 for 10% worse.
+Regression = namedtuple(
+    "Regression", ["metric", "baseline", "current", "change"])
+
+
+def write_json(summary, f):
+    """Writes a Benchmark.summary() to the file f as JSON."""
+    json.dump(summary, f, indent=2, sort_keys=True)
+    f.write("\n")
+
+
+def read_json(f):
+    return json.load(f)
+
+
+def flatten(summary):
+    """Returns a Benchmark.summary() as a flat, ordered list of (name,
+    value) pairs, leaving out the response time histogram. Config entries
+    are prefixed with "config_" (and nested ones with their parent's name
+    too), and percentiles are named like "p99"."""
+    rows = []
+
+    def _add_config(prefix, config):
+        for k in sorted(config):
+            value = config[k]
+            if isinstance(value, dict):
+                _add_config(prefix + k + "_", value)
+            elif isinstance(value, list):
+                rows.append((prefix + k, " ".join(str(v) for v in value)))
+            else:
+                rows.append((prefix + k, value))
+    _add_config("config_", summary['config'])
+    for k in sorted(summary):
+        if k in ('config', 'percentiles', 'response_times'):
+            continue
+        rows.append((k, summary[k]))
+    for pct in sorted(summary['percentiles'], key=float):
+        rows.append(("p" + pct, summary['percentiles'][pct]))
+    return rows
+
+
+def write_csv(summary, f):
+    """Writes a Benchmark.summary() to the file f as a CSV header row and a
+    single row of values, so that the output of several runs can be
+    concatenated (without their headers) into one table."""
+    rows = flatten(summary)
+    writer = csv.writer(f)
+    writer.writerow([name for name, _ in rows])
+    writer.writerow(["" if value is None else value for _, value in rows])
+
+
+def _percentile_bounds(histogram, pct, z):
+    """Returns a confidence interval for the pct'th percentile of the
+    distribution the histogram was sampled from, using the normal
+    approximation to the binomial distribution of the number of samples
+    below it."""
+    n = histogram.count
+    p = pct / 100.0
+    spread = z * math.sqrt(n * p * (1 - p))
+    lower = max(0.0, (n * p - spread) / n * 100.0)
+    upper = min(100.0, (n * p + spread) / n * 100.0)
+    return histogram.percentile(lower), histogram.percentile(upper)
+
+
+def compare(baseline, current, threshold=0.05, z=2.58,
+            percentiles=(50, 99, 99.9)):
+    """Compares two Benchmark.summary() dicts, and returns a list of
+    Regressions: metrics in current that are worse than in baseline by more
+    than the relative threshold, and by more than chance would explain at a
+    confidence level given by z (2.58 for 99%).
+
+    Throughput is compared treating each run's completed requests as a
+    Poisson count. Response time percentiles are compared by their
+    confidence intervals, which are estimated from each run's histogram; an
+    increase counts only if the intervals don't overlap. Percentiles are
+    skipped where either run has too few samples to estimate them.
+    """
+    regressions = []
+
+    def _requests(summary):
+        return summary['finished_count'] + summary['error_count']
+
+    base_rps = baseline['requests_per_second']
+    cur_rps = current['requests_per_second']
+    if base_rps and cur_rps is not None:
+        change = (base_rps - cur_rps) / base_rps
+        # standard error of a rate estimated from a Poisson count
+        stderr = math.sqrt(
+            _requests(baseline) / baseline['elapsed_time'] ** 2 +
+            _requests(current) / current['elapsed_time'] ** 2)
+        if change > threshold and base_rps - cur_rps > z * stderr:
+            regressions.append(Regression(
+                "requests_per_second", base_rps, cur_rps, change))
+
+    base_times = Histogram.from_dict(baseline['response_times'])
+    cur_times = Histogram.from_dict(current['response_times'])
+    for pct in percentiles:
+        # the interval needs at least a few samples beyond the percentile
+        min_count = 10.0 / (1 - pct / 100.0)
+        if base_times.count < min_count or cur_times.count < min_count:
+            continue
+        base_value = base_times.percentile(pct)
+        cur_value = cur_times.percentile(pct)
+        change = (cur_value - base_value) / base_value
+        _, base_upper = _percentile_bounds(base_times, pct, z)
+        cur_lower, _ = _percentile_bounds(cur_times, pct, z)
+        if change > threshold and cur_lower > base_upper:
+            regressions.append(Regression(
+                "p{:g}".format(pct), base_value, cur_value, change))
+    return regressions
+
+
+# config entries that say where the server was, not how it was loaded; with
+# --fake-server the port differs on every run
+_NOT_COMPARED = frozenset(['host', 'port'])
+
+
+def config_differences(baseline, current):
+    """Returns the names of config entries that differ between two
+    summaries, which may make their comparison meaningless."""
+    base, cur = baseline['config'], current['config']
+    return sorted(k for k in set(base) | set(cur)
+                  if k not in _NOT_COMPARED and base.get(k) != cur.get(k))
+
+
+def print_comparison(baseline, current, regressions, file=None):
+    """Prints the outcome of compare() to file, or standard output."""
+    file = file or sys.stdout
+    print("", file=file)
+    differences = config_differences(baseline, current)
+    if differences:
+        print("Warning: baseline was run with different settings: {}".format(
+            ", ".join(differences)), file=file)
+    if not regressions:
+        print("No regressions from baseline", file=file)
+        return
+    print("Regressions from baseline:", file=file)
+    for r in regressions:
+        print("{}{:.3f} -> {:.3f} ({:.1f}% worse)".format(
+            (r.metric + ":").ljust(24), r.baseline, r.current,
+            r.change * 100.0), file=file)
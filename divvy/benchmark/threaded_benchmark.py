@@ -4,15 +4,30 @@ from threading import Thread, Timer
 
 from divvy import DivvyClient, Response
 from divvy.benchmark import Benchmark
+from divvy.connection import ConnectionPool
+from divvy.resolver import Resolver
 
 
 class ThreadedBenchmark(Benchmark):
+    name = 'threaded'
+
     def __init__(self, args):
         super(ThreadedBenchmark, self).__init__(args)
         self.reconnect_rate = args.reconnect_rate
         self.thread_count = args.threads
         self.threads = []
         self.timer = None
+        # All threads share one client, and one warm pool of connections,
+        # unless each thread needs to cycle its own connection.
+        self.client = None
+        # connections share DNS lookups
+        self.resolver = Resolver()
+        if not self.reconnect_rate:
+            pool = ConnectionPool(max_connections=self.thread_count,
+                                  host=self.host, port=self.port,
+                                  socket_timeout=self.timeout,
+                                  resolver=self.resolver)
+            self.client = DivvyClient(connection_pool=pool)
 
     def _start(self):
         for _ in range(self.thread_count):
@@ -40,10 +55,20 @@ class ThreadedBenchmark(Benchmark):
             self.timer.cancel()
         for t in self.threads:
             t.join()
+        if self.client:
+            self.client.disconnect()
+
+    def config(self):
+        config = super(ThreadedBenchmark, self).config()
+        config.update(concurrency=self.thread_count,
+                      reconnect_rate=self.reconnect_rate)
+        return config
 
     def _print_summary(self):
         self._print_summary_line("Implementation", "Multi-threaded")
         self._print_summary_line("Concurrency level", self.thread_count)
+        if self.open_loop:
+            self._print_summary_line("Load generation", "Open loop")
         self._print_summary_line(
             "Auto reconnect rate",
             "N/A" if self.reconnect_rate is None
@@ -53,7 +78,9 @@ class ThreadedBenchmark(Benchmark):
         """Execute the benchmark in a single thread. Coordinates with other
         threads, if any exist, so that the correct number of requests are
         issued."""
-        client = DivvyClient(self.host, self.port, socket_timeout=self.timeout)
+        client = self.client or DivvyClient(self.host, self.port,
+                                            socket_timeout=self.timeout,
+                                            resolver=self.resolver)
         conn_requests = 0
         while True:
             with self.lock:
@@ -61,10 +88,31 @@ class ThreadedBenchmark(Benchmark):
                     break
                 self.pending_count -= 1
                 self.running_count += 1
-            start_time = time.time()
+                scheduled = None
+                if self.open_loop:
+                    scheduled = self.schedule_send()
+                    if scheduled is None:
+                        self.running_count -= 1
+                        break
+            if scheduled is not None:
+                intended, params = scheduled
+                # Open loop: wait for this request's slot in the timetable,
+                # and time it from then, so that any queueing behind slow
+                # requests counts against its latency.
+                delay = intended - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                if not self.begin_scheduled_send(intended):
+                    with self.lock:
+                        self.running_count -= 1
+                    continue
+                start_time = intended
+            else:
+                params = self.rate_limit_params()
+                start_time = time.time()
             success = True
             try:
-                result = client.check_rate_limit(**self.rate_limit_params())
+                result = client.check_rate_limit(**params)
             except Exception:
                 success = False
             end_time = time.time()
@@ -77,9 +125,12 @@ class ThreadedBenchmark(Benchmark):
                     self.finished_count += 1
                 else:
                     self.error_count += 1
-                self.response_times.append((end_time - start_time) * 1000.0)
+                self.response_times.record((end_time - start_time) * 1000.0)
             if self.reconnect_rate and conn_requests > self.reconnect_rate:
-                client.connection.disconnect()
+                client.disconnect()
                 client = DivvyClient(self.host, self.port,
-                                     socket_timeout=self.timeout)
-        client.connection.disconnect()
+                                     socket_timeout=self.timeout,
+                                     resolver=self.resolver)
+                conn_requests = 0
+        if client is not self.client:
+            client.disconnect()
@@ -11,15 +11,23 @@ from divvy.twisted_client import DivvyClient
 
 
 class TwistedBenchmark(Benchmark):
+    name = 'twisted'
+
     def __init__(self, args):
         super(TwistedBenchmark, self).__init__(args)
         self.connection_count = args.threads
+        self.batch_writes = getattr(args, 'batch_writes', False)
         self.client = DivvyClient(args.host, args.port,
-                                  timeout=args.socket_timeout)
+                                  timeout=args.socket_timeout,
+                                  connections=self.connection_count,
+                                  batch_writes=self.batch_writes)
 
     def _start(self):
-        for _ in range(self.connection_count):
-            self._makeRequest()
+        if self.open_loop:
+            self._scheduleRequest()
+        else:
+            for _ in range(self.connection_count):
+                self._makeRequest()
 
         if self.time_limit:
             deferLater(reactor, self.time_limit, self.abort)
@@ -48,9 +56,35 @@ class TwistedBenchmark(Benchmark):
         d = self.client.check_rate_limit(**self.rate_limit_params())
         d.addBoth(self._handleResponse, start_time=start_time)
 
+    def _scheduleRequest(self):
+        """Open loop: arranges for the next request in the timetable to be
+        sent at its intended time, regardless of outstanding responses."""
+        with self.lock:
+            if self.pending_count <= 0:
+                return
+            self.pending_count -= 1
+            self.running_count += 1
+            scheduled = self.schedule_send()
+            if scheduled is None:
+                self.running_count -= 1
+                return
+        intended, params = scheduled
+        reactor.callLater(max(0, intended - time.time()),
+                          self._makeScheduledRequest, intended, params)
+
+    def _makeScheduledRequest(self, intended, params):
+        self._scheduleRequest()
+        if not self.begin_scheduled_send(intended):
+            with self.lock:
+                self.running_count -= 1
+            return
+        d = self.client.check_rate_limit(**params)
+        # latency is measured from the intended send time
+        d.addBoth(self._handleResponse, start_time=intended)
+
     def _handleResponse(self, response, start_time):
         end_time = time.time()
-        self.response_times.append((end_time - start_time) * 1000.0)
+        self.response_times.record((end_time - start_time) * 1000.0)
         success = isinstance(response, Response)
         with self.lock:
             self.running_count -= 1
@@ -58,7 +92,7 @@ class TwistedBenchmark(Benchmark):
                 self.finished_count += 1
             else:
                 self.error_count += 1
-            make_another = self.pending_count >= 1
+            make_another = self.pending_count >= 1 and not self.open_loop
         if make_another:
             self._makeRequest()
 
@@ -66,6 +100,19 @@ class TwistedBenchmark(Benchmark):
         if not reactor._stopped:  # pylint: disable=no-member
             reactor.stop()  # pylint: disable=no-member
 
+    def config(self):
+        config = super(TwistedBenchmark, self).config()
+        config.update(concurrency=self.connection_count,
+                      batch_writes=self.batch_writes)
+        return config
+
     def _print_summary(self):
         self._print_summary_line("Implementation", "Twisted")
         self._print_summary_line("Concurrency level", self.connection_count)
+        if self.open_loop:
+            self._print_summary_line("Load generation", "Open loop")
+        sizes = self.client.batch_sizes
+        if sizes is not None and sizes.count:
+            self._print_summary_line(
+                "Requests per write",
+                "{:.1f} (mean), {:.0f} (max)".format(sizes.mean, sizes.max))
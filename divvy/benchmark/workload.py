@@ -0,0 +1,127 @@
+from array import array
+from bisect import bisect
+import itertools
+import random
+import socket
+import struct
+
+
+# HIT argument shapes that the benchmark can send. Each maps argument names
+# to templates, which are filled in with a key's IP address and numeric ID.
+SHAPES = {
+    # matches the benchmark stanza for Divvy's config.ini in README.md
+    'benchmark': {'type': 'benchmark', 'ip': '{ip}'},
+    'login': {'method': 'POST', 'path': '/login', 'ip': '{ip}'},
+    'api': {'method': 'GET', 'path': '/api/v1/items', 'user': 'user{id}'},
+    'wide': {'method': 'GET', 'path': '/search', 'ip': '{ip}',
+             'user': 'user{id}', 'country': 'US', 'plan': 'free'},
+}
+
+DISTRIBUTIONS = ('uniform', 'zipf', 'hotspot')
+
+
+_IPV4 = struct.Struct('!I')
+
+
+def _ip(n):
+    return socket.inet_ntoa(_IPV4.pack(n))
+
+
+# an odd multiplier, so that key * _SPREAD + offset is a bijection of the
+# 32-bit integers: every key gets its own IP address, and none are stored
+_SPREAD = 2654435761
+
+
+class Workload(object):
+    """Generates the HIT arguments for benchmark requests.
+
+    There are key_count distinct keys, up to 2 ** 32, each identified by an
+    IP address and ID, which are chosen with the given distribution:
+
+    - uniform: every key is equally likely.
+    - zipf: the key of rank r is chosen with probability proportional to
+      1 / r ** zipf_exponent, so a few keys get most of the traffic.
+    - hotspot: a hot_keys fraction of the keys gets a hot_traffic fraction
+      of the requests, uniformly, and the other keys share the rest.
+
+    Each request takes one of the named shapes, in turn. Keys are drawn as
+    requests are made, so every key can be chosen however many there are;
+    only zipf keeps any state per key, a table of 8 bytes for each. The same
+    seed gives the same keys, so benchmarks in several processes share
+    them, but pass each process its own stream number to vary the order of
+    requests.
+    """
+
+    def __init__(self, key_count, distribution='uniform', zipf_exponent=1.0,
+                 hot_keys=0.01, hot_traffic=0.9, shapes=('benchmark',),
+                 seed=None, stream=0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError("Unknown distribution: {}".format(distribution))
+        for shape in shapes:
+            if shape not in SHAPES:
+                raise ValueError("Unknown shape: {}".format(shape))
+        if key_count > 1 << 32:
+            raise ValueError("At most 2 ** 32 keys are supported")
+        key_count = max(1, key_count)
+        self.key_count = key_count
+        self.distribution = distribution
+        self.zipf_exponent = zipf_exponent
+        self.hot_keys = hot_keys
+        self.hot_traffic = hot_traffic
+        self.shapes = tuple(shapes)
+
+        self._ip_offset = random.Random(seed).randrange(1 << 32)
+        self._rng = random.Random("{}-{}".format(seed, stream))
+        self._templates = [SHAPES[shape] for shape in self.shapes]
+        self._count = itertools.count()
+        self._hot = max(1, min(key_count, int(round(key_count * hot_keys))))
+        if distribution == 'zipf':
+            self._cumulative = array('d', itertools.accumulate(
+                1.0 / (rank ** zipf_exponent)
+                for rank in range(1, key_count + 1)))
+
+    def _index(self):
+        """Returns a key index, chosen with the distribution."""
+        random = self._rng.random
+        n = self.key_count
+        if self.distribution == 'uniform':
+            return int(random() * n)
+        if self.distribution == 'hotspot':
+            hot = self._hot
+            if hot == n or random() < self.hot_traffic:
+                return int(random() * hot)
+            return hot + int(random() * (n - hot))
+        cumulative = self._cumulative
+        return min(bisect(cumulative, random() * cumulative[-1]), n - 1)
+
+    def params(self):
+        """Returns the HIT arguments for the next request. Safe to call from
+        several threads."""
+        i = self._index()
+        template = self._templates[next(self._count) % len(self._templates)]
+        ip = _ip((i * _SPREAD + self._ip_offset) & 0xffffffff)
+        return {k: v.format(ip=ip, id=i) for k, v in template.items()}
+
+    def config(self):
+        config = {
+            'keys': self.key_count,
+            'distribution': self.distribution,
+            'shapes': list(self.shapes),
+        }
+        if self.distribution == 'zipf':
+            config['zipf_exponent'] = self.zipf_exponent
+        elif self.distribution == 'hotspot':
+            config.update(hot_keys=self.hot_keys,
+                          hot_traffic=self.hot_traffic)
+        return config
+
+    def describe(self):
+        if self.distribution == 'zipf':
+            dist = "zipf (exponent {:g})".format(self.zipf_exponent)
+        elif self.distribution == 'hotspot':
+            dist = "hotspot ({:g}% of keys get {:g}% of requests)".format(
+                self.hot_keys * 100, self.hot_traffic * 100)
+        else:
+            dist = "uniform"
+        return "{} keys, {}, shapes {}".format(
+            self.key_count, dist, ", ".join(self.shapes))
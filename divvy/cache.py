@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import math
+import threading
+
+from divvy.connection import monotonic
+from divvy.protocol import Response
+
+
+class DenialCache(object):
+    """A bounded, in-process cache of denied checks.
+
+    When the server denies a check, it says how many seconds remain until
+    the actor gets credit back. Until then, the same check is certain to be
+    denied again, so it can be answered locally instead of asking the
+    server. Checks are keyed by their HIT command bytes, as built by
+    Translator.build_hit(), so keyword order does not matter.
+
+    Note that a check answered from the cache does not reach the server, and
+    so does not consume credit there.
+
+    Holds at most max_size entries, evicting the least recently used. Safe
+    to share between threads.
+    """
+
+    def __init__(self, max_size=10000, clock=monotonic):
+        if max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, Response)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns a denied Response for key if the actor is still out of
+        credit, or None if the server must be asked."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, response = entry
+            remaining = expires_at - self.clock()
+            if remaining <= 0:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            # OrderedDict.move_to_end() is not available on Python 2.7
+            self._entries[key] = self._entries.pop(key)
+            self.hits += 1
+        return response._replace(next_reset_seconds=int(math.ceil(remaining)))
+
+    def update(self, key, response):
+        """Records the server's response to the check for key."""
+        if not isinstance(response, Response):
+            return
+        with self._lock:
+            if response.is_allowed or response.next_reset_seconds <= 0:
+                self._entries.pop(key, None)
+                return
+            expires_at = self.clock() + response.next_reset_seconds
+            self._entries.pop(key, None)
+            self._entries[key] = (expires_at, response)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
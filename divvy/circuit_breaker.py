@@ -0,0 +1,263 @@
+from __future__ import absolute_import
+
+from abc import ABCMeta, abstractmethod
+from fnmatch import fnmatchcase
+import threading
+
+from divvy.connection import monotonic
+from divvy.exceptions import ConnectionError, TimeoutError
+from divvy.protocol import Response
+
+
+def fail_open(hit_args):
+    """Policy that allows every check while the server is unreachable."""
+    return Response(is_allowed=True, current_credit=0, next_reset_seconds=0)
+
+
+def fail_closed(hit_args):
+    """Policy that denies every check while the server is unreachable."""
+    return Response(is_allowed=False, current_credit=0, next_reset_seconds=0)
+
+
+class KeyPatternPolicy(object):
+    """Policy that picks another policy by matching the check's arguments.
+
+    rules is a sequence of (pattern, policy) pairs, where pattern is a dict
+    of HIT argument names to shell-style wildcards, as in Divvy's own
+    configuration. The first rule whose pattern matches is used; checks that
+    match no rule use default.
+    """
+
+    def __init__(self, rules, default=fail_open):
+        self.rules = list(rules)
+        self.default = default
+
+    def __call__(self, hit_args):
+        for pattern, policy in self.rules:
+            if self._matches(pattern, hit_args):
+                return policy(hit_args)
+        return self.default(hit_args)
+
+    @staticmethod
+    def _matches(pattern, hit_args):
+        for k, wildcard in pattern.items():
+            if k not in hit_args:
+                return False
+            if not fnmatchcase(str(hit_args[k]), wildcard):
+                return False
+        return True
+
+
+class CircuitBreaker(object):
+    """Tracks the health of a Divvy server, so that clients can stop waiting
+    on it while it is down.
+
+    The breaker starts closed. Once at least minimum_requests checks have
+    been made within a window of window_seconds, and the fraction of them
+    that failed reaches failure_threshold, the breaker opens: checks are
+    answered immediately by policy, a callable that takes the check's
+    arguments and returns a divvy.Response.
+
+    After recovery_timeout seconds the breaker becomes half-open and the
+    client probes the server in the background, while checks are still
+    answered by policy. The breaker closes if the probe succeeds, and opens
+    again if it fails.
+
+    Safe to share between threads.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=0.5, minimum_requests=20,
+                 window_seconds=10.0, recovery_timeout=5.0, policy=fail_open,
+                 clock=monotonic):
+        self.failure_threshold = failure_threshold
+        self.minimum_requests = minimum_requests
+        self.window_seconds = window_seconds
+        self.recovery_timeout = recovery_timeout
+        self.policy = policy
+        self.clock = clock
+
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._window_start = clock()
+        self._successes = 0
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def allow_request(self):
+        """Returns True if a check should be sent to the server, or False if
+        it should be answered with fallback()."""
+        if self.state == self.CLOSED:
+            return True
+        with self._lock:
+            if (self.state == self.OPEN and
+                    self.clock() - self._opened_at >= self.recovery_timeout):
+                self.state = self.HALF_OPEN
+        return False
+
+    def begin_probe(self):
+        """Returns True, exactly once per half-open period, if the caller
+        should start probing the server. The caller must then report the
+        outcome with probe_succeeded() or probe_failed()."""
+        with self._lock:
+            if self.state != self.HALF_OPEN or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def probe_succeeded(self):
+        with self._lock:
+            self._probing = False
+            self._close()
+
+    def probe_failed(self):
+        with self._lock:
+            self._probing = False
+            self._open()
+
+    def record_success(self):
+        with self._lock:
+            self._roll_window()
+            self._successes += 1
+
+    def record_failure(self):
+        with self._lock:
+            self._roll_window()
+            self._failures += 1
+            if self.state != self.CLOSED:
+                return
+            total = self._successes + self._failures
+            if (total >= self.minimum_requests and
+                    self._failures >= self.failure_threshold * total):
+                self._open()
+
+    def fallback(self, hit_args):
+        """Returns the policy's answer to a check that isn't sent."""
+        return self.policy(hit_args)
+
+    def _roll_window(self):
+        now = self.clock()
+        if now - self._window_start >= self.window_seconds:
+            self._window_start = now
+            self._successes = 0
+            self._failures = 0
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = self.clock()
+
+    def _close(self):
+        self.state = self.CLOSED
+        self._window_start = self.clock()
+        self._successes = 0
+        self._failures = 0
+
+
+# abc.ABC, which Python 2.7 lacks
+_ABC = ABCMeta('_ABC', (object,), {})
+
+
+class BaseCircuitBreakerClient(_ABC):
+    """The CircuitBreaker bookkeeping shared by the sync, asyncio and Twisted
+    CircuitBreakerClients.
+
+    Subclasses make the check, and probe the server, in their own way:
+    _admit() says whether a check is sent, and _succeeded() or _failed()
+    record how it went. Errors in FAILURES count as failures; subclasses add
+    the ones their transport raises.
+    """
+
+    FAILURES = (ConnectionError, TimeoutError)
+
+    def __init__(self, client, breaker=None):
+        self.client = client
+        self.breaker = breaker or CircuitBreaker()
+
+    def _admit(self, hit_args):
+        """Returns None if the check should be sent to the server, or the
+        policy's Response if it is answered without, starting the probe if
+        one is due."""
+        breaker = self.breaker
+        if breaker.allow_request():
+            return None
+        if breaker.begin_probe():
+            self._start_probe()
+        return breaker.fallback(hit_args)
+
+    def _succeeded(self, response):
+        self.breaker.record_success()
+        return response
+
+    def _failed(self, error, hit_args):
+        """Returns the policy's Response for a check that failed with error,
+        or None if error is not one of FAILURES and should be raised."""
+        if not isinstance(error, self.FAILURES):
+            return None
+        self.breaker.record_failure()
+        return self.breaker.fallback(hit_args)
+
+    def _probed(self, succeeded):
+        if succeeded:
+            self.breaker.probe_succeeded()
+        else:
+            self.breaker.probe_failed()
+
+    @abstractmethod
+    def _start_probe(self):
+        """Starts probing the server in the background, and reports the
+        outcome with _probed()."""
+
+
+class CircuitBreakerClient(BaseCircuitBreakerClient):
+    """Wraps a divvy.client.DivvyClient with a CircuitBreaker.
+
+    Checks that fail with ConnectionError or TimeoutError count as failures
+    and are answered by the breaker's policy instead of raising. While the
+    breaker is open, checks are answered by the policy without touching the
+    network. Other errors, such as InputError, are raised as usual.
+
+    The background probe opens a new connection to the server from a
+    separate thread; pass probe, a function of no arguments that raises on
+    failure, to probe differently.
+    """
+
+    def __init__(self, client, breaker=None, probe=None):
+        super(CircuitBreakerClient, self).__init__(client, breaker)
+        self.probe = probe or self._connect
+
+    def check_rate_limit(self, **hit_args):
+        response = self._admit(hit_args)
+        if response is not None:
+            return response
+        try:
+            response = self.client.check_rate_limit(**hit_args)
+        except self.FAILURES as e:
+            return self._failed(e, hit_args)
+        return self._succeeded(response)
+
+    def _start_probe(self):
+        t = threading.Thread(target=self._run_probe)
+        t.daemon = True
+        t.start()
+
+    def _run_probe(self):
+        try:
+            self.probe()
+        except Exception:
+            self._probed(False)
+        else:
+            self._probed(True)
+
+    def _connect(self):
+        # the pool's idle connections may have been cut since they were last
+        # used, so connect afresh
+        pool = self.client.connection_pool
+        connection = pool.connection_class(**pool.connection_kwargs)
+        try:
+            connection.connect()
+        finally:
+            connection.disconnect()
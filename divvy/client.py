@@ -3,9 +3,10 @@ from __future__ import absolute_import
 from collections import namedtuple
 import re
 import socket
+import threading
 
-from divvy.connection import Connection
-from divvy.exceptions import InputError
+from divvy.connection import ConnectionPool
+from divvy.exceptions import DivvyError, InputError
 from divvy.protocol import Translator
 
 
@@ -13,20 +14,68 @@ class DivvyClient(object):
     def __init__(self, host='localhost', port=8321,
                  socket_timeout=1, socket_connect_timeout=1,
                  socket_keepalive=False, socket_keepalive_options=None,
-                 socket_type=0, retry_on_timeout=False, encoding='utf-8'):
+                 socket_type=0, retry_on_timeout=False, encoding='utf-8',
+                 connection_pool=None, denial_cache=None,
+                 instrumentation=None, resolver=None,
+                 happy_eyeballs_delay=None):
+        """Configures a client that can speak to a Divvy server.
+
+        A client may safely be shared between threads. Each check borrows a
+        connection from connection_pool; if no pool is given, one is built
+        from the host, port and socket arguments.
+
+        If a divvy.cache.DenialCache is given, checks that are known to be
+        denied until their reset time are answered without a round trip.
+
+        If a divvy.instrumentation.Instrumentation is given, it is notified
+        of every send, reply, error and reconnect. When passing a
+        connection_pool, give the instrumentation to the pool instead.
+
+        If a divvy.resolver.Resolver is given, the server's addresses are
+        looked up through it, so that reconnecting doesn't wait on DNS; share
+        one between clients. If happy_eyeballs_delay is set, connections are
+        attempted to each of the server's addresses in turn, that many
+        seconds apart, without waiting for earlier attempts to fail.
+        """
         self.host = host
         self.port = port
         self.translator = Translator(encoding=encoding)
-        self.connection = Connection(
-            host=host,
-            port=port,
-            socket_timeout=socket_timeout,
-            socket_connect_timeout=socket_connect_timeout,
-            socket_keepalive=socket_keepalive,
-            socket_keepalive_options=socket_keepalive_options,
-            socket_type=socket_type,
-            retry_on_timeout=retry_on_timeout
-        )
+        if connection_pool is not None and instrumentation is not None:
+            raise ValueError("instrumentation applies to the client's own "
+                             "pool; pass it to connection_pool instead")
+        if connection_pool is None:
+            connection_pool = ConnectionPool(
+                host=host,
+                port=port,
+                socket_timeout=socket_timeout,
+                socket_connect_timeout=socket_connect_timeout,
+                socket_keepalive=socket_keepalive,
+                socket_keepalive_options=socket_keepalive_options,
+                socket_type=socket_type,
+                retry_on_timeout=retry_on_timeout,
+                encoding=encoding,
+                instrumentation=instrumentation,
+                resolver=resolver,
+                happy_eyeballs_delay=happy_eyeballs_delay
+            )
+        self.connection_pool = connection_pool
+        self.denial_cache = denial_cache
+        self._connection = None
+        self._connection_lock = threading.Lock()
+
+    @property
+    def connection(self):
+        """A Connection to the server, for code written against earlier
+        versions, in which the client held a single connection.
+
+        It is made the first time it is used, configured as the pool's
+        connections are, but is neither taken from the pool nor used for
+        checks. disconnect() closes it.
+        """
+        with self._connection_lock:
+            if self._connection is None:
+                self._connection = self.connection_pool.make_connection()
+            return self._connection
 
     def check_rate_limit(self, **kwargs):
         """Perform a check-and-decrement of quota. Zero or more key-value pairs
@@ -47,8 +96,81 @@ class DivvyClient(object):
                 next_reset_seconds: time, in seconds, until credit next resets.
         """
         cmd = self.translator.build_hit(**kwargs)
-        self.connection.send(cmd)
+        if self.denial_cache is not None:
+            response = self.denial_cache.get(cmd)
+            if response is not None:
+                return response
+
+        connection = self.connection_pool.get_connection()
+        try:
+            connection.send(cmd)
+            reply = connection.recv()
+        finally:
+            self.connection_pool.release(connection)
 
-        reply = self.connection.recv()
         response = self.translator.parse_reply(reply)
+        if self.denial_cache is not None:
+            self.denial_cache.update(cmd, response)
         return response
+
+    def check_rate_limits(self, hits):
+        """Perform several check-and-decrement operations in a single round
+        trip. All HIT commands are written to the server at once, and the
+        replies, which the server sends in order, are read back together.
+
+        Args:
+            hits: A sequence of dicts, each holding the key-value pairs that
+                would be passed to check_rate_limit().
+
+        Returns:
+            A list with one entry per element of hits, in the same order.
+            Each entry is either a divvy.Response or the DivvyError (such as
+            an InputError or ServerError) raised for that check. Errors that
+            affect the whole batch, like ConnectionError, are raised.
+        """
+        results = []
+        cmds = []
+        for kwargs in hits:
+            try:
+                cmd = self.translator.build_hit(**kwargs)
+            except InputError as e:
+                results.append(e)
+                continue
+            if self.denial_cache is not None:
+                response = self.denial_cache.get(cmd)
+                if response is not None:
+                    results.append(response)
+                    continue
+            cmds.append(cmd)
+            results.append(None)
+        if not cmds:
+            return results
+
+        connection = self.connection_pool.get_connection()
+        try:
+            connection.send(b"".join(cmds))
+            replies = connection.recv_lines(len(cmds))
+        finally:
+            self.connection_pool.release(connection)
+
+        replies = iter(zip(cmds, replies))
+        for i, result in enumerate(results):
+            if result is not None:
+                continue
+            cmd, reply = next(replies)
+            try:
+                results[i] = self.translator.parse_reply(reply)
+            except DivvyError as e:
+                results[i] = e
+            else:
+                if self.denial_cache is not None:
+                    self.denial_cache.update(cmd, results[i])
+        return results
+
+    def disconnect(self):
+        """Closes every connection held by this client."""
+        with self._connection_lock:
+            connection = self._connection
+        if connection is not None:
+            connection.disconnect()
+        self.connection_pool.disconnect()
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+from divvy.protocol import Response
+
+
+class CoalescedResponse(Response):
+    """The Response to a check that shared its round trip to the server with
+    other identical checks.
+
+    The server saw, and charged credit for, a single check on behalf of all
+    of them; weight is how many checks that was. Callers that keep their
+    own accounting should treat the response as covering weight checks.
+    """
+
+    weight = 1
+
+    def __new__(cls, response, weight):
+        self = super(CoalescedResponse, cls).__new__(cls, *response)
+        self.weight = weight
+        return self
+
+    def __getnewargs__(self):
+        # for copy and pickle, which would pass the Response fields alone
+        return (Response(*self), self.weight)
+
+    def _replace(self, **kwargs):
+        return CoalescedResponse(Response(*self)._replace(**kwargs),
+                                 self.weight)
+
+    def __repr__(self):
+        return "CoalescedResponse(is_allowed={!r}, current_credit={!r}, " \
+            "next_reset_seconds={!r}, weight={!r})".format(
+                self.is_allowed, self.current_credit,
+                self.next_reset_seconds, self.weight)
+
+
+class Flight(object):
+    """A check that is waiting for its reply, and the callers that share
+    it."""
+    __slots__ = ('waiters', 'weight')
+
+    def __init__(self):
+        self.waiters = []
+        self.weight = 1
+
+
+class Coalescer(object):
+    """Single-flight bookkeeping for the Twisted and asyncio clients.
+
+    A coalescable check made while an identical one, with the same HIT
+    command bytes as built by Translator.build_hit(), is waiting for its
+    reply is not sent; it gets the same reply, as a CoalescedResponse. Only
+    use this for checks where that is acceptable, such as probes for whether
+    an actor is already blocked: N callers share one credit, not N.
+
+    checks counts the coalescable checks made, and round_trips those that
+    were sent to the server. Use one Coalescer per event loop.
+    """
+
+    def __init__(self):
+        self.checks = 0
+        self.round_trips = 0
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    def join(self, key):
+        """Returns the Flight for key, counting this check, or None if no
+        identical check is waiting for its reply; then call begin()."""
+        self.checks += 1
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.weight += 1
+        return flight
+
+    def begin(self, key):
+        """Records that the check for key is being sent."""
+        self.round_trips += 1
+        flight = self._flights[key] = Flight()
+        return flight
+
+    def end(self, key, flight):
+        """Records that the reply for key's Flight has arrived."""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    @property
+    def ratio(self):
+        """The fraction of coalescable checks that were answered without a
+        round trip of their own."""
+        if not self.checks:
+            return 0.0
+        return 1.0 - float(self.round_trips) / self.checks
+
+    def summary(self):
+        return {
+            'checks': self.checks,
+            'round_trips': self.round_trips,
+            'in_flight': len(self._flights),
+            'ratio': self.ratio,
+        }
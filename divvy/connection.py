@@ -4,19 +4,38 @@
 
 from __future__ import absolute_import
 
+from collections import deque
+import errno
+import os
+import select
 import socket
 import sys
+import threading
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
 
 from divvy.exceptions import ConnectionError, TimeoutError
 from divvy.protocol import Translator
 
 
+# connect_ex() results that mean a non-blocking connect has started
+_CONNECT_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
 class Connection(object):
+    # the longest reply accepted, as for the Twisted client's protocol; a
+    # server that sends more without a newline is cut off
+    MAX_LENGTH = 16384
+
     def __init__(self, host='localhost', port=8321,
                  socket_timeout=1, socket_connect_timeout=1,
                  socket_keepalive=False, socket_keepalive_options=None,
                  socket_type=0, retry_on_timeout=False,
-                 socket_read_size=1024, encoding='utf-8'):
+                 socket_read_size=1024, encoding='utf-8',
+                 instrumentation=None, resolver=None,
+                 happy_eyeballs_delay=None):
         self.host = host
         self.port = port
         self.socket_timeout = socket_timeout
@@ -26,15 +45,32 @@ class Connection(object):
         self.socket_type = socket_type
         self.retry_on_timeout = retry_on_timeout
         self.socket_read_size = socket_read_size
+        self.instrumentation = instrumentation
+        # a divvy.resolver.Resolver, to cache DNS lookups
+        self.resolver = resolver
+        # if set, connection attempts to the server's addresses are started
+        # this many seconds apart, rather than one after another fails
+        self.happy_eyeballs_delay = happy_eyeballs_delay
 
         self._translator = Translator(encoding)
         self._sock = None
+        self.connected_at = None
+        self._was_connected = False
+        self._sent_at = None
+
+        # read buffer; bytes in [_buf_start, _buf_end) have not been consumed
+        self._buf = bytearray(socket_read_size)
+        self._view = memoryview(self._buf)
+        self._buf_start = 0
+        self._buf_end = 0
 
     def connect(self):
         """Connects to the Divvy server if not already connected."""
 
         if self._sock:
             return
+        if self._was_connected and self.instrumentation is not None:
+            self.instrumentation.on_reconnect()
         try:
             sock = self._connect()
         except socket.timeout:
@@ -52,6 +88,8 @@ class Connection(object):
             raise ConnectionError(msg)
 
         self._sock = sock
+        self.connected_at = monotonic()
+        self._was_connected = True
 
     def _connect(self):
         """Creates a TCP socket connection."""
@@ -59,40 +97,128 @@ class Connection(object):
         # we want to mimic what socket.create_connection does to support
         # ipv4/ipv6, but we want to set options prior to calling
         # socket.connect()
+        if self.resolver is not None:
+            addresses = self.resolver.getaddrinfo(
+                self.host, self.port, self.socket_type, socket.SOCK_STREAM)
+        else:
+            addresses = socket.getaddrinfo(self.host, self.port,
+                                           self.socket_type,
+                                           socket.SOCK_STREAM)
+        if not addresses:
+            raise socket.error("socket.getaddrinfo returned an empty list")
+
+        if self.happy_eyeballs_delay is not None and len(addresses) > 1:
+            res, sock = self._connect_staggered(addresses)
+        else:
+            res, sock = self._connect_sequential(addresses)
+
+        # set the socket_timeout now that we're connected
+        sock.settimeout(self.socket_timeout)
+        if self.resolver is not None:
+            self.resolver.mark_good(self.host, self.port, self.socket_type,
+                                    socket.SOCK_STREAM, res)
+        return sock
+
+    def _create_socket(self, res):
+        family, socktype, proto, canonname, socket_address = res
+        sock = socket.socket(family, socktype, proto)
+        try:
+            # TCP_NODELAY
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            # TCP_KEEPALIVE
+            if self.socket_keepalive:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                for k, v in self.socket_keepalive_options.items():
+                    sock.setsockopt(socket.SOL_TCP, k, v)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def _connect_sequential(self, addresses):
+        """Tries each address in turn, and returns the first that connects
+        and its socket."""
         err = None
-        for res in socket.getaddrinfo(self.host, self.port, self.socket_type,
-                                      socket.SOCK_STREAM):
-            family, socktype, proto, canonname, socket_address = res
+        for res in addresses:
             sock = None
             try:
-                sock = socket.socket(family, socktype, proto)
-                # TCP_NODELAY
-                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-
-                # TCP_KEEPALIVE
-                if self.socket_keepalive:
-                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                    for k, v in self.socket_keepalive_options.items():
-                        sock.setsockopt(socket.SOL_TCP, k, v)
+                sock = self._create_socket(res)
 
                 # set the socket_connect_timeout before we connect
                 sock.settimeout(self.socket_connect_timeout)
 
                 # connect
-                sock.connect(socket_address)
-
-                # set the socket_timeout now that we're connected
-                sock.settimeout(self.socket_timeout)
-                return sock
+                sock.connect(res[4])
+                return res, sock
 
             except socket.error as _:
                 err = _
                 if sock is not None:
                     sock.close()
 
-        if err is not None:
+        raise err  # pylint: disable=raising-bad-type
+
+    def _connect_staggered(self, addresses):
+        """Happy Eyeballs (RFC 8305): starts connecting to each address in
+        turn, happy_eyeballs_delay seconds after the last, or as soon as the
+        last fails, without abandoning earlier attempts. Returns the first
+        address that connects and its socket, and closes the others."""
+        deadline = None
+        if self.socket_connect_timeout is not None:
+            deadline = monotonic() + self.socket_connect_timeout
+        remaining = deque(addresses)
+        pending = {}  # socket -> address
+        next_start = 0
+        err = None
+        try:
+            while remaining or pending:
+                now = monotonic()
+                if remaining and (not pending or now >= next_start):
+                    res = remaining.popleft()
+                    try:
+                        sock = self._create_socket(res)
+                    except socket.error as _:
+                        err = _
+                        continue
+                    sock.setblocking(False)
+                    rc = sock.connect_ex(res[4])
+                    if rc == 0:
+                        sock.setblocking(True)
+                        return res, sock
+                    if rc not in _CONNECT_IN_PROGRESS:
+                        err = socket.error(rc, os.strerror(rc))
+                        sock.close()
+                        continue
+                    pending[sock] = res
+                    next_start = now + self.happy_eyeballs_delay
+                    continue
+
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - now
+                    if timeout <= 0:
+                        raise socket.timeout("timed out")
+                if remaining:
+                    wait = next_start - now
+                    timeout = wait if timeout is None else min(timeout, wait)
+                # select() rather than selectors, which Python 2.7 lacks;
+                # there are only ever a few sockets
+                _, writable, _ = select.select([], list(pending), [], timeout)
+                for sock in writable:
+                    res = pending.pop(sock)
+                    rc = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if rc == 0:
+                        sock.setblocking(True)
+                        return res, sock
+                    err = socket.error(rc, os.strerror(rc))
+                    sock.close()
+                    # start the next attempt now
+                    next_start = now
             raise err  # pylint: disable=raising-bad-type
-        raise socket.error("socket.getaddrinfo returned an empty list")
+        finally:
+            for sock in pending:
+                sock.close()
 
     def disconnect(self):
         """Disconnects from the Divvy server."""
@@ -105,19 +231,33 @@ class Connection(object):
         except socket.error:
             pass
         self._sock = None
+        self.connected_at = None
+        self._buf_start = self._buf_end = 0
 
     def send(self, msg):
-        """Sends a command to the Divvy server."""
+        """Sends one or more commands to the Divvy server."""
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return self._send(msg)
+        try:
+            self._send(msg)
+        except Exception as e:
+            instrumentation.on_error(e)
+            raise
+        self._sent_at = monotonic()
+        instrumentation.on_send(msg.count(b"\n"))
+
+    def _send(self, msg):
         if not self._sock:
             self.connect()
         try:
-            self._sock.send(msg)
+            self._sock.sendall(msg)
         except socket.timeout:
             self.disconnect()
             if self.retry_on_timeout:
                 self.connect()
                 try:
-                    self._sock.send(msg)
+                    self._sock.sendall(msg)
                 except socket.timeout:
                     self.disconnect()
                     raise TimeoutError("Timeout writing to socket after retry")
@@ -138,13 +278,206 @@ class Connection(object):
             raise e
 
     def recv(self):
-        """Receives a response from the Divvy server. This should only be
-        called immediately after a command is sent."""
+        """Receives one reply from the Divvy server, as bytes ending in a
+        newline. Bytes received beyond the end of the reply are kept for the
+        next call, so replies may be split or coalesced by the network."""
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return self._recv()
         try:
-            response = self._sock.recv(self.socket_read_size)
-            if not response:
-                raise ConnectionError("Connection closed by server.")
+            line = self._recv()
+        except Exception as e:
+            instrumentation.on_error(e)
+            raise
+        if self._sent_at is not None:
+            instrumentation.on_reply(monotonic() - self._sent_at)
+        return line
+
+    def _recv(self):
+        try:
+            return self._read_line()
+        except socket.timeout:
+            self.disconnect()
+            raise TimeoutError("Timeout reading from socket")
+        except socket.error:
+            e = sys.exc_info()[1]
+            self.disconnect()
+            if len(e.args) == 1:
+                errno, errmsg = 'UNKNOWN', e.args[0]
+            else:
+                errno = e.args[0]
+                errmsg = e.args[1]
+            raise ConnectionError("Error %s while reading from socket. %s." %
+                                  (errno, errmsg))
         except Exception as e:
             self.disconnect()
             raise e
-        return response
+
+    def recv_lines(self, count):
+        """Receives exactly count replies from the Divvy server, which
+        answers commands in the order they were sent. Returns a list of
+        bytes, one per reply."""
+        return [self.recv() for _ in range(count)]
+
+    def _read_line(self):
+        """Returns the next newline-terminated line, reading from the socket
+        into the buffer only when it does not already hold a whole line."""
+        buf = self._buf
+        start = self._buf_start
+        scanned = start
+        while True:
+            end = self._buf_end
+            newline = buf.find(b"\n", scanned, end)
+            if newline >= 0:
+                self._buf_start = newline + 1
+                if self._buf_start == end:
+                    self._buf_start = self._buf_end = 0
+                return bytes(buf[start:newline + 1])
+            scanned = end
+            if end - start > self.MAX_LENGTH:
+                raise ConnectionError(
+                    "Reply longer than {} bytes".format(self.MAX_LENGTH))
+
+            if end == len(buf):
+                if start > 0:
+                    # make room by moving the partial line to the front
+                    buf[:end - start] = buf[start:end]
+                    scanned -= start
+                    end -= start
+                    start = self._buf_start = 0
+                    self._buf_end = end
+                else:
+                    # the buffer can't grow while a view of it exists;
+                    # Python 2.7 has no release(), but dropping the last
+                    # reference to the view does the same
+                    if hasattr(self._view, 'release'):
+                        self._view.release()
+                    self._view = None
+                    buf.extend(bytearray(len(buf)))
+                    self._view = memoryview(buf)
+
+            nbytes = self._sock.recv_into(self._view[end:])
+            if not nbytes:
+                raise ConnectionError("Connection closed by server.")
+            self._buf_end = end + nbytes
+
+
+class ConnectionPool(object):
+    """A bounded, thread-safe pool of Connections to a single Divvy server.
+
+    Connections are created lazily, up to max_connections. When the pool is
+    exhausted, get_connection() either blocks (for at most block_timeout
+    seconds, or forever if that is None) or, if block is False, raises
+    ConnectionError immediately.
+
+    Idle connections are handed out most-recently-used first, so a small set
+    of sockets stays warm. Connections idle for longer than max_idle_time
+    seconds are closed and dropped from the pool, and connections older than
+    max_lifetime seconds are reconnected before being handed out again.
+    """
+
+    def __init__(self, max_connections=10, block=True, block_timeout=None,
+                 max_idle_time=None, max_lifetime=None,
+                 connection_class=Connection, **connection_kwargs):
+        if max_connections < 1:
+            raise ValueError("max_connections must be a positive integer")
+        self.max_connections = max_connections
+        self.block = block
+        self.block_timeout = block_timeout
+        self.max_idle_time = max_idle_time
+        self.max_lifetime = max_lifetime
+        self.connection_class = connection_class
+        self.connection_kwargs = connection_kwargs
+        self.instrumentation = connection_kwargs.get('instrumentation')
+
+        self._lock = threading.Condition(threading.Lock())
+        # (connection, released_at) pairs; the right end is the warmest
+        self._idle = deque()
+        self._in_use = set()
+        # checked-out connections to disconnect when they are released
+        self._stale = set()
+
+    def __repr__(self):
+        return "{}<{}:{}>".format(
+            type(self).__name__,
+            self.connection_kwargs.get('host', 'localhost'),
+            self.connection_kwargs.get('port', 8321))
+
+    def get_connection(self):
+        """Checks a connection out of the pool. Callers must hand it back
+        with release() when they are done with it."""
+        deadline = None
+        if self.block and self.block_timeout is not None:
+            deadline = monotonic() + self.block_timeout
+
+        with self._lock:
+            while True:
+                self._reap_idle()
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                    break
+                if len(self._in_use) < self.max_connections:
+                    connection = self.make_connection()
+                    break
+                if not self.block:
+                    raise ConnectionError("Too many connections")
+                if deadline is None:
+                    self._lock.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise ConnectionError(
+                            "No connection available after {} seconds".format(
+                                self.block_timeout))
+                    self._lock.wait(remaining)
+            self._in_use.add(connection)
+            in_use = len(self._in_use)
+
+        if self.instrumentation is not None:
+            self.instrumentation.on_queue_depth(in_use)
+        if (self.max_lifetime is not None and
+                connection.connected_at is not None and
+                monotonic() - connection.connected_at > self.max_lifetime):
+            connection.disconnect()
+        return connection
+
+    def make_connection(self):
+        """Returns a new Connection, configured as the pool's are, that does
+        not belong to the pool."""
+        return self.connection_class(**self.connection_kwargs)
+
+    def release(self, connection):
+        """Returns a connection to the pool."""
+        with self._lock:
+            if connection not in self._in_use:
+                return
+            self._in_use.remove(connection)
+            if connection in self._stale:
+                self._stale.remove(connection)
+                connection.disconnect()
+            self._idle.append((connection, monotonic()))
+            self._lock.notify()
+            in_use = len(self._in_use)
+
+        if self.instrumentation is not None:
+            self.instrumentation.on_queue_depth(in_use)
+
+    def disconnect(self):
+        """Disconnects every connection in the pool. Connections that are
+        checked out are left to the threads using them, and disconnected
+        when they are released; all of them reconnect on their next use."""
+        with self._lock:
+            connections = [c for c, _ in self._idle]
+            self._stale.update(self._in_use)
+        for connection in connections:
+            connection.disconnect()
+
+    def _reap_idle(self):
+        """Drops connections that have sat idle for too long. The lock must
+        be held by the caller."""
+        if self.max_idle_time is None:
+            return
+        now = monotonic()
+        while self._idle and now - self._idle[0][1] > self.max_idle_time:
+            connection, _ = self._idle.popleft()
+            connection.disconnect()
@@ -0,0 +1,228 @@
+from __future__ import absolute_import
+
+import math
+import threading
+
+
+class Instrumentation(object):
+    """Receives events from the request hot path of a client.
+
+    Pass an instance as the `instrumentation` argument of any client to be
+    notified as checks are sent and answered. Every method does nothing by
+    default; subclasses override the events they care about. Methods are
+    called synchronously, from whichever thread or reactor is making the
+    check, so they should be quick.
+
+    Clients that are not given an Instrumentation skip these calls
+    entirely.
+    """
+
+    def on_send(self, count):
+        """count HIT commands were written to the server."""
+
+    def on_reply(self, latency):
+        """A reply arrived, latency seconds after its command was written."""
+
+    def on_error(self, error):
+        """A check failed with error, an exception such as a
+        divvy.ConnectionError, divvy.TimeoutError or divvy.ServerError (or
+        their Twisted equivalents, for the Twisted client)."""
+
+    def on_reconnect(self):
+        """A lost connection is being re-established."""
+
+    def on_queue_depth(self, depth):
+        """The number of checks awaiting a reply on a connection (or, for the
+        synchronous client, the number of connections in use) changed."""
+
+
+class Histogram(object):
+    """A fixed-memory histogram with logarithmically sized buckets.
+
+    Each bucket is `precision` wider than the last, so any reported value is
+    within that relative error of a value that was actually recorded.
+    Recording is O(1). Values outside [lowest, highest] are clamped to the
+    end buckets, but min, max, mean and standard deviation are exact.
+
+    Histograms with the same lowest, highest and precision can be merged,
+    and to_dict() and from_dict() let them be passed between processes.
+    """
+
+    def __init__(self, lowest=1e-6, highest=3600.0, precision=0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self._counts = [0] * (self._index(highest) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._mean = 0.0
+        self._m2 = 0.0  # sum of squared differences from the mean
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self._log_base)
+
+    def _value(self, index):
+        """Returns the value at the middle of a bucket."""
+        return self.lowest * math.exp((index + 0.5) * self._log_base)
+
+    def record(self, value):
+        i = self._index(value)
+        if i >= len(self._counts):
+            i = len(self._counts) - 1
+        self._counts[i] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self._mean
+
+    @property
+    def stddev(self):
+        """The population standard deviation of recorded values."""
+        if not self.count:
+            return None
+        return math.sqrt(self._m2 / self.count)
+
+    def percentile(self, pct):
+        """Returns the value below which pct percent of recorded values
+        fall, or None if nothing has been recorded."""
+        if not self.count:
+            return None
+        if pct >= 100:
+            return self.max
+        rank = max(1, int(math.ceil(pct / 100.0 * self.count)))
+        seen = 0
+        for i, n in enumerate(self._counts):
+            seen += n
+            if seen >= rank:
+                return min(max(self._value(i), self.min), self.max)
+        return self.max
+
+    def merge(self, other):
+        """Adds every value recorded in other to this histogram."""
+        if (other.lowest, other.highest, other.precision) != \
+                (self.lowest, self.highest, self.precision):
+            raise ValueError("Can't merge histograms with different buckets")
+        if not other.count:
+            return
+        for i, n in enumerate(other._counts):
+            if n:
+                self._counts[i] += n
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        self._mean += delta * other.count / count
+        self._m2 += other._m2 + \
+            delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def to_dict(self):
+        """Returns the histogram as a dict of JSON- and pickle-friendly
+        values."""
+        return {
+            'lowest': self.lowest,
+            'highest': self.highest,
+            'precision': self.precision,
+            'buckets': dict((str(i), n) for i, n in enumerate(self._counts)
+                            if n),
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self._mean,
+            'm2': self._m2,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(lowest=d['lowest'], highest=d['highest'],
+                precision=d['precision'])
+        for i, n in d['buckets'].items():
+            h._counts[int(i)] = n
+        h.count = d['count']
+        h.total = d['total']
+        h.min = d['min']
+        h.max = d['max']
+        h._mean = d['mean']
+        h._m2 = d['m2']
+        return h
+
+
+class InMemoryCollector(Instrumentation):
+    """An Instrumentation that keeps counters and a latency Histogram in
+    memory. Safe to share between threads and clients."""
+
+    def __init__(self, **histogram_kwargs):
+        self._lock = threading.Lock()
+        self._histogram_kwargs = histogram_kwargs
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.sends = 0
+            self.replies = 0
+            self.errors = {}  # exception class name -> count
+            self.reconnects = 0
+            self.queue_depth = 0
+            self.max_queue_depth = 0
+            self.latency = Histogram(**self._histogram_kwargs)
+
+    def on_send(self, count):
+        with self._lock:
+            self.sends += count
+
+    def on_reply(self, latency):
+        with self._lock:
+            self.replies += 1
+            self.latency.record(latency)
+
+    def on_error(self, error):
+        name = type(error).__name__
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def on_reconnect(self):
+        with self._lock:
+            self.reconnects += 1
+
+    def on_queue_depth(self, depth):
+        with self._lock:
+            self.queue_depth = depth
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """Returns a dict of the collected counters, and latency percentiles
+        in seconds."""
+        with self._lock:
+            result = {
+                'sends': self.sends,
+                'replies': self.replies,
+                'errors': dict(self.errors),
+                'reconnects': self.reconnects,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'latency_mean': self.latency.mean,
+                'latency_max': self.latency.max,
+            }
+            for pct in percentiles:
+                result['latency_p{}'.format(pct)] = \
+                    self.latency.percentile(pct)
+        return result
@@ -4,8 +4,39 @@ try:
     from types import StringTypes
 except ImportError as e:
     StringTypes = str
+try:
+    from functools import lru_cache
+except ImportError:
+    def lru_cache(maxsize=128, typed=False):
+        """A stand-in for functools.lru_cache on Python 2.7, for functions
+        of one argument: caches up to maxsize results, and starts over once
+        it is full."""
+        def decorator(func):
+            cache = {}
+
+            def wrapper(arg):
+                key = (type(arg), arg) if typed else arg
+                try:
+                    return cache[key]
+                except KeyError:
+                    pass
+                result = func(arg)
+                if len(cache) >= maxsize:
+                    cache.clear()
+                cache[key] = result
+                return result
+            return wrapper
+        return decorator
+
+from divvy.exceptions import DivvyError, InputError, ParseError, ServerError
 
-from divvy.exceptions import InputError, ParseError, ServerError
+
+def _bytes(buf):
+    """Returns the contents of bytes, a bytearray or a memoryview as bytes.
+    (On Python 2.7, bytes() of a memoryview is its repr.)"""
+    if isinstance(buf, memoryview):
+        return buf.tobytes()
+    return bytes(buf)
 
 
 Response = namedtuple(
@@ -23,28 +54,113 @@ class Translator(object):
     RESPONSE_REGEXP = re.compile('^OK (true|false) (-?\\d+) (-?\\d+)$')
     ERROR_REGEXP = re.compile('^ERR (unknown|unknown-command) "?([^"]+)"?$')
 
-    def __init__(self, encoding='utf-8'):
+    def __init__(self, encoding='utf-8', value_cache_size=4096):
         self.encoding = encoding
+        # Validated, encoded fragments of the HIT command are cached, since
+        # callers tend to reuse a few keys and many (but not all) values.
+        self._key_fragment = lru_cache(maxsize=256)(self._build_key_fragment)
+        if value_cache_size:
+            self._value_fragment = lru_cache(
+                maxsize=value_cache_size, typed=True)(
+                    self._build_value_fragment)
+        else:
+            self._value_fragment = self._build_value_fragment
 
     def build_hit(self, **kwargs):
         """Builds a HIT command with the given arguments. Returns bytes."""
-        cmd = b"HIT"
+        parts = [b"HIT"]
         for k in sorted(kwargs.keys()):
-            v = kwargs[k]
-            if not isinstance(v, StringTypes):
-                v = str(v)
-            if not self.STRING_REGEXP.match(k):
-                raise InputError("Invalid Divvy key {}".format(k))
-            if not self.STRING_REGEXP.match(v):
-                raise InputError("Invalid Divvy value {}".format(v))
-            cmd += b" \"" + k.encode(self.encoding) + b"\"=\"" + \
-                v.encode(self.encoding) + b"\""
-        cmd += b"\n"
-        return cmd
+            parts.append(self._key_fragment(k))
+            parts.append(self._encode_value(kwargs[k]))
+        parts.append(b"\n")
+        return b"".join(parts)
+
+    def template(self, *keys):
+        """Returns a HitTemplate for building HIT commands with exactly these
+        keys. The keys are validated and encoded once, up front."""
+        return HitTemplate(self, keys)
+
+    def _encode_value(self, v):
+        try:
+            return self._value_fragment(v)
+        except TypeError:
+            # unhashable values can't be cached
+            return self._build_value_fragment(v)
+
+    def _build_key_fragment(self, k):
+        if not self.STRING_REGEXP.match(k):
+            raise InputError("Invalid Divvy key {}".format(k))
+        return b" \"" + k.encode(self.encoding) + b"\"=\""
+
+    def _build_value_fragment(self, v):
+        if not isinstance(v, StringTypes):
+            v = str(v)
+        if not self.STRING_REGEXP.match(v):
+            raise InputError("Invalid Divvy value {}".format(v))
+        return v.encode(self.encoding) + b"\""
 
     def parse_reply(self, reply_bytes):
-        """Builds a Resopnse object based on the server's reply."""
-        reply = reply_bytes.decode(self.encoding)
+        """Builds a Resopnse object based on the server's reply, which may be
+        bytes or a memoryview."""
+        reply = _bytes(reply_bytes)
+        if reply.endswith(b"\n"):
+            reply = reply[:-1]
+        response = self._parse_ok(reply)
+        if response is None:
+            return self._parse_reply_slow(reply_bytes)
+        return response
+
+    def parse_replies(self, buffer):
+        """Parses every complete reply in a buffer of pipelined replies.
+
+        Returns a tuple (results, remainder): results holds, for each
+        newline-terminated reply in order, either a Response or the
+        DivvyError raised while parsing it; remainder is the bytes of any
+        incomplete reply at the end of the buffer.
+        """
+        lines = _bytes(buffer).split(b"\n")
+        remainder = lines.pop()
+        results = []
+        parse_ok = self._parse_ok
+        for line in lines:
+            response = parse_ok(line)
+            if response is None:
+                try:
+                    response = self._parse_reply_slow(line)
+                except DivvyError as e:
+                    response = e
+            results.append(response)
+        return results, remainder
+
+    def _parse_ok(self, reply):
+        """Parses an "OK" reply, without its newline, directly from bytes.
+        Returns None if reply is anything else, including malformed."""
+        parts = reply.split(b" ")
+        if len(parts) != 4 or parts[0] != b"OK":
+            return None
+        _, allowed, credit, reset = parts
+        if allowed == b"true":
+            is_allowed = True
+        elif allowed == b"false":
+            is_allowed = False
+        else:
+            return None
+        if not (credit.isdigit() or
+                credit[:1] == b"-" and credit[1:].isdigit()):
+            return None
+        if not (reset.isdigit() or
+                reset[:1] == b"-" and reset[1:].isdigit()):
+            return None
+        return Response(is_allowed, int(credit), int(reset))
+
+    def _parse_reply_slow(self, reply_bytes):
+        """Parses any reply with regular expressions, raising the
+        appropriate error for replies that aren't "OK"."""
+        try:
+            reply = _bytes(reply_bytes).decode(self.encoding)
+        except UnicodeDecodeError:
+            raise ParseError("Unable to decode reply: {!r}".format(
+                _bytes(reply_bytes)))
         response = self.RESPONSE_REGEXP.match(reply)
         if not response:
             error = self.ERROR_REGEXP.match(reply)
@@ -56,3 +172,31 @@ class Translator(object):
         return Response(is_allowed=response.group(1) == "true",
                         current_credit=int(response.group(2)),
                         next_reset_seconds=int(response.group(3)))
+
+
+class HitTemplate(object):
+    """Builds HIT commands for a fixed set of keys, as returned by
+    Translator.template(). Output is identical to Translator.build_hit()."""
+
+    def __init__(self, translator, keys):
+        self.keys = tuple(sorted(set(keys)))
+        self._fragments = [translator._key_fragment(k) for k in self.keys]
+        self._encode_value = translator._encode_value
+
+    def build_hit(self, **kwargs):
+        """Builds a HIT command with the given arguments, which must be
+        exactly this template's keys. Returns bytes."""
+        if len(kwargs) != len(self.keys):
+            raise InputError("Expected Divvy keys {}, got {}".format(
+                ", ".join(self.keys), ", ".join(sorted(kwargs.keys()))))
+        encode = self._encode_value
+        parts = [b"HIT"]
+        try:
+            for fragment, k in zip(self._fragments, self.keys):
+                parts.append(fragment)
+                parts.append(encode(kwargs[k]))
+        except KeyError:
+            raise InputError("Expected Divvy keys {}, got {}".format(
+                ", ".join(self.keys), ", ".join(sorted(kwargs.keys()))))
+        parts.append(b"\n")
+        return b"".join(parts)
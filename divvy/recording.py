@@ -0,0 +1,115 @@
+"""
+Capture of the checks a client makes, for replay by benchmark.py --replay.
+
+A trace is a text file, gzip-compressed if its name ends in ".gz". The first
+line is a header; each following line is one check, as the number of seconds
+since recording began, a tab, and the HIT arguments as compact JSON:
+
+    # divvy-trace 1 1700000000.000000
+    0.000000	{"ip":"10.1.2.3","method":"GET","path":"/login"}
+    0.001250	{"ip":"10.9.8.7","method":"POST","path":"/login"}
+"""
+
+from __future__ import absolute_import
+
+import gzip
+import io
+import json
+import threading
+import time
+
+
+HEADER = "# divvy-trace 1"
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, mode + "b"),
+                                encoding="utf-8")
+    return io.open(path, mode, encoding="utf-8")
+
+
+class TraceRecorder(object):
+    """Appends checks to a trace file. Safe to share between threads and
+    clients; call close() when done."""
+
+    def __init__(self, path, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._file = _open(path, "w")
+        self._start = clock()
+        self._encoder = json.JSONEncoder(separators=(",", ":"),
+                                         sort_keys=True)
+        self._file.write(u"{} {:.6f}\n".format(HEADER, self._start))
+        self.count = 0
+
+    def record(self, hit_args):
+        line = u"{:.6f}\t{}\n".format(self.clock() - self._start,
+                                      self._encoder.encode(hit_args))
+        with self._lock:
+            self._file.write(line)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingClient(object):
+    """Wraps any Divvy client, synchronous, asyncio or Twisted, and records
+    the arguments of every check to a TraceRecorder before making it."""
+
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+
+    def check_rate_limit(self, timeout=None, coalesce=False, **hit_args):
+        """Records hit_args, and makes the check. timeout and coalesce are
+        not HIT arguments; they are passed on, if given, to clients that
+        accept them."""
+        self.recorder.record(hit_args)
+        options = {}
+        if timeout is not None:
+            options['timeout'] = timeout
+        if coalesce:
+            options['coalesce'] = coalesce
+        return self.client.check_rate_limit(**dict(hit_args, **options))
+
+    def check_rate_limits(self, hits):
+        for hit_args in hits:
+            self.recorder.record(hit_args)
+        return self.client.check_rate_limits(hits)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def read_trace(path, shard=0, shards=1):
+    """Yields (seconds since recording began, HIT arguments) for each check
+    in a trace, reading it a line at a time. Pass shards > 1 to yield only
+    every shards'th check, starting with the shard'th."""
+    with _open(path, "r") as f:
+        header = f.readline()
+        if not header.startswith(HEADER):
+            raise ValueError("{} is not a divvy trace".format(path))
+        for i, line in enumerate(f):
+            if i % shards != shard:
+                continue
+            offset, _, hit_args = line.partition("\t")
+            yield float(offset), json.loads(hit_args)
+
+
+def count_trace(path):
+    """Returns the number of checks in a trace, without loading it all."""
+    count = 0
+    with _open(path, "r") as f:
+        f.readline()
+        for _ in f:
+            count += 1
+    return count
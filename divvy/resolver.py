@@ -0,0 +1,159 @@
+from __future__ import absolute_import
+
+import socket
+import threading
+
+from divvy.connection import monotonic
+
+
+def interleave_families(addresses):
+    """Reorders getaddrinfo() results so that address families alternate,
+    starting with the family of the first, as recommended for Happy
+    Eyeballs by RFC 8305. The order within each family is kept."""
+    by_family = {}
+    families = []
+    for res in addresses:
+        if res[0] not in by_family:
+            by_family[res[0]] = []
+            families.append(res[0])
+        by_family[res[0]].append(res)
+    if len(families) < 2:
+        return list(addresses)
+    result = []
+    while len(result) < len(addresses):
+        for family in families:
+            if by_family[family]:
+                result.append(by_family[family].pop(0))
+    return result
+
+
+class _Entry(object):
+    __slots__ = ('addresses', 'refresh_at', 'expires_at', 'refreshing',
+                 'good')
+
+    def __init__(self, addresses, refresh_at, expires_at):
+        self.addresses = addresses
+        self.refresh_at = refresh_at
+        self.expires_at = expires_at
+        self.refreshing = False
+        self.good = None  # the address last connected to
+
+
+class Resolver(object):
+    """Caches the results of socket.getaddrinfo().
+
+    Results are cached for ttl seconds. Once refresh_ratio of that time has
+    passed, the next lookup starts a refresh in a background thread and
+    returns the cached results meanwhile, so that callers don't wait on the
+    resolver while it is in regular use. If a refresh fails, the old results
+    continue to be used, and the refresh is retried after retry_interval
+    seconds. Results that expire unused are looked up again synchronously,
+    and are still used if that lookup fails.
+
+    Addresses that a connection has been made to are reported with
+    mark_good(), and are returned first until another address is.
+
+    Share one Resolver between connections; it is safe to use from several
+    threads.
+    """
+
+    def __init__(self, ttl=60.0, refresh_ratio=0.75, retry_interval=1.0,
+                 clock=monotonic, getaddrinfo=socket.getaddrinfo):
+        self.ttl = ttl
+        self.refresh_ratio = refresh_ratio
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self._getaddrinfo = getaddrinfo
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def getaddrinfo(self, host, port, family=0, type=0):
+        """Returns the getaddrinfo() results for host and port, with the
+        last known good address first. Raises socket.error if host can't be
+        resolved."""
+        key = (host, port, family, type)
+        now = self.clock()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and now >= entry.refresh_at and \
+                    not entry.refreshing:
+                if now < entry.expires_at:
+                    entry.refreshing = True
+                    self._start_refresh(key)
+                else:
+                    entry = None
+        if entry is None:
+            entry = self._lookup(key)
+        return self._ordered(entry)
+
+    def mark_good(self, host, port, family, type, address):
+        """Records that a connection to address, a getaddrinfo() result
+        tuple, succeeded."""
+        with self._lock:
+            entry = self._cache.get((host, port, family, type))
+            if entry is not None:
+                entry.good = address[4]
+
+    def invalidate(self, host=None):
+        """Forgets the cached results for host, or for every host."""
+        with self._lock:
+            for key in list(self._cache):
+                if host is None or key[0] == host:
+                    del self._cache[key]
+
+    def _lookup(self, key):
+        """Looks up key, waiting on the resolver, and caches the results.
+        If that fails but expired results are cached, uses them."""
+        try:
+            addresses = self._getaddrinfo(*key)
+        except socket.error:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is None:
+                    raise
+                entry.refresh_at = self.clock() + self.retry_interval
+                return entry
+        return self._store(key, addresses)
+
+    def _store(self, key, addresses):
+        now = self.clock()
+        new = _Entry(list(addresses), now + self.ttl * self.refresh_ratio,
+                     now + self.ttl)
+        with self._lock:
+            old = self._cache.get(key)
+            if old is not None:
+                new.good = old.good
+            self._cache[key] = new
+        return new
+
+    def _start_refresh(self, key):
+        t = threading.Thread(target=self._refresh, args=(key,))
+        t.daemon = True
+        t.start()
+
+    def _refresh(self, key):
+        try:
+            addresses = self._getaddrinfo(*key)
+        except Exception:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+                    entry.refresh_at = self.clock() + self.retry_interval
+                    # keep using the old results until a refresh succeeds
+                    entry.expires_at = max(entry.expires_at,
+                                           entry.refresh_at)
+            return
+        self._store(key, addresses)
+
+    @staticmethod
+    def _ordered(entry):
+        addresses = interleave_families(entry.addresses)
+        good = entry.good
+        if good is not None:
+            for i, res in enumerate(addresses):
+                if res[4] == good:
+                    if i:
+                        addresses.insert(0, addresses.pop(i))
+                    break
+        return addresses
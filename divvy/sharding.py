@@ -0,0 +1,179 @@
+from __future__ import absolute_import
+
+from bisect import bisect
+import hashlib
+import threading
+
+from divvy.client import DivvyClient
+from divvy.connection import monotonic
+from divvy.exceptions import ConnectionError, TimeoutError
+from divvy.protocol import Translator
+
+
+def _hash(data):
+    """A hash that is stable across processes, unlike hash()."""
+    return int(hashlib.md5(data).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """A consistent hash ring with virtual nodes.
+
+    Each node is placed on the ring at `replicas` pseudo-random points, and a
+    key belongs to the node at the first point at or after the key's hash.
+    Adding or removing a node only moves the keys that belong to it.
+    """
+
+    def __init__(self, nodes=(), replicas=160):
+        self.replicas = replicas
+        self._nodes = set()
+        # (points, owners) is replaced as a whole, so lookups need no lock
+        self._ring = ((), ())
+        for node in nodes:
+            self._nodes.add(node)
+        self._rebuild()
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add(self, node):
+        if node not in self._nodes:
+            self._nodes.add(node)
+            self._rebuild()
+
+    def remove(self, node):
+        if node in self._nodes:
+            self._nodes.discard(node)
+            self._rebuild()
+
+    def get_node(self, key):
+        """Returns the node that owns key (bytes), or None if the ring is
+        empty."""
+        points, owners = self._ring
+        if not points:
+            return None
+        i = bisect(points, _hash(key))
+        return owners[i % len(owners)]
+
+    def _rebuild(self):
+        ring = sorted(
+            (_hash("{}-{}".format(node, i).encode('utf-8')), node)
+            for node in self._nodes
+            for i in range(self.replicas))
+        self._ring = (tuple(p for p, _ in ring), tuple(n for _, n in ring))
+
+
+class ShardedClient(object):
+    """Spreads checks across several Divvy servers, each of which is reached
+    through its own client.
+
+    Every check is routed by a consistent hash of the HIT arguments named in
+    key_fields (all of them, if key_fields is None), so checks for the same
+    actor always land on the same server. Choose key_fields to match the
+    actorField of your Divvy rules.
+
+    When a server fails, with a ConnectionError or TimeoutError, it is marked
+    down for down_interval seconds, and its checks are routed to the other
+    servers in the meantime. Only that server's keys move, and they move back
+    when it rejoins.
+    """
+
+    def __init__(self, clients, key_fields=None, replicas=160,
+                 down_interval=30.0, encoding='utf-8', clock=monotonic):
+        """clients maps an endpoint name, such as "host:port", to a client
+        for that server."""
+        self.clients = dict(clients)
+        self.key_fields = None if key_fields is None else tuple(key_fields)
+        self.down_interval = down_interval
+        self.translator = Translator(encoding)
+        self.clock = clock
+        self.ring = HashRing(self.clients, replicas=replicas)
+        self._down = {}  # endpoint -> time at which it rejoins
+        self._lock = threading.Lock()
+
+    def routing_key(self, hit_args):
+        """Returns the bytes that checks are hashed by."""
+        if self.key_fields is not None:
+            hit_args = dict((k, hit_args[k]) for k in self.key_fields
+                            if k in hit_args)
+        return self.translator.build_hit(**hit_args)
+
+    def get_endpoint(self, hit_args):
+        """Returns the endpoint that a check with these arguments is routed
+        to, or None if every server is down."""
+        self._rejoin_expired()
+        return self.ring.get_node(self.routing_key(hit_args))
+
+    def check_rate_limit(self, **hit_args):
+        """Perform a check-and-decrement of quota on the server that owns
+        these arguments. See DivvyClient.check_rate_limit()."""
+        endpoint = self.get_endpoint(hit_args)
+        if endpoint is None:
+            return self._no_endpoint()
+        return self._check(endpoint, self.clients[endpoint], hit_args)
+
+    def mark_down(self, endpoint, duration=None):
+        """Stops routing checks to endpoint. It rejoins after duration
+        seconds, or down_interval if duration is None. Pass a duration of
+        float('inf') to keep it down until mark_up() is called."""
+        if duration is None:
+            duration = self.down_interval
+        with self._lock:
+            self._down[endpoint] = self.clock() + duration
+            self.ring.remove(endpoint)
+
+    def mark_up(self, endpoint):
+        """Resumes routing checks to endpoint."""
+        with self._lock:
+            self._down.pop(endpoint, None)
+            if endpoint in self.clients:
+                self.ring.add(endpoint)
+
+    def is_down(self, endpoint):
+        with self._lock:
+            return endpoint in self._down
+
+    def _rejoin_expired(self):
+        with self._lock:
+            if not self._down:
+                return
+            now = self.clock()
+            for endpoint, until in list(self._down.items()):
+                if until <= now:
+                    del self._down[endpoint]
+                    if endpoint in self.clients:
+                        self.ring.add(endpoint)
+
+    def _check(self, endpoint, client, hit_args):
+        """Subclasses may override this to detect failures reported
+        asynchronously."""
+        try:
+            return client.check_rate_limit(**hit_args)
+        except (ConnectionError, TimeoutError):
+            self.mark_down(endpoint)
+            raise
+
+    def _no_endpoint(self):
+        raise ConnectionError("No Divvy servers available")
+
+
+class ShardedDivvyClient(ShardedClient):
+    """A ShardedClient that builds a divvy.client.DivvyClient for each
+    (host, port) in endpoints. Other keyword arguments are passed on to every
+    DivvyClient."""
+
+    def __init__(self, endpoints, key_fields=None, replicas=160,
+                 down_interval=30.0, encoding='utf-8', **client_kwargs):
+        clients = dict(
+            ("{}:{}".format(host, port),
+             DivvyClient(host, port, encoding=encoding, **client_kwargs))
+            for host, port in endpoints)
+        super(ShardedDivvyClient, self).__init__(
+            clients, key_fields=key_fields, replicas=replicas,
+            down_interval=down_interval, encoding=encoding)
+
+    def disconnect(self):
+        for client in self.clients.values():
+            client.disconnect()
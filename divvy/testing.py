@@ -0,0 +1,494 @@
+"""
+A stand-in for a Divvy server, for tests and benchmarks that shouldn't
+depend on a real deployment.
+
+FakeDivvyServer enforces quotas the way Divvy does, according to rules like
+those in Divvy's config.ini, and can be told to misbehave: to answer slowly,
+to return errors, to stop answering, or to reset connections. It can serve
+from a background thread, a subprocess, an asyncio event loop or a Twisted
+reactor. Run `python -m divvy.testing -h` to serve from the command line.
+"""
+
+import asyncio
+from collections import deque
+from fnmatch import fnmatchcase
+import math
+import multiprocessing
+import random
+import re
+import threading
+
+from divvy.connection import monotonic
+
+
+class Rule(object):
+    """A quota, as configured by one section of Divvy's config.ini.
+
+    A HIT matches the rule if, for each name in operation, it has an argument
+    of that name whose value matches the shell-style wildcard. Each distinct
+    value of the actor_field argument gets its own credit_limit, which is
+    restored reset_seconds after the actor's first HIT; if actor_field is
+    None, all HITs that match the rule share one quota.
+    """
+
+    def __init__(self, operation, credit_limit, reset_seconds,
+                 actor_field=None, label=None):
+        self.operation = dict(operation)
+        self.credit_limit = credit_limit
+        self.reset_seconds = reset_seconds
+        self.actor_field = actor_field
+        self.label = label
+
+    def matches(self, hit_args):
+        for k, wildcard in self.operation.items():
+            if k not in hit_args:
+                return False
+            if not fnmatchcase(hit_args[k], wildcard):
+                return False
+        return True
+
+    def __repr__(self):
+        return "Rule({!r}, {}, {}, actor_field={!r})".format(
+            self.operation, self.credit_limit, self.reset_seconds,
+            self.actor_field)
+
+
+_SECTION_REGEXP = re.compile(r'^\[(.*)\]$')
+_SETTING_REGEXP = re.compile(r'^(\w+)\s*=\s*(.*)$')
+
+
+def load_rules(text):
+    """Returns the list of Rules configured by the text of a Divvy
+    config.ini. A [default] section matches every HIT."""
+    rules = []
+    section = None
+
+    def _finish(section):
+        if section is None:
+            return
+        operation, settings = section
+        rules.append(Rule(
+            operation,
+            int(settings.get('creditLimit', 0)),
+            int(settings.get('resetSeconds', 0)),
+            actor_field=settings.get('actorField') or None,
+            label=settings.get('label') or settings.get('comment')))
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith((';', '#')):
+            continue
+        match = _SECTION_REGEXP.match(line)
+        if match:
+            _finish(section)
+            header = match.group(1).strip()
+            operation = {}
+            if header != 'default':
+                for term in header.split():
+                    k, _, v = term.partition('=')
+                    operation[k] = v
+            section = (operation, {})
+            continue
+        match = _SETTING_REGEXP.match(line)
+        if match is None or section is None:
+            raise ValueError("Can't parse config line: {!r}".format(line))
+        section[1][match.group(1)] = match.group(2).strip().strip('\'"')
+    _finish(section)
+    return rules
+
+
+class QuotaTracker(object):
+    """Applies a list of Rules to HITs. Each HIT is counted against the first
+    rule it matches; a HIT that matches no rule is allowed."""
+
+    def __init__(self, rules, clock=monotonic):
+        self.rules = list(rules)
+        self.clock = clock
+        self._buckets = {}  # (rule index, actor) -> [credit, reset time]
+        self._purge_at = 1024
+
+    def hit(self, hit_args):
+        """Counts a HIT, and returns (is_allowed, current_credit,
+        next_reset_seconds)."""
+        for i, rule in enumerate(self.rules):
+            if rule.matches(hit_args):
+                break
+        else:
+            return True, 0, 0
+
+        now = self.clock()
+        key = (i, hit_args.get(rule.actor_field))
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket[1] <= now:
+            if len(self._buckets) >= self._purge_at:
+                self._purge(now)
+            bucket = [rule.credit_limit, now + rule.reset_seconds]
+            self._buckets[key] = bucket
+        allowed = bucket[0] > 0
+        if allowed:
+            bucket[0] -= 1
+        return allowed, bucket[0], int(math.ceil(bucket[1] - now))
+
+    def reset(self):
+        """Restores every quota to its limit."""
+        self._buckets.clear()
+
+    def _purge(self, now):
+        for key, bucket in list(self._buckets.items()):
+            if bucket[1] <= now:
+                del self._buckets[key]
+        # purge again once the live buckets have doubled
+        self._purge_at = max(1024, 2 * len(self._buckets))
+
+
+# Actions that take the place of a reply
+DROP = object()
+RESET = object()
+
+_HIT_ARG_REGEXP = re.compile(r'"([^"]*)"="([^"]*)"')
+
+
+class _FakeConnection(object):
+    """The server's side of one connection, independent of the networking
+    framework: write, abort and call_later are supplied by the framework.
+
+    Replies are written in the order the commands arrived, even if an
+    earlier command was given more latency than a later one, since Divvy
+    clients match replies to requests by order. Replies that are due at the
+    same time are written together.
+    """
+
+    def __init__(self, server, write, abort, call_later):
+        self.server = server
+        self.write = write
+        self.abort = abort
+        self.call_later = call_later
+        self._buffer = b''
+        self._queue = deque()  # (time due, reply or RESET)
+        self._timer = None
+        self._stalled = False
+        self._closed = False
+
+    def data_received(self, data):
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        server = self.server
+        immediate = []
+        for line in lines:
+            if self._stalled:
+                break
+            reply = server.handle_line(line)
+            if reply is None:
+                continue
+            if reply is DROP:
+                # Replies are matched to requests by order, so nothing more
+                # can be answered on this connection.
+                self._stalled = True
+                break
+            delay = server.sample_latency()
+            if not delay and not self._queue and reply is not RESET:
+                immediate.append(reply)
+                continue
+            if immediate:
+                self.write(b''.join(immediate))
+                immediate = []
+            due = monotonic() + delay
+            if self._queue:
+                due = max(due, self._queue[-1][0])
+            self._queue.append((due, reply))
+            if self._timer is None:
+                self._timer = self.call_later(delay, self._flush)
+        if immediate:
+            self.write(b''.join(immediate))
+
+    def _flush(self):
+        self._timer = None
+        if self._closed:
+            return
+        now = monotonic()
+        replies = []
+        while self._queue and self._queue[0][0] <= now:
+            _, reply = self._queue.popleft()
+            if reply is RESET:
+                if replies:
+                    self.write(b''.join(replies))
+                self.abort()
+                return
+            replies.append(reply)
+        if replies:
+            self.write(b''.join(replies))
+        if self._queue:
+            self._timer = self.call_later(
+                max(0, self._queue[0][0] - now), self._flush)
+
+    def connection_lost(self):
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._queue.clear()
+
+
+class _AsyncioProtocol(asyncio.Protocol):
+    def __init__(self, server, loop):
+        self.server = server
+        self.loop = loop
+        self.transport = None
+        self.connection = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connection = _FakeConnection(
+            self.server, transport.write, transport.abort,
+            self.loop.call_later)
+        self.server._connection_made(transport)
+
+    def data_received(self, data):
+        self.connection.data_received(data)
+
+    def connection_lost(self, exc):
+        self.connection.connection_lost()
+        self.server._connection_lost(self.transport)
+
+
+def _serve_forever(server_kwargs, host, port, ready):
+    """Runs a FakeDivvyServer in a subprocess."""
+    server = FakeDivvyServer(**server_kwargs)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    aio_server = loop.run_until_complete(server.serve(host, port))
+    ready.put(aio_server.sockets[0].getsockname()[:2])
+    loop.run_forever()
+
+
+class FakeDivvyServer(object):
+    """A fake Divvy server.
+
+    rules is a list of Rules, or the text of a Divvy config.ini. Faults are
+    injected at random, per command, with the given probabilities:
+
+    - latency seconds, plus up to jitter seconds more, pass before each
+      reply is written, though replies are never reordered.
+    - error_rate: the reply is an ERR, which clients raise as ServerError.
+    - drop_rate: the command, and every later command on its connection, is
+      never answered, as though the server had hung; clients time out.
+    - reset_rate: the connection is reset when the reply is due.
+
+    Pass seed to make the faults reproducible, and clock to control the
+    passage of time for quotas (but not latency). The server's counters,
+    request_count and connection_count, are updated as it runs.
+
+    To serve, call one of start() (from a background thread), start_process()
+    (from a subprocess), serve() (from the running asyncio event loop) or
+    listen_twisted() (from the Twisted reactor).
+    """
+
+    def __init__(self, rules=(), latency=0.0, jitter=0.0, error_rate=0.0,
+                 drop_rate=0.0, reset_rate=0.0, seed=None, clock=monotonic):
+        self._kwargs = dict(
+            rules=rules, latency=latency, jitter=jitter,
+            error_rate=error_rate, drop_rate=drop_rate,
+            reset_rate=reset_rate, seed=seed, clock=clock)
+        if isinstance(rules, str):
+            rules = load_rules(rules)
+        self.quotas = QuotaTracker(rules, clock=clock)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.reset_rate = reset_rate
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.connection_count = 0
+        self.address = None
+        self._transports = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._process = None
+
+    def handle_line(self, line):
+        """Returns the reply to one command, DROP or RESET, or None for a
+        blank line."""
+        line = line.rstrip(b'\r')
+        if not line:
+            return None
+        self.request_count += 1
+        if self.drop_rate or self.reset_rate or self.error_rate:
+            r = self.random.random()
+            if r < self.drop_rate:
+                return DROP
+            r -= self.drop_rate
+            if r < self.reset_rate:
+                return RESET
+            r -= self.reset_rate
+            if r < self.error_rate:
+                return b'ERR unknown "Injected error"\n'
+        command, _, args = line.partition(b' ')
+        if command != b'HIT':
+            return b'ERR unknown-command "Unrecognized command"\n'
+        try:
+            hit_args = dict(_HIT_ARG_REGEXP.findall(args.decode('utf-8')))
+        except UnicodeDecodeError:
+            return b'ERR unknown "Invalid encoding"\n'
+        allowed, credit, reset = self.quotas.hit(hit_args)
+        return "OK {} {} {}\n".format(
+            'true' if allowed else 'false', credit, reset).encode('ascii')
+
+    def sample_latency(self):
+        if self.jitter:
+            return self.latency + self.random.uniform(0, self.jitter)
+        return self.latency
+
+    def _connection_made(self, transport):
+        self.connection_count += 1
+        self._transports.add(transport)
+
+    def _connection_lost(self, transport):
+        self._transports.discard(transport)
+
+    async def serve(self, host='127.0.0.1', port=0):
+        """Starts serving from the running asyncio event loop, and returns
+        the asyncio.Server. The address it is listening on is stored in
+        self.address."""
+        loop = asyncio.get_event_loop()
+        self._server = await loop.create_server(
+            lambda: _AsyncioProtocol(self, loop), host, port)
+        self.address = self._server.sockets[0].getsockname()[:2]
+        return self._server
+
+    def start(self, host='127.0.0.1', port=0):
+        """Starts serving from a new background thread with its own event
+        loop, and returns the (host, port) it is listening on."""
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(self.serve(host, port))
+        self._loop = loop
+        self._thread = threading.Thread(target=loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.address
+
+    def start_process(self, host='127.0.0.1', port=0):
+        """Starts serving from a new subprocess, so that the server doesn't
+        compete with the code under test for the GIL, and returns the (host,
+        port) it is listening on. The server's counters are not updated in
+        this process."""
+        context = multiprocessing.get_context('spawn')
+        ready = context.Queue()
+        self._process = context.Process(
+            target=_serve_forever, args=(self._kwargs, host, port, ready))
+        self._process.daemon = True
+        self._process.start()
+        self.address = tuple(ready.get(timeout=30))
+        return self.address
+
+    def listen_twisted(self, port=0, interface='127.0.0.1', reactor=None):
+        """Starts serving from the Twisted reactor, and returns the
+        IListeningPort."""
+        from twisted.internet.protocol import Factory, Protocol
+        if reactor is None:
+            from twisted.internet import reactor
+        server = self
+
+        class _TwistedProtocol(Protocol):
+            def connectionMade(self):
+                self.connection = _FakeConnection(
+                    server, self.transport.write,
+                    self.transport.abortConnection, reactor.callLater)
+                server._connection_made(self.transport)
+
+            def dataReceived(self, data):
+                self.connection.data_received(data)
+
+            def connectionLost(self, reason):
+                self.connection.connection_lost()
+                server._connection_lost(self.transport)
+
+        factory = Factory.forProtocol(_TwistedProtocol)
+        listening_port = reactor.listenTCP(port, factory, interface=interface)
+        address = listening_port.getHost()
+        self.address = (address.host, address.port)
+        return listening_port
+
+    def reset_connections(self):
+        """Resets every open connection. Safe to call from any thread if the
+        server was started with start(); otherwise, call it from the event
+        loop or reactor that is serving."""
+        if self._loop is not None:
+            done = threading.Event()
+
+            def _reset():
+                self._reset_connections()
+                done.set()
+            self._loop.call_soon_threadsafe(_reset)
+            done.wait()
+        else:
+            self._reset_connections()
+
+    def _reset_connections(self):
+        for transport in list(self._transports):
+            if hasattr(transport, 'abortConnection'):
+                transport.abortConnection()
+            else:
+                transport.abort()
+
+    def stop(self):
+        """Stops serving, if started with start() or start_process(), and
+        closes open connections."""
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+        if self._thread is not None:
+            loop = self._loop
+
+            def _stop():
+                self._server.close()
+                self._reset_connections()
+                loop.stop()
+            loop.call_soon_threadsafe(_stop)
+            self._thread.join()
+            loop.close()
+            self._thread = None
+            self._loop = None
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Runs a fake Divvy server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8321)
+    parser.add_argument("--config", metavar="config.ini", default=None,
+                        help="Divvy configuration file to take rules from")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to wait before each reply")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Up to this many more seconds to wait before "
+                        "each reply")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--reset-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rules = ()
+    if args.config:
+        with open(args.config) as f:
+            rules = f.read()
+    server = FakeDivvyServer(
+        rules, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, drop_rate=args.drop_rate,
+        reset_rate=args.reset_rate, seed=args.seed)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(server.serve(args.host, args.port))
+    print("Serving on {}:{}".format(*server.address))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ from twisted.internet import defer, reactor
 from twisted.internet.defer import Deferred
 from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
-from twisted.internet.error import TimeoutError, ConnectionDone, ConnectionLost
+from twisted.internet.error import TimeoutError, ConnectError, ConnectionDone, ConnectionLost
 from twisted.internet.task import deferLater
 from twisted.logger import Logger
 from twisted.python import log
@@ -14,7 +14,13 @@ from twisted.python.failure import Failure
 from twisted.protocols.basic import LineOnlyReceiver
 from twisted.protocols.policies import TimeoutMixin
 
+from divvy.batching import WriteBatcher
+from divvy.circuit_breaker import BaseCircuitBreakerClient
+from divvy.coalescing import CoalescedResponse
+from divvy.exceptions import DivvyError
+from divvy.instrumentation import Histogram
 from divvy.protocol import Translator
+from divvy.sharding import ShardedClient
 
 
 translator = Translator()
@@ -22,21 +28,101 @@ translator = Translator()
 class DivvyClient(object):
     log = Logger(__name__)
 
-    def __init__(self, host, port, timeout=1.0, encoding='utf-8', debug_mode=False, count_before_reconnect=1000):
+    def __init__(self, host, port, timeout=1.0, encoding='utf-8', debug_mode=False, count_before_reconnect=1000,
+                 connections=1, max_tombstones=None, denial_cache=None, instrumentation=None, max_pending=1000,
+                 max_age=None, batch_writes=False, batch_delay=0.0, batch_bytes=65536, coalescer=None):
         """
         Configures a client that can speak to a Divvy rate limiting server.
+
+        The client opens `connections` independent TCP connections, each with
+        its own FIFO of pending responses and its own reconnection schedule.
+        Every check is sent over the connected connection with the fewest
+        outstanding requests.
+
+        A request that times out keeps its place in the FIFO until the
+        server's late reply arrives and is discarded. If max_tombstones is
+        set, a connection is recycled once it has that many late replies
+        outstanding.
+
+        Each connection is replaced after count_before_reconnect checks, or
+        once it is max_age seconds old, if that is set. The replacement is
+        connected first; new checks then go to it, and the old connection is
+        closed once every check sent over it has been answered or has timed
+        out, so that no check fails because of the rotation.
+
+        If a divvy.cache.DenialCache is given, checks that are known to be
+        denied until their reset time are answered without a round trip.
+
+        If a divvy.instrumentation.Instrumentation is given, it is notified
+        of every send, reply, error and reconnect on every connection.
+
+        Checks made while no connection is up, such as before the first
+        connection is made or while reconnecting, wait for a connection, up
+        to max_pending of them. They are sent together, in one write, as
+        soon as a connection is made, and what is left of their timeout is
+        how long they then wait for a reply. A check that waits longer than
+        its timeout for a connection fails with
+        twisted.internet.error.TimeoutError, and checks made while
+        max_pending are already waiting fail immediately with ConnectionLost.
+        Set max_pending to 0 to fail every check made while disconnected.
+
+        If batch_writes is set, the checks made on a connection in the same
+        reactor iteration, or within batch_delay seconds, are written to it
+        together, as soon as batch_bytes are waiting or at the end of the
+        iteration; see divvy.batching.WriteBatcher. The number of checks in
+        each write is recorded in the batch_sizes Histogram.
+
+        If a divvy.coalescing.Coalescer is given, checks made with
+        coalesce=True share one round trip with any identical check that is
+        already waiting for its reply.
         """
+        if connections < 1:
+            raise ValueError("connections must be a positive integer")
         self.host = host
         self.port = port
         self.timeout = timeout
         self.encoding = encoding
-        self.connected = False
-        self.factory = DivvyFactory(self, self.timeout, self.encoding, debug_mode, count_before_reconnect=count_before_reconnect)
-        reactor.connectTCP(self.host, self.port, self.factory)
         self.debug_mode = debug_mode
-
-
-    def check_rate_limit(self, timeout=None, **hit_args):
+        self.denial_cache = denial_cache
+        self.coalescer = coalescer
+        self.translator = Translator(encoding)
+        self.max_pending = max_pending
+        # checks waiting for a connection: [line, deferred, deadline]
+        self.pendingHits = deque()
+        self.pendingSweep = None
+        self.count_before_reconnect = count_before_reconnect
+        self.max_tombstones = max_tombstones
+        self.instrumentation = instrumentation
+        self.max_age = max_age
+        self.batch_writes = batch_writes
+        self.batch_delay = batch_delay
+        self.batch_bytes = batch_bytes
+        self.batch_sizes = Histogram(lowest=1, highest=1 << 16) if batch_writes else None
+        self.factories = []
+        for _ in range(connections):
+            self.addFactory()
+
+    def addFactory(self):
+        """Opens another connection, and returns its factory."""
+        factory = DivvyFactory(self, self.timeout, self.encoding, self.debug_mode,
+                               count_before_reconnect=self.count_before_reconnect,
+                               max_tombstones=self.max_tombstones, instrumentation=self.instrumentation,
+                               max_age=self.max_age, batch_writes=self.batch_writes, batch_delay=self.batch_delay,
+                               batch_bytes=self.batch_bytes, batch_sizes=self.batch_sizes)
+        self.factories.append(factory)
+        reactor.connectTCP(self.host, self.port, factory)
+        return factory
+
+    @property
+    def factory(self):
+        """The first connection's factory, for single-connection clients."""
+        return self.factories[0]
+
+    @property
+    def connected(self):
+        return any(f.divvyProtocol is not None for f in self.factories)
+
+    def check_rate_limit(self, timeout=None, coalesce=False, **hit_args):
         """
         Perform a check-and-decrement of quota.
 
@@ -45,6 +131,13 @@ class DivvyClient(object):
                 being performed, which will be evaluated by the server against
                 its configuration.
 
+             timeout: Seconds to wait for a reply, including any time spent
+                waiting for a connection. Defaults to the client's timeout.
+
+             coalesce: If the client has a Coalescer, share the reply to an
+                identical check that is already waiting for one. The reply is
+                then a divvy.coalescing.CoalescedResponse.
+
         Returns:
             twisted.internet.defer.Deferred: Callbacks will be executed when we
                 hear back from the server. Callbacks will receive a single
@@ -56,18 +149,162 @@ class DivvyClient(object):
                     next_reset_seconds: time, in seconds, until credit next
                         resets.
         """
-        if not self.connected:
-            # TODO: if not connected, wait `timeout` seconds for the socket to be connected,
-            # (e.g. factory.connection_made_deferred is triggered) and then call
-            # checkRateLimit (look into defer.chainDeferred())
-            return defer.fail(ConnectionLost("Not yet connected"))
+        line = self.translator.build_hit(**hit_args)
+        if self.denial_cache is not None:
+            response = self.denial_cache.get(line)
+            if response is not None:
+                return defer.succeed(response)
+        if coalesce and self.coalescer is not None:
+            return self._checkCoalesced(line, timeout)
+        return self._send(line, timeout)
+
+    def _checkCoalesced(self, line, timeout):
+        coalescer = self.coalescer
+        d = Deferred()
+        flight = coalescer.join(line)
+        if flight is not None:
+            flight.waiters.append(d)
+            return d
+        flight = coalescer.begin(line)
+        flight.waiters.append(d)
+        self._send(line, timeout).addBoth(self._flightLanded, line, flight)
+        return d
+
+    def _flightLanded(self, result, line, flight):
+        self.coalescer.end(line, flight)
+        if not isinstance(result, Failure):
+            result = CoalescedResponse(result, flight.weight)
+        for d in flight.waiters:
+            if not d.called:
+                if isinstance(result, Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+
+    def _send(self, line, timeout):
+        factory = self.pickFactory()
+        if factory is None:
+            d = self.queueHit(line, self.timeout if timeout is None else timeout)
+        elif timeout is None:
+            d = factory.sendHit(line)
+        else:
+            d = factory.sendHit(line, reactor.seconds() + timeout)
+        if self.denial_cache is not None:
+            d.addCallback(self._updateDenialCache, line)
+        return d
 
-        return self.factory.checkRateLimit(hit_args)
+    def _updateDenialCache(self, response, line):
+        self.denial_cache.update(line, response)
+        return response
+
+    def pickFactory(self):
+        """Returns the connected factory with the fewest outstanding requests,
+        or None if no connection is up."""
+        best = None
+        for factory in self.factories:
+            if factory.divvyProtocol is None:
+                continue
+            if best is None or len(factory.deferredResponses) < len(best.deferredResponses):
+                best = factory
+        return best
+
+    def replaceFactory(self, factory):
+        """Starts replacing factory's connection with a new one. factory keeps
+        taking checks until the new connection is made."""
+        if factory.replacement is None and factory in self.factories:
+            factory.replacement = self.addFactory()
+            factory.replacement.replaces = factory
+
+    def factoryConnected(self, factory):
+        """Called when factory's connection is made: retires the connection it
+        replaces, if any, and sends the checks waiting for a connection."""
+        old = factory.replaces
+        if old is not None:
+            factory.replaces = None
+            if old in self.factories:
+                self.factories.remove(old)
+            old.drain()
+        self.flushPending(factory)
+
+    def queueHit(self, line, timeout):
+        """Holds a HIT command until a connection is made, for at most timeout
+        seconds, and returns a Deferred for the server's reply."""
+        if not self.max_pending:
+            return defer.fail(ConnectionLost("Not yet connected"))
+        if not any(f.running for f in self.factories):
+            return defer.fail(ConnectionLost("Client is disconnected"))
+        if len(self.pendingHits) >= self.max_pending:
+            return defer.fail(ConnectionLost(
+                "Not connected, and {} requests are already waiting".format(len(self.pendingHits))))
+        deadline = reactor.seconds() + timeout
+        entry = [line, None, deadline]
+        entry[1] = Deferred(lambda d: self._cancelPending(entry))
+        self.pendingHits.append(entry)
+        if self.pendingSweep is None:
+            self.pendingSweep = reactor.callLater(timeout, self._sweepPending)
+        elif deadline < self.pendingSweep.getTime():
+            self.pendingSweep.reset(timeout)
+        return entry[1]
+
+    def flushPending(self, factory):
+        """Sends every waiting HIT command over factory's new connection, in
+        one write. Each keeps the deadline it was given when it was queued."""
+        if not self.pendingHits:
+            return
+        entries, self.pendingHits = self.pendingHits, deque()
+        if self.pendingSweep is not None:
+            self.pendingSweep.cancel()
+            self.pendingSweep = None
+        sent = factory.sendHits([line for line, _, _ in entries],
+                                [deadline for _, _, deadline in entries])
+        for (_, d, _), sent_d in zip(entries, sent):
+            sent_d.addBoth(self._deliverPending, d)
+
+    @staticmethod
+    def _deliverPending(result, d):
+        if not d.called:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def _cancelPending(self, entry):
+        try:
+            self.pendingHits.remove(entry)
+        except ValueError:
+            pass
+
+    def _sweepPending(self):
+        """Fails the waiting checks that have passed their deadlines."""
+        self.pendingSweep = None
+        now = reactor.seconds()
+        expired = [entry for entry in self.pendingHits if entry[2] <= now]
+        if expired:
+            self.pendingHits = deque(entry for entry in self.pendingHits if entry[2] > now)
+        for _, d, _ in expired:
+            d.errback(TimeoutError(string="No connection to the Divvy server"))
+        if self.pendingHits:
+            deadline = min(entry[2] for entry in self.pendingHits)
+            self.pendingSweep = reactor.callLater(max(0, deadline - now), self._sweepPending)
+
+    def disconnect(self):
+        """Closes every connection and stops reconnecting."""
+        for factory in self.factories:
+            factory.close()
+        if self.pendingSweep is not None:
+            self.pendingSweep.cancel()
+            self.pendingSweep = None
+        entries, self.pendingHits = self.pendingHits, deque()
+        for _, d, _ in entries:
+            d.errback(ConnectionLost("Client is disconnected"))
 
 
 class DivvyProtocol(LineOnlyReceiver):
     log = Logger(__name__)
     count = 0
+    connectedAt = 0.0
+    rotating = False
+    batcher = None
     """
     Twisted handler for network communication with a Divvy server.
     """
@@ -85,29 +322,107 @@ class DivvyProtocol(LineOnlyReceiver):
 
     def connectionMade(self):
         self.log.info("Protocol.connectionMade")
+        self.connectedAt = reactor.seconds()
+        factory = self.factory
+        if factory.batch_writes:
+            self.batcher = WriteBatcher(self.transport.writeSequence, reactor.callLater, factory.batch_delay,
+                                        factory.batch_bytes, factory.batch_sizes)
+        divvy_client = factory.divvy_client
+        if divvy_client is not None:
+            divvy_client.factoryConnected(self.factory)
 
     def checkRateLimit(self, **kwargs):
-        assert self.connected
-        self.count = self.count + 1
-        if self.count > self.max_count:
-            self.count = 0
-            self.transport.loseConnection()
+        return self.sendHit(self.factory.translator.build_hit(**kwargs))
 
-        line = self.factory.translator.build_hit(**kwargs).strip()
+    def sendHit(self, line):
+        """Writes a HIT command, as built by Translator.build_hit()."""
+        assert self.connected
         if self.debug_mode:
             self.log.debug("DivvyClient: Sent {line}", line=line)
-        self.sendLine(line)
+        if self.batcher is not None:
+            self.batcher.write(line)
+        else:
+            self.transport.write(line)
+        self.countSent(1)
         return self
 
+    def sendHits(self, lines):
+        """Writes several HIT commands at once."""
+        assert self.connected
+        if self.debug_mode:
+            for line in lines:
+                self.log.debug("DivvyClient: Sent {line}", line=line)
+        if self.batcher is not None:
+            self.batcher.write_lines(lines)
+        else:
+            self.transport.write(b"".join(lines))
+        self.countSent(len(lines))
+        return self
+
+    def connectionLost(self, reason):
+        if self.batcher is not None:
+            self.batcher.discard()
+        LineOnlyReceiver.connectionLost(self, reason)
+
+    def countSent(self, count):
+        """Asks the factory to rotate the connection once it has carried
+        max_count requests or is max_age seconds old."""
+        self.count = self.count + count
+        if self.rotating:
+            return
+        max_age = self.factory.max_age
+        if self.count > self.max_count or (max_age is not None and reactor.seconds() - self.connectedAt >= max_age):
+            self.rotating = True
+            self.log.info("DivvyClient: rotating connection after {count} requests", count=self.count)
+            self.factory.rotate()
+
+    def dataReceived(self, data):
+        """Parses every complete reply in data in a single pass."""
+        results, self._buffer = self.factory.translator.parse_replies(self._buffer + data)
+        for result in results:
+            self.replyReceived(result)
+        if len(self._buffer) > self.MAX_LENGTH:
+            return self.lineLengthExceeded(self._buffer)
+
     def lineReceived(self, line):
-        deferred = self.factory.deferredResponses.popleft()
         try:
-            if self.debug_mode:
-                self.log.debug("DivvyClient: Received {line}", line=line)
-            response = self.factory.translator.parse_reply(line)
-            deferred.callback(response)
-        except Exception as e:
-            deferred.errback(e)
+            result = self.factory.translator.parse_reply(line)
+        except DivvyError as e:
+            result = e
+        self.replyReceived(result)
+
+    def replyReceived(self, result):
+        """Delivers a parsed reply, a divvy.Response or the DivvyError raised
+        while parsing it, to the oldest pending request."""
+        factory = self.factory
+        if self.debug_mode:
+            self.log.debug("DivvyClient: Received {result}", result=result)
+        if not factory.deferredResponses:
+            self.log.error("DivvyClient: unexpected reply {result}", result=result)
+            return
+        deferred = factory.deferredResponses.popleft()
+        if factory.deadlines and factory.deadlines[0][1] is deferred:
+            factory.deadlines.popleft()
+        sequence = factory.receivedSequence
+        factory.receivedSequence += 1
+        instrumentation = factory.instrumentation
+        if instrumentation is not None:
+            instrumentation.on_reply(reactor.seconds() - factory.sentTimes.popleft())
+            instrumentation.on_queue_depth(len(factory.deferredResponses))
+            if isinstance(result, Exception):
+                instrumentation.on_error(result)
+        if deferred.called:
+            # tombstone: the request timed out, so this late reply belongs to
+            # nobody and must not be handed to the next request in line
+            factory.tombstones -= 1
+            self.log.info("DivvyClient: discarding late reply to request #{sequence}",
+                          sequence=sequence)
+        elif isinstance(result, Exception):
+            deferred.errback(result)
+        else:
+            deferred.callback(result)
+        if factory.draining:
+            factory.closeIfDrained()
 
 
 class DivvyFactory(ReconnectingClientFactory):
@@ -120,7 +435,22 @@ class DivvyFactory(ReconnectingClientFactory):
     """
     protocol = DivvyProtocol
 
-    def __init__(self, divvy_client, timeout=1.0, encoding='utf-8', debug_mode=False, count_before_reconnect=10000):
+    def __init__(self, divvy_client=None, timeout=1.0, encoding='utf-8', debug_mode=False, count_before_reconnect=10000,
+                 max_tombstones=None, instrumentation=None, max_age=None, batch_writes=False, batch_delay=0.0,
+                 batch_bytes=65536, batch_sizes=None):
+        """
+        If max_tombstones is set, the connection is recycled once that many
+        timed-out requests are still waiting for their late replies.
+
+        The connection is rotated after count_before_reconnect requests, or
+        once it is max_age seconds old; see rotate().
+
+        If batch_writes is set, requests are written through a
+        divvy.batching.WriteBatcher, which records the size of each write in
+        the batch_sizes Histogram, if given.
+
+        instrumentation, if given, is a divvy.instrumentation.Instrumentation.
+        """
         self.divvy_client = divvy_client
         self.timeout = timeout
         self.translator = Translator(encoding)
@@ -131,6 +461,38 @@ class DivvyFactory(ReconnectingClientFactory):
         self.addr = None
         self.debug_mode = debug_mode
         self.count_before_reconnect = count_before_reconnect
+        self.max_tombstones = max_tombstones
+        self.instrumentation = instrumentation
+        self.max_age = max_age
+        self.batch_writes = batch_writes
+        self.batch_delay = batch_delay
+        self.batch_bytes = batch_bytes
+        self.batch_sizes = batch_sizes
+        # set while the connection is closing once its requests are answered
+        self.draining = False
+        # the factory taking over from this one, and the one this replaces
+        self.replacement = None
+        self.replaces = None
+        # (deadline, deferred) for each request that has neither been
+        # answered nor timed out, oldest first, and the one delayed call that
+        # fails the requests whose deadlines have passed
+        self.deadlines = deque()
+        self.timeoutSweep = None
+        # when each pending request was sent; only kept if instrumented
+        self.sentTimes = deque()
+        self.resetSequence()
+
+    def resetSequence(self):
+        """Restart request numbering, for a new connection.
+
+        Requests are numbered in the order they are written, and replies in
+        the order they arrive; since the server answers in order, reply #N
+        always belongs to request #N. Timed-out requests stay in the FIFO as
+        tombstones so that their late replies are discarded, not misrouted.
+        """
+        self.sentSequence = 0
+        self.receivedSequence = 0
+        self.tombstones = 0
 
     def buildProtocol(self, addr):
         self.resetDelay()
@@ -138,44 +500,176 @@ class DivvyFactory(ReconnectingClientFactory):
         self.divvyProtocol = ReconnectingClientFactory.buildProtocol(self, addr)
         self.divvyProtocol.setReconnectCount(self.count_before_reconnect)
         self.divvyProtocol.debug_mode = self.debug_mode
-        self.divvy_client.connected = True
+        self.draining = False
+        self.resetSequence()
         self.connection_made_deferred.callback(True)
         return self.divvyProtocol
 
     def checkRateLimit(self, hit_args):
-        if self.divvyProtocol is None:
-            # fail immediately if not connected
-            return defer.fail(ConnectionLost("on checkRateLimit"))
         if self.debug_mode:
             self.log.debug("DivvyClient: Checking ratelimit {hit_args}", hit_args=hit_args)
-        self.divvyProtocol.checkRateLimit(**hit_args)
-        return self.newDeferredResponse()
+        return self.sendHit(self.translator.build_hit(**hit_args))
 
-    def newDeferredResponse(self):
+    def sendHit(self, line, deadline=None):
+        """Sends a HIT command, as built by Translator.build_hit(), and returns
+        a Deferred for the server's reply. The reply is waited for until
+        deadline, in reactor.seconds(), or for timeout seconds if it is None."""
+        if self.divvyProtocol is None or self.draining:
+            # fail immediately if not connected
+            return defer.fail(ConnectionLost("on checkRateLimit"))
+        self.divvyProtocol.sendHit(line)
+        d = self.newDeferredResponse(deadline)
+        if self.instrumentation is not None:
+            self.sentTimes.append(reactor.seconds())
+            self.instrumentation.on_send(1)
+            self.instrumentation.on_queue_depth(len(self.deferredResponses))
+        return d
+
+    def sendHits(self, lines, deadlines=None):
+        """Sends several HIT commands in one write, and returns a list of
+        Deferreds for the server's replies. deadlines, if given, holds the
+        deadline for each command, as for sendHit()."""
+        if self.divvyProtocol is None or self.draining:
+            return [defer.fail(ConnectionLost("on checkRateLimit")) for _ in lines]
+        self.divvyProtocol.sendHits(lines)
+        if deadlines is None:
+            deadlines = [None] * len(lines)
+        deferreds = [self.newDeferredResponse(deadline) for deadline in deadlines]
+        if self.instrumentation is not None:
+            self.sentTimes.extend([reactor.seconds()] * len(lines))
+            self.instrumentation.on_send(len(lines))
+            self.instrumentation.on_queue_depth(len(self.deferredResponses))
+        return deferreds
+
+    def newDeferredResponse(self, deadline=None):
         """Make a lifetime limited response and save it in a FIFO queue
 
         Responses are associated to requests based only in the order
         assuming the server send reponses in the same order as it receive requests
         """
         d = Deferred()
-        d.addTimeout(self.timeout, reactor)
-        d.addErrback(self.cleanupOnTimeout, d)
+        d.addErrback(self.cleanupOnTimeout, self.sentSequence)
+        self.sentSequence += 1
         self.deferredResponses.append(d)
+        now = reactor.seconds()
+        if deadline is None:
+            deadline = now + self.timeout
+        deadlines = self.deadlines
+        if deadlines and deadline < deadlines[-1][0]:
+            # most requests share the factory's timeout, so deadlines come in
+            # order and one delayed call, for the oldest, covers them all; a
+            # request due before those already waiting gets its own
+            expiry = reactor.callLater(max(0, deadline - now), self.expire, d)
+            d.addBoth(self._cancelExpiry, expiry)
+            return d
+        deadlines.append((deadline, d))
+        if self.timeoutSweep is None:
+            self.timeoutSweep = reactor.callLater(max(0, deadline - now), self.sweepTimeouts)
+        elif deadline < self.timeoutSweep.getTime():
+            self.timeoutSweep.reset(max(0, deadline - now))
         return d
 
-    def cleanupOnTimeout(self, err, d):
-        """Called when a deferred response timeouts to remove it from the FIFO queue
+    @staticmethod
+    def _cancelExpiry(result, expiry):
+        if expiry.active():
+            expiry.cancel()
+        return result
+
+    @staticmethod
+    def expire(d):
+        """Fails a request that has not been answered by its deadline."""
+        if not d.called:
+            d.errback(defer.TimeoutError("No reply before the check's deadline"))
+
+    def sweepTimeouts(self):
+        """Fails the requests whose deadlines have passed, and schedules the
+        next sweep for the oldest request still waiting.
+
+        Answered requests leave deadlines when their reply arrives, and
+        timed-out ones when they are failed, so each request is looked at
+        here at most once however many tombstones build up.
+        """
+        self.timeoutSweep = None
+        now = reactor.seconds()
+        deadlines = self.deadlines
+        while deadlines:
+            deadline, d = deadlines[0]
+            if d.called:
+                deadlines.popleft()
+            elif deadline <= now:
+                deadlines.popleft()
+                self.expire(d)
+            else:
+                break
+        if deadlines and self.timeoutSweep is None:
+            self.timeoutSweep = reactor.callLater(deadlines[0][0] - now, self.sweepTimeouts)
+
+    def cancelTimeouts(self):
+        self.deadlines.clear()
+        if self.timeoutSweep is not None:
+            self.timeoutSweep.cancel()
+            self.timeoutSweep = None
+
+    def cleanupOnTimeout(self, err, sequence):
+        """Called when a deferred response fails. If it timed out or was
+        cancelled, it is still in the FIFO queue, and stays there as a
+        tombstone until the server's late reply arrives. (Other failures are
+        delivered after the deferred has left the queue.)
         """
-        if isinstance(err, TimeoutError):
-            self.log.error("DivvyClient: request timeout {err}", err=err)
-            # O(n) worst case, O(1) if all timeouts are the same
-            self.deferredResponses.remove(d)
+        if err.check(defer.TimeoutError, defer.CancelledError):
+            if err.check(defer.TimeoutError):
+                self.log.error("DivvyClient: request #{sequence} timeout {err}", sequence=sequence, err=err)
+                if self.instrumentation is not None:
+                    self.instrumentation.on_error(err.value)
+            self.tombstones += 1
+            if (self.max_tombstones is not None and self.tombstones >= self.max_tombstones
+                    and self.divvyProtocol is not None):
+                self.log.error("DivvyClient: {tombstones} late replies outstanding, recycling connection",
+                               tombstones=self.tombstones)
+                self.divvyProtocol.transport.loseConnection()
+        if self.draining:
+            self.closeIfDrained()
         return err
 
+    def rotate(self):
+        """Replaces the connection without failing the requests sent over it.
+
+        With a DivvyClient, a new connection is opened and takes over once it
+        is up, and this one is then drained. A standalone factory has no
+        connection to hand over to, so rotation is not make-before-break: it
+        stops taking requests, drains its connection and reconnects once it
+        has closed, and requests made in the meantime fail with
+        ConnectionLost.
+        """
+        if self.divvy_client is not None and self.running:
+            self.divvy_client.replaceFactory(self)
+        else:
+            self.draining = True
+
+    def drain(self):
+        """Stops reconnecting, and closes the connection once every request
+        sent over it has been answered or has timed out."""
+        self.running = False
+        self.stopTrying()
+        if self.divvyProtocol is not None:
+            self.draining = True
+            self.closeIfDrained()
+
+    def closeIfDrained(self):
+        if self.divvyProtocol is None:
+            return
+        # every request still in the FIFO has been answered or is a tombstone
+        if len(self.deferredResponses) > self.tombstones:
+            return
+        protocol, self.divvyProtocol = self.divvyProtocol, None
+        self.log.info("DivvyClient: connection drained, closing")
+        protocol.transport.loseConnection()
+
     def close(self, *_):
         # self.log.debug("client connection closed properly")
         self.running = False
         self.stopTrying()  # cancel possible reconnection delayed call
+        self.cancelTimeouts()
         if self.divvyProtocol:
             self.divvyProtocol.transport.loseConnection()
 
@@ -187,20 +681,30 @@ class DivvyFactory(ReconnectingClientFactory):
         # cleanup all pending responses
         while self.deferredResponses:
             d = self.deferredResponses.popleft()
-            d.errback(reason)
-
-        # retry if required
+            if not d.called:
+                if self.instrumentation is not None:
+                    self.instrumentation.on_error(reason.value)
+                d.errback(reason)
+        self.sentTimes.clear()
+        self.cancelTimeouts()
+        self.resetSequence()
+
+        # retry if required, unless another connection has taken over
+        if self.replacement is not None:
+            self.running = False
         if self.running:
+            if self.instrumentation is not None:
+                self.instrumentation.on_reconnect()
+                self.instrumentation.on_queue_depth(0)
             ReconnectingClientFactory.retry(self, connector)
 
     def startedConnecting(self, connector):
         self.log.info('Started to connect.')
 
     def clientConnectionLost(self, connector, reason):
-        self.divvy_client.connected = False
         if reason.check(ConnectionDone) and not self.running:
             # shall not have pending responses on regular disconnection
-            assert not self.deferredResponses
+            assert all(d.called for d in self.deferredResponses)
         self.log.info("DivvyClient: connection lost {reason}", reason=reason )
         self.retry(connector, reason)
 
@@ -209,5 +713,79 @@ class DivvyFactory(ReconnectingClientFactory):
         self.retry(connector, reason)
 
 
+class ShardedDivvyClient(ShardedClient):
+    """
+    Spreads checks across several Divvy servers by consistent hashing; see
+    divvy.sharding.ShardedClient. Builds a DivvyClient for each (host, port)
+    in endpoints, passing it the other keyword arguments.
+
+    A server is marked down when a check fails because its connection is
+    lost or the reply timed out, and rejoins after down_interval seconds.
+    """
+
+    def __init__(self, endpoints, key_fields=None, replicas=160, down_interval=30.0, encoding='utf-8',
+                 **client_kwargs):
+        clients = dict(
+            ("{}:{}".format(host, port), DivvyClient(host, port, encoding=encoding, **client_kwargs))
+            for host, port in endpoints)
+        super().__init__(clients, key_fields=key_fields, replicas=replicas, down_interval=down_interval,
+                         encoding=encoding)
+
+    def _check(self, endpoint, client, hit_args):
+        d = client.check_rate_limit(**hit_args)
+        d.addErrback(self._checkFailed, endpoint)
+        return d
+
+    def _checkFailed(self, failure, endpoint):
+        if failure.check(ConnectionLost, ConnectionDone, ConnectError, TimeoutError, defer.TimeoutError):
+            self.mark_down(endpoint)
+        return failure
+
+    def _no_endpoint(self):
+        return defer.fail(ConnectionLost("No Divvy servers available"))
+
+    def disconnect(self):
+        for client in self.clients.values():
+            client.disconnect()
+
+
+class CircuitBreakerClient(BaseCircuitBreakerClient):
+    """
+    Wraps a DivvyClient with a divvy.circuit_breaker.CircuitBreaker.
+
+    Checks that fail because the connection is down or the reply timed out
+    count as failures, and their Deferreds fire with the breaker's policy
+    Response instead of failing. While the breaker is open, checks are
+    answered by the policy immediately. Other failures pass through.
+
+    DivvyClient reconnects by itself, so the background probe just checks,
+    every probe_interval seconds, whether a connection is up.
+    """
+
+    FAILURES = BaseCircuitBreakerClient.FAILURES + (
+        ConnectionLost, ConnectionDone, ConnectError, TimeoutError, defer.TimeoutError)
+
+    def __init__(self, client, breaker=None, probe_interval=0.1):
+        super().__init__(client, breaker)
+        self.probe_interval = probe_interval
+
+    def check_rate_limit(self, timeout=None, **hit_args):
+        response = self._admit(hit_args)
+        if response is not None:
+            return defer.succeed(response)
+        d = self.client.check_rate_limit(timeout, **hit_args)
+        d.addCallbacks(self._succeeded, self._checkFailed, errbackArgs=(hit_args,))
+        return d
+
+    def _checkFailed(self, failure, hit_args):
+        failure.trap(*self.FAILURES)
+        return self._failed(failure.value, hit_args)
+
+    def _start_probe(self):
+        reactor.callLater(self.probe_interval, self._probe)
+
+    def _probe(self):
+        self._probed(self.client.connected)
+
 
-__all__ = ["DivvyClient"]
+__all__ = ["CircuitBreakerClient", "DivvyClient", "ShardedDivvyClient"]
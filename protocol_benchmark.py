@@ -0,0 +1,93 @@
+from __future__ import print_function
+from argparse import ArgumentParser
+import itertools
+import random
+import timeit
+
+from divvy.exceptions import InputError
+from divvy.protocol import StringTypes, Translator
+
+
+def _random_ip():
+    return '.'.join([str(random.randrange(256)) for _ in range(4)])
+
+
+def _original_build_hit(translator, **kwargs):
+    """Translator.build_hit() as it was before fragments were cached, for
+    comparison: validates every key and value, and concatenates bytes."""
+    cmd = b"HIT"
+    for k in sorted(kwargs.keys()):
+        v = kwargs[k]
+        if not isinstance(v, StringTypes):
+            v = str(v)
+        if not translator.STRING_REGEXP.match(k):
+            raise InputError("Invalid Divvy key {}".format(k))
+        if not translator.STRING_REGEXP.match(v):
+            raise InputError("Invalid Divvy value {}".format(v))
+        cmd += b" \"" + k.encode(translator.encoding) + b"\"=\"" + \
+            v.encode(translator.encoding) + b"\""
+    cmd += b"\n"
+    return cmd
+
+
+def _time(fn, number):
+    """Returns the best of three timings of number calls to fn."""
+    return min(timeit.repeat(fn, number=number, repeat=3))
+
+
+def _report(name, seconds, count):
+    print("{}{:.3f} us per call".format(
+        (name + ":").ljust(40), seconds / count * 1e6))
+
+
+def main():
+    desc = "Measures the per-call cost of divvy-client-python's encoding " \
+        "and parsing of Divvy protocol messages."
+    parser = ArgumentParser(description=desc)
+    parser.add_argument("-n", dest="count", metavar="calls",
+                        type=int, default=100000,
+                        help="Number of calls to time for each case")
+    parser.add_argument("-k", dest="unique", metavar="unique_values",
+                        type=int, default=1000,
+                        help="Number of distinct IP addresses to cycle "
+                             "through")
+    args = parser.parse_args()
+
+    translator = Translator()
+    template = translator.template('type', 'ip')
+    ips = [_random_ip() for _ in range(args.unique)]
+    hits = [{'type': 'benchmark', 'ip': ip} for ip in ips]
+
+    def _cycle(fn):
+        kwargs = itertools.cycle(hits)
+        return lambda: fn(**next(kwargs))
+
+    n = args.count
+
+    def original(**kwargs):
+        return _original_build_hit(translator, **kwargs)
+
+    _report("build_hit (original)",
+            _time(_cycle(original), number=n), n)
+    _report("Translator.build_hit",
+            _time(_cycle(translator.build_hit), number=n), n)
+    _report("Translator.build_hit (no value cache)",
+            _time(_cycle(Translator(value_cache_size=0).build_hit),
+                  number=n), n)
+    _report("HitTemplate.build_hit",
+            _time(_cycle(template.build_hit), number=n), n)
+
+    reply = b"OK true 575 60\n"
+    _report("Translator.parse_reply",
+            _time(lambda: translator.parse_reply(reply), number=n), n)
+    _report("Translator.parse_reply (regex)",
+            _time(lambda: translator._parse_reply_slow(reply),
+                  number=n), n)
+    replies = reply * 100
+    _report("Translator.parse_replies (per reply)",
+            _time(lambda: translator.parse_replies(replies),
+                  number=n // 100), n)
+
+
+if __name__ == '__main__':
+    main()
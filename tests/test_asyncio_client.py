@@ -0,0 +1,114 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from divvy import asyncio_client
+from divvy.coalescing import Coalescer
+from divvy.exceptions import ConnectionError, TimeoutError
+from divvy.protocol import Response
+
+
+class AsyncioClientTest(IsolatedAsyncioTestCase):
+    """Runs the client against a mock divvy server, which replies to each
+    HIT with its "credit" argument after an optional "delay"."""
+
+    async def asyncSetUp(self):
+        self.writers = []
+        self.server = await asyncio.start_server(
+            self._handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.client = asyncio_client.DivvyClient(
+            '127.0.0.1', self.port, timeout=1.0, initial_delay=0.01)
+
+    async def asyncTearDown(self):
+        self.client.close()
+        self.server.close()
+        for writer in self.writers:
+            writer.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.writers.append(writer)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            args = dict(arg.split(b'=') for arg in line.split()[1:])
+            delay = float(args.get(b'"delay"', b'"0"').strip(b'"'))
+            credit = args.get(b'"credit"', b'"575"').strip(b'"')
+            if delay:
+                await asyncio.sleep(delay)
+            writer.write(b'OK true ' + credit + b' 60\n')
+
+    async def test_check_rate_limit(self):
+        r = await self.client.check_rate_limit(credit=5)
+        self.assertEqual(Response(True, 5, 60), r)
+        self.assertTrue(self.client.connected)
+
+    async def test_pipelining(self):
+        results = await asyncio.gather(*[
+            self.client.check_rate_limit(credit=i) for i in range(200)])
+        self.assertEqual([Response(True, i, 60) for i in range(200)],
+                         results)
+
+    async def test_batch_writes(self):
+        client = asyncio_client.DivvyClient(
+            '127.0.0.1', self.port, batch_writes=True)
+        self.addCleanup(client.close)
+        await client.connect()
+        results = await asyncio.gather(*[
+            client.check_rate_limit(credit=i) for i in range(50)])
+        self.assertEqual([Response(True, i, 60) for i in range(50)],
+                         results)
+        self.assertEqual(1, client.batch_sizes.count)
+        self.assertEqual(50, client.batch_sizes.max)
+
+    async def test_coalescing(self):
+        self.client.coalescer = Coalescer()
+        results = await asyncio.gather(*[
+            self.client.check_rate_limit(coalesce=True, credit=5, delay=0.01)
+            for _ in range(10)])
+        self.assertEqual([Response(True, 5, 60)] * 10, results)
+        self.assertEqual([10] * 10, [r.weight for r in results])
+        self.assertEqual(1, self.client.coalescer.round_trips)
+        self.assertEqual(0.9, self.client.coalescer.ratio)
+
+    async def test_coalesced_timeout(self):
+        self.client.coalescer = Coalescer()
+        results = await asyncio.gather(*[
+            self.client.check_rate_limit(
+                timeout=0.05, coalesce=True, credit=1, delay=0.1)
+            for _ in range(2)], return_exceptions=True)
+        self.assertEqual([TimeoutError] * 2, [type(r) for r in results])
+        self.assertEqual(0, len(self.client.coalescer))
+
+    async def test_timeout_discards_late_reply(self):
+        with self.assertRaises(TimeoutError):
+            await self.client.check_rate_limit(
+                timeout=0.05, credit=1, delay=0.1)
+        r = await self.client.check_rate_limit(credit=2)
+        self.assertEqual(Response(True, 2, 60), r)
+
+    async def test_reconnect(self):
+        await self.client.check_rate_limit()
+        for writer in self.writers:
+            writer.close()
+        await asyncio.sleep(0.05)
+        r = await self.client.check_rate_limit(credit=3)
+        self.assertEqual(Response(True, 3, 60), r)
+
+    async def test_connection_lost_fails_pending(self):
+        await self.client.connect()
+        d = asyncio.ensure_future(
+            self.client.check_rate_limit(credit=1, delay=0.5))
+        await asyncio.sleep(0.01)
+        self.client.protocol.transport.abort()
+        with self.assertRaises(ConnectionError):
+            await d
+
+    async def test_write_after_connection_lost(self):
+        protocol = asyncio_client.DivvyProtocol(self.client)
+        future = asyncio.get_running_loop().create_future()
+        protocol.check_rate_limit(b'HIT\n', future)
+        with self.assertRaises(ConnectionError):
+            await future
+        self.assertEqual(0, len(protocol.pending_responses))
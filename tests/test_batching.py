@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+from twisted.internet import task
+
+from divvy.batching import WriteBatcher
+from divvy.instrumentation import Histogram
+
+
+class WriteBatcherTest(TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.writes = []
+        self.sizes = Histogram(lowest=1, highest=1 << 16)
+        self.batcher = WriteBatcher(self.writes.append, self.clock.callLater,
+                                    max_bytes=32, sizes=self.sizes)
+
+    def test_writes_once_per_tick(self):
+        self.batcher.write(b'HIT "a"="1"\n')
+        self.batcher.write_lines([b'HIT\n', b'HIT\n'])
+        self.assertEqual([], self.writes)
+        self.clock.advance(0)
+        self.assertEqual([[b'HIT "a"="1"\n', b'HIT\n', b'HIT\n']],
+                         self.writes)
+        self.assertEqual(1, self.sizes.count)
+        self.assertEqual(3, self.sizes.max)
+
+    def test_writes_at_max_bytes(self):
+        for _ in range(8):
+            self.batcher.write(b'HIT\n')
+        self.assertEqual([[b'HIT\n'] * 8], self.writes)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.batcher.write(b'HIT\n')
+        self.clock.advance(0)
+        self.assertEqual([[b'HIT\n'] * 8, [b'HIT\n']], self.writes)
+
+    def test_delay(self):
+        self.batcher.delay = 0.01
+        self.batcher.write(b'HIT\n')
+        self.clock.advance(0.005)
+        self.batcher.write(b'HIT\n')
+        self.clock.advance(0.005)
+        self.assertEqual([[b'HIT\n'] * 2], self.writes)
+
+    def test_discard(self):
+        self.batcher.write(b'HIT\n')
+        self.batcher.discard()
+        self.clock.advance(0)
+        self.assertEqual([], self.writes)
+        self.assertEqual(0, self.sizes.count)
@@ -0,0 +1,89 @@
+import io
+import random
+import unittest
+
+from divvy.benchmark import report
+from divvy.instrumentation import Histogram
+
+
+def make_summary(latencies, elapsed_time, **config):
+    times = Histogram(lowest=0.001, highest=3600000.0)
+    for latency in latencies:
+        times.record(latency)
+    return {
+        'config': dict({'implementation': 'threaded', 'concurrency': 4},
+                       **config),
+        'elapsed_time': elapsed_time,
+        'finished_count': len(latencies),
+        'error_count': 0,
+        'requests_per_second': len(latencies) / elapsed_time,
+        'percentiles': {'50': times.percentile(50),
+                        '99': times.percentile(99)},
+        'response_times': times.to_dict(),
+    }
+
+
+class CompareTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(42)
+
+    def latencies(self, count, scale=1.0):
+        return [self.random.expovariate(1.0) * scale for _ in range(count)]
+
+    def test_same_distribution(self):
+        baseline = make_summary(self.latencies(20000), 10.0)
+        current = make_summary(self.latencies(20000), 10.0)
+        self.assertEqual(report.compare(baseline, current), [])
+
+    def test_slower(self):
+        baseline = make_summary(self.latencies(20000), 10.0)
+        current = make_summary(self.latencies(20000, scale=1.5), 15.0)
+        regressions = report.compare(baseline, current)
+        metrics = [r.metric for r in regressions]
+        self.assertEqual(metrics,
+                         ["requests_per_second", "p50", "p99", "p99.9"])
+        self.assertAlmostEqual(regressions[0].change, 1 / 3.0)
+        self.assertAlmostEqual(regressions[2].change, 0.5, delta=0.1)
+
+    def test_too_few_samples(self):
+        # a large relative change, but not enough evidence of it
+        baseline = make_summary(self.latencies(10), 0.01)
+        current = make_summary(self.latencies(10, scale=1.2), 0.012)
+        self.assertEqual(report.compare(baseline, current), [])
+
+    def test_print_comparison(self):
+        baseline = make_summary(self.latencies(20000), 10.0)
+        current = make_summary(self.latencies(20000, scale=1.5), 15.0,
+                               concurrency=8)
+        out = io.StringIO()
+        report.print_comparison(
+            baseline, current, report.compare(baseline, current), file=out)
+        self.assertIn("different settings: concurrency", out.getvalue())
+        self.assertIn("requests_per_second:", out.getvalue())
+
+    def test_address_not_compared(self):
+        baseline = make_summary([0.1], 1.0, host='localhost', port=1234)
+        current = make_summary([0.1], 1.0, host='127.0.0.1', port=5678)
+        self.assertEqual([], report.config_differences(baseline, current))
+
+
+class OutputTest(unittest.TestCase):
+    def test_csv(self):
+        summary = make_summary([1.0, 2.0, 3.0], 1.0, rate=None)
+        out = io.StringIO()
+        report.write_csv(summary, out)
+        header, row = out.getvalue().splitlines()
+        header = header.split(",")
+        row = row.split(",")
+        self.assertEqual(header[:3], ["config_concurrency",
+                                      "config_implementation", "config_rate"])
+        self.assertEqual(row[:3], ["4", "threaded", ""])
+        self.assertEqual(header[-2:], ["p50", "p99"])
+        self.assertNotIn("response_times", header)
+
+    def test_json_round_trip(self):
+        summary = make_summary([1.0, 2.0, 3.0], 1.0)
+        out = io.StringIO()
+        report.write_json(summary, out)
+        out.seek(0)
+        self.assertEqual(report.read_json(out), summary)
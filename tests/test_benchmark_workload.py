@@ -0,0 +1,60 @@
+from collections import Counter
+import unittest
+
+from divvy.benchmark.workload import Workload
+
+
+class WorkloadTest(unittest.TestCase):
+    def counts(self, workload, count, field='ip'):
+        return Counter(workload.params()[field] for _ in range(count))
+
+    def test_uniform(self):
+        w = Workload(10, seed=1)
+        counts = self.counts(w, 10000)
+        self.assertEqual(10, len(counts))
+        self.assertTrue(all(800 < n < 1200 for n in counts.values()))
+        self.assertEqual({'type', 'ip'}, set(w.params()))
+
+    def test_zipf(self):
+        w = Workload(1000, distribution='zipf', zipf_exponent=1.0,
+                     seed=1)
+        counts = self.counts(w, 20000).most_common()
+        # the top key gets about 1/H(1000) of the traffic, about 13%
+        self.assertAlmostEqual(0.134, counts[0][1] / 20000.0, delta=0.015)
+        self.assertAlmostEqual(2.0, counts[0][1] / float(counts[1][1]),
+                               delta=0.3)
+
+    def test_hotspot(self):
+        w = Workload(1000, distribution='hotspot', hot_keys=0.01,
+                     hot_traffic=0.9, seed=1)
+        counts = self.counts(w, 20000).most_common()
+        hot = sum(n for _, n in counts[:10])
+        self.assertAlmostEqual(0.9, hot / 20000.0, delta=0.01)
+
+    def test_shapes(self):
+        w = Workload(5, shapes=('login', 'api'), seed=1)
+        login, api = w.params(), w.params()
+        self.assertEqual('/login', login['path'])
+        self.assertTrue(api['user'].startswith('user'))
+        self.assertEqual('/login', w.params()['path'])
+
+    def test_streams_share_keys(self):
+        a = Workload(50, seed=7, stream=0)
+        b = Workload(50, seed=7, stream=1)
+        self.assertEqual(set(self.counts(a, 1000)),
+                         set(self.counts(b, 1000)))
+        self.assertNotEqual([a.params() for _ in range(10)],
+                            [b.params() for _ in range(10)])
+
+    def test_large_key_space(self):
+        w = Workload(10 ** 6, seed=1)
+        # 100000 draws from a million keys give about 95000 distinct ones
+        self.assertGreater(len(self.counts(w, 100000)), 94000)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, Workload, 10, distribution='pareto')
+        self.assertRaises(ValueError, Workload, 10, shapes=('nope',))
+
+    def test_at_least_one_key(self):
+        w = Workload(0)
+        self.assertEqual(1, len(self.counts(w, 3)))
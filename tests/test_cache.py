@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from divvy.cache import DenialCache
+from divvy.protocol import Response
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class DenialCacheTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = DenialCache(max_size=2, clock=self.clock)
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get(b'HIT\n'))
+        self.assertEqual(1, self.cache.misses)
+
+    def test_allowed_not_cached(self):
+        self.cache.update(b'HIT\n', Response(True, 5, 60))
+        self.assertIsNone(self.cache.get(b'HIT\n'))
+
+    def test_denied_until_reset(self):
+        self.cache.update(b'HIT\n', Response(False, 0, 60))
+        self.clock.now += 10.5
+        self.assertEqual(Response(False, 0, 50), self.cache.get(b'HIT\n'))
+        self.assertEqual(1, self.cache.hits)
+        self.clock.now += 50
+        self.assertIsNone(self.cache.get(b'HIT\n'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_allowed_clears_denial(self):
+        self.cache.update(b'HIT\n', Response(False, 0, 60))
+        self.cache.update(b'HIT\n', Response(True, 4, 60))
+        self.assertIsNone(self.cache.get(b'HIT\n'))
+
+    def test_lru_eviction(self):
+        self.cache.update(b'a', Response(False, 0, 60))
+        self.cache.update(b'b', Response(False, 0, 60))
+        self.cache.get(b'a')
+        self.cache.update(b'c', Response(False, 0, 60))
+        self.assertIsNotNone(self.cache.get(b'a'))
+        self.assertIsNone(self.cache.get(b'b'))
+        self.assertIsNotNone(self.cache.get(b'c'))
+
+    def test_ignores_errors(self):
+        self.cache.update(b'HIT\n', ValueError())
+        self.assertEqual(0, len(self.cache))
@@ -0,0 +1,149 @@
+import socket
+import threading
+from unittest import TestCase
+
+from divvy.circuit_breaker import (
+    CircuitBreaker, CircuitBreakerClient, KeyPatternPolicy,
+    fail_closed, fail_open
+)
+from divvy.client import DivvyClient
+from divvy.exceptions import ConnectionError, InputError
+from divvy.protocol import Response
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.error = None
+        self.calls = 0
+
+    def check_rate_limit(self, **hit_args):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return Response(True, 5, 60)
+
+
+class PolicyTest(TestCase):
+    def test_fail_open(self):
+        self.assertTrue(fail_open({}).is_allowed)
+
+    def test_fail_closed(self):
+        self.assertFalse(fail_closed({}).is_allowed)
+
+    def test_key_pattern(self):
+        policy = KeyPatternPolicy([({'type': 'login*'}, fail_closed)])
+        self.assertFalse(policy({'type': 'login-password'}).is_allowed)
+        self.assertTrue(policy({'type': 'api'}).is_allowed)
+        self.assertTrue(policy({'ip': '1.2.3.4'}).is_allowed)
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=0.5,
+                                      minimum_requests=4, window_seconds=10,
+                                      recovery_timeout=5, clock=self.clock)
+
+    def test_stays_closed_below_minimum(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+
+    def test_stays_closed_below_threshold(self):
+        for _ in range(3):
+            self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+
+    def test_window_resets(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 10
+        self.breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+
+    def test_open_probe_close(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertFalse(self.breaker.begin_probe())
+
+        self.clock.now += 5
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(CircuitBreaker.HALF_OPEN, self.breaker.state)
+        self.assertTrue(self.breaker.begin_probe())
+        self.assertFalse(self.breaker.begin_probe())
+
+        self.breaker.probe_failed()
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+
+        self.clock.now += 5
+        self.breaker.allow_request()
+        self.assertTrue(self.breaker.begin_probe())
+        self.breaker.probe_succeeded()
+        self.assertTrue(self.breaker.allow_request())
+
+
+class CircuitBreakerClientTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.client = FakeClient()
+        self.probed = threading.Event()
+        breaker = CircuitBreaker(minimum_requests=2, recovery_timeout=5,
+                                 policy=fail_closed, clock=self.clock)
+        self.wrapped = CircuitBreakerClient(self.client, breaker,
+                                            probe=self.probed.set)
+
+    def test_passes_through(self):
+        self.assertEqual(Response(True, 5, 60),
+                         self.wrapped.check_rate_limit(ip='1.2.3.4'))
+
+    def test_input_error_raised(self):
+        self.client.error = InputError("bad")
+        self.assertRaises(InputError, self.wrapped.check_rate_limit)
+
+    def test_outage(self):
+        self.client.error = ConnectionError("down")
+        for _ in range(2):
+            self.assertFalse(self.wrapped.check_rate_limit().is_allowed)
+        self.assertEqual(CircuitBreaker.OPEN, self.wrapped.breaker.state)
+
+        self.assertFalse(self.wrapped.check_rate_limit().is_allowed)
+        self.assertEqual(2, self.client.calls)
+
+        self.client.error = None
+        self.clock.now += 5
+        self.assertFalse(self.wrapped.check_rate_limit().is_allowed)
+        self.assertTrue(self.probed.wait(5))
+        for _ in range(100):
+            if self.wrapped.breaker.state == CircuitBreaker.CLOSED:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue(self.wrapped.check_rate_limit().is_allowed)
+        self.assertEqual(3, self.client.calls)
+
+    def test_probe_reaches_server(self):
+        # a port with nothing listening on it
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = DivvyClient('127.0.0.1', port)
+        # an idle pooled connection that still looks connected
+        pool = client.connection_pool
+        connection = pool.get_connection()
+        connection._sock = socket.socket()
+        pool.release(connection)
+
+        wrapped = CircuitBreakerClient(client)
+        self.assertRaises(ConnectionError, wrapped.probe)
+        client.disconnect()
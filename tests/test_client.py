@@ -0,0 +1,128 @@
+import socket
+import threading
+from unittest import TestCase
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from divvy.cache import DenialCache
+from divvy.client import DivvyClient
+from divvy.instrumentation import InMemoryCollector
+from divvy.exceptions import InputError, ServerError
+from divvy.protocol import Response
+
+
+class DivvyServerHandler(socketserver.StreamRequestHandler):
+    """Mock a divvy server for test purposes: replies to each HIT line with
+    the canned reply for its "ip" argument, if any."""
+
+    def handle(self):
+        for line in self.rfile:
+            self.server.request_count += 1
+            reply = b'OK true 575 60\n'
+            for ip, canned in self.server.replies.items():
+                if b'"ip"="' + ip + b'"' in line:
+                    reply = canned
+            self.wfile.write(reply)
+
+
+class DivvyServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, replies=None):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0),
+                                        DivvyServerHandler)
+        self.replies = replies or {}
+        self.request_count = 0
+
+
+class ClientTest(TestCase):
+    def setUp(self):
+        self.server = DivvyServer({
+            b'1.1.1.1': b'OK false 0 30\n',
+            b'2.2.2.2': b'ERR unknown "oops"\n',
+        })
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+        host, port = self.server.server_address
+        self.client = DivvyClient(host, port)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_check_rate_limit(self):
+        r = self.client.check_rate_limit(ip='3.3.3.3')
+        self.assertEqual(Response(True, 575, 60), r)
+
+    def test_check_rate_limits(self):
+        results = self.client.check_rate_limits([
+            {'ip': '3.3.3.3'},
+            {'ip': '1.1.1.1'},
+            {'ip': 'bad"ip'},
+            {'ip': '2.2.2.2'},
+            {'ip': '3.3.3.3'},
+        ])
+        self.assertEqual(5, len(results))
+        self.assertEqual(Response(True, 575, 60), results[0])
+        self.assertEqual(Response(False, 0, 30), results[1])
+        self.assertIsInstance(results[2], InputError)
+        self.assertIsInstance(results[3], ServerError)
+        self.assertEqual(Response(True, 575, 60), results[4])
+
+    def test_check_rate_limits_empty(self):
+        self.assertEqual([], self.client.check_rate_limits([]))
+
+    def test_check_rate_limits_many(self):
+        hits = [{'ip': '1.1.1.1'}] * 500
+        results = self.client.check_rate_limits(hits)
+        self.assertEqual([Response(False, 0, 30)] * 500, results)
+
+    def test_denial_cache(self):
+        self.client.denial_cache = DenialCache()
+        for _ in range(3):
+            r = self.client.check_rate_limit(ip='1.1.1.1')
+            self.assertFalse(r.is_allowed)
+        results = self.client.check_rate_limits([
+            {'ip': '1.1.1.1'}, {'ip': '3.3.3.3'}])
+        self.assertFalse(results[0].is_allowed)
+        self.assertTrue(results[1].is_allowed)
+        self.assertEqual(2, self.server.request_count)
+
+    def test_connection(self):
+        connection = self.client.connection
+        self.assertIs(connection, self.client.connection)
+        connection.send(b'HIT "ip"="3.3.3.3"\n')
+        self.assertEqual(Response(True, 575, 60),
+                         self.client.translator.parse_reply(connection.recv()))
+        self.assertNotIn(connection, self.client.connection_pool._in_use)
+        self.assertTrue(self.client.check_rate_limit(ip='3.3.3.3'))
+        self.client.disconnect()
+        self.assertIsNone(connection._sock)
+
+    def test_instrumentation_with_pool(self):
+        self.assertRaises(ValueError, DivvyClient,
+                          connection_pool=self.client.connection_pool,
+                          instrumentation=InMemoryCollector())
+
+    def test_instrumentation(self):
+        collector = InMemoryCollector()
+        host, port = self.server.server_address
+        client = DivvyClient(host, port, instrumentation=collector)
+        client.check_rate_limit(ip='3.3.3.3')
+        client.check_rate_limits([{'ip': '1.1.1.1'}, {'ip': '3.3.3.3'}])
+        client.disconnect()
+        client.check_rate_limit(ip='3.3.3.3')
+        summary = collector.summary()
+        self.assertEqual(4, summary['sends'])
+        self.assertEqual(4, summary['replies'])
+        self.assertEqual(1, summary['reconnects'])
+        self.assertEqual(1, summary['max_queue_depth'])
+        self.assertIsNotNone(summary['latency_p99'])
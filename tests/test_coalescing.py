@@ -0,0 +1,37 @@
+import copy
+import pickle
+from unittest import TestCase
+
+from divvy.coalescing import CoalescedResponse, Coalescer
+from divvy.protocol import Response
+
+
+class CoalescedResponseTest(TestCase):
+    def test_is_a_response(self):
+        r = CoalescedResponse(Response(True, 5, 60), 3)
+        self.assertIsInstance(r, Response)
+        self.assertEqual(Response(True, 5, 60), r)
+        self.assertEqual(3, r.weight)
+        r = r._replace(next_reset_seconds=30)
+        self.assertEqual((Response(True, 5, 30), 3), (r, r.weight))
+
+    def test_copy_and_pickle(self):
+        r = CoalescedResponse(Response(True, 5, 60), 3)
+        for r2 in (copy.copy(r), copy.deepcopy(r),
+                   pickle.loads(pickle.dumps(r))):
+            self.assertIsInstance(r2, CoalescedResponse)
+            self.assertEqual((r, 3), (r2, r2.weight))
+
+
+class CoalescerTest(TestCase):
+    def test_single_flight(self):
+        coalescer = Coalescer()
+        self.assertIsNone(coalescer.join(b'HIT\n'))
+        flight = coalescer.begin(b'HIT\n')
+        self.assertIs(flight, coalescer.join(b'HIT\n'))
+        self.assertIs(flight, coalescer.join(b'HIT\n'))
+        self.assertEqual(3, flight.weight)
+        coalescer.end(b'HIT\n', flight)
+        self.assertIsNone(coalescer.join(b'HIT\n'))
+        self.assertEqual({'checks': 4, 'round_trips': 1, 'in_flight': 0,
+                          'ratio': 0.75}, coalescer.summary())
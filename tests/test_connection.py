@@ -0,0 +1,241 @@
+import socket
+import threading
+import time
+from unittest import TestCase
+
+from divvy.connection import Connection, ConnectionPool, monotonic
+from divvy.exceptions import ConnectionError, TimeoutError
+from divvy.instrumentation import InMemoryCollector
+from divvy.resolver import Resolver
+
+
+class DummyConnection(object):
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.connected_at = None
+        self.disconnects = 0
+
+    def connect(self):
+        self.connected_at = monotonic()
+
+    def disconnect(self):
+        self.connected_at = None
+        self.disconnects += 1
+
+
+class ConnectionPoolTest(TestCase):
+    def _pool(self, **kwargs):
+        return ConnectionPool(connection_class=DummyConnection,
+                              host='localhost', port=8321, **kwargs)
+
+    def test_passes_connection_kwargs(self):
+        pool = self._pool()
+        c = pool.get_connection()
+        self.assertEqual({'host': 'localhost', 'port': 8321}, c.kwargs)
+
+    def test_reuses_released_connection(self):
+        pool = self._pool()
+        c1 = pool.get_connection()
+        pool.release(c1)
+        c2 = pool.get_connection()
+        self.assertIs(c1, c2)
+
+    def test_warmest_connection_first(self):
+        pool = self._pool()
+        c1 = pool.get_connection()
+        c2 = pool.get_connection()
+        pool.release(c1)
+        pool.release(c2)
+        self.assertIs(c2, pool.get_connection())
+
+    def test_non_blocking_exhausted(self):
+        pool = self._pool(max_connections=2, block=False)
+        pool.get_connection()
+        pool.get_connection()
+        self.assertRaises(ConnectionError, pool.get_connection)
+
+    def test_blocking_timeout(self):
+        pool = self._pool(max_connections=1, block_timeout=0.01)
+        pool.get_connection()
+        self.assertRaises(ConnectionError, pool.get_connection)
+
+    def test_blocking_waits_for_release(self):
+        pool = self._pool(max_connections=1, block_timeout=5)
+        c1 = pool.get_connection()
+        timer = threading.Timer(0.01, pool.release, [c1])
+        timer.start()
+        self.assertIs(c1, pool.get_connection())
+        timer.join()
+
+    def test_idle_reaping(self):
+        pool = self._pool(max_idle_time=0)
+        c1 = pool.get_connection()
+        c1.connect()
+        pool.release(c1)
+        time.sleep(0.001)
+        c2 = pool.get_connection()
+        self.assertIsNot(c1, c2)
+        self.assertEqual(1, c1.disconnects)
+
+    def test_max_lifetime(self):
+        pool = self._pool(max_lifetime=60)
+        c1 = pool.get_connection()
+        c1.connect()
+        pool.release(c1)
+        self.assertIs(c1, pool.get_connection())
+        self.assertEqual(0, c1.disconnects)
+        pool.release(c1)
+
+        c1.connected_at -= 120
+        self.assertIs(c1, pool.get_connection())
+        self.assertEqual(1, c1.disconnects)
+
+    def test_disconnect(self):
+        pool = self._pool()
+        c1 = pool.get_connection()
+        c2 = pool.get_connection()
+        pool.release(c1)
+        pool.disconnect()
+        self.assertEqual(1, c1.disconnects)
+        # c2 is in use, so it is left alone until it is released
+        self.assertEqual(0, c2.disconnects)
+        pool.release(c2)
+        self.assertEqual(1, c2.disconnects)
+
+
+class FakeSocket(object):
+    """Hands out canned chunks of data, one per recv_into() call."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, view):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        if len(chunk) > len(view):
+            self.chunks.insert(0, chunk[len(view):])
+            chunk = chunk[:len(view)]
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConnectionRecvTest(TestCase):
+    def _connection(self, chunks, **kwargs):
+        c = Connection(**kwargs)
+        c._sock = FakeSocket(chunks)
+        return c
+
+    def test_single_reply(self):
+        c = self._connection([b'OK true 575 60\n'])
+        self.assertEqual(b'OK true 575 60\n', c.recv())
+
+    def test_split_reply(self):
+        c = self._connection([b'OK tr', b'ue 575', b' 60\n'])
+        self.assertEqual(b'OK true 575 60\n', c.recv())
+
+    def test_coalesced_replies(self):
+        c = self._connection([b'OK true 1 60\nOK false 0 ', b'60\n'])
+        self.assertEqual([b'OK true 1 60\n', b'OK false 0 60\n'],
+                         c.recv_lines(2))
+
+    def test_reply_larger_than_buffer(self):
+        line = b'ERR unknown "' + b'x' * 100 + b'"\n'
+        c = self._connection([line[:50], line[50:] + b'OK true 1 60\n'],
+                             socket_read_size=16)
+        self.assertEqual(line, c.recv())
+        self.assertEqual(b'OK true 1 60\n', c.recv())
+
+    def test_reply_too_long(self):
+        sock = FakeSocket([b'x' * 64] * 4)
+        c = self._connection([], socket_read_size=16)
+        c._sock = sock
+        c.MAX_LENGTH = 100
+        self.assertRaises(ConnectionError, c.recv)
+        self.assertIsNone(c._sock)
+        # gave up before reading everything the server sent
+        self.assertTrue(sock.chunks)
+
+    def test_compacts_partial_reply(self):
+        c = self._connection([b'OK true 1 60\nOK tr', b'ue 2 60\n'],
+                             socket_read_size=18)
+        self.assertEqual(b'OK true 1 60\n', c.recv())
+        self.assertEqual(b'OK true 2 60\n', c.recv())
+        self.assertEqual(18, len(c._buf))
+
+    def test_instrumented_recv_before_send(self):
+        collector = InMemoryCollector()
+        c = self._connection([b'OK true 575 60\n'],
+                             instrumentation=collector)
+        self.assertEqual(b'OK true 575 60\n', c.recv())
+        self.assertEqual(0, collector.summary()['replies'])
+
+    def test_connection_closed(self):
+        c = self._connection([b'OK tr'])
+        self.assertRaises(ConnectionError, c.recv)
+        self.assertIsNone(c._sock)
+
+
+class ConnectTest(TestCase):
+    """Connects to a listening socket on 127.0.0.1, with addresses supplied
+    by a Resolver with a fake getaddrinfo."""
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        self.lookups = 0
+
+    def tearDown(self):
+        self.listener.close()
+
+    def _resolver(self, *hosts):
+        def getaddrinfo(host, port, family, type):
+            self.lookups += 1
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (h, port))
+                    for h in hosts]
+        return Resolver(getaddrinfo=getaddrinfo)
+
+    def test_resolver(self):
+        resolver = self._resolver('127.0.0.1')
+        for _ in range(3):
+            c = Connection('divvy.example', self.port, resolver=resolver)
+            c.connect()
+            c.disconnect()
+        self.assertEqual(1, self.lookups)
+
+    def test_staggered_past_unresponsive_address(self):
+        # 192.0.2.1 is reserved for documentation, so it never answers
+        resolver = self._resolver('192.0.2.1', '127.0.0.1')
+        c = Connection('divvy.example', self.port, resolver=resolver,
+                       socket_connect_timeout=5, happy_eyeballs_delay=0.05)
+        start = monotonic()
+        c.connect()
+        self.assertLess(monotonic() - start, 1.0)
+        self.assertEqual(('127.0.0.1', self.port), c._sock.getpeername())
+        self.assertEqual(1, c._sock.gettimeout())
+        c.disconnect()
+
+        # the address that worked is tried first next time
+        self.assertEqual('127.0.0.1', resolver.getaddrinfo(
+            'divvy.example', self.port, 0, socket.SOCK_STREAM)[0][4][0])
+
+    def test_staggered_all_fail(self):
+        self.listener.close()
+        resolver = self._resolver('127.0.0.1', '127.0.0.1')
+        c = Connection('divvy.example', self.port, resolver=resolver,
+                       happy_eyeballs_delay=0.05)
+        self.assertRaises(ConnectionError, c.connect)
+
+    def test_staggered_timeout(self):
+        resolver = self._resolver('192.0.2.1', '192.0.2.2')
+        c = Connection('divvy.example', self.port, resolver=resolver,
+                       socket_connect_timeout=0.2, happy_eyeballs_delay=0.05)
+        self.assertRaises((TimeoutError, ConnectionError), c.connect)
@@ -0,0 +1,99 @@
+from unittest import TestCase
+
+from divvy.exceptions import TimeoutError
+from divvy.instrumentation import Histogram, InMemoryCollector, Instrumentation
+
+
+class HistogramTest(TestCase):
+    def test_empty(self):
+        h = Histogram()
+        self.assertEqual(0, h.count)
+        self.assertIsNone(h.mean)
+        self.assertIsNone(h.percentile(50))
+
+    def test_percentiles(self):
+        h = Histogram(precision=0.01)
+        for i in range(1, 1001):
+            h.record(i / 1000.0)
+        self.assertEqual(1000, h.count)
+        self.assertAlmostEqual(0.5005, h.mean)
+        self.assertAlmostEqual(0.5, h.percentile(50), delta=0.5 * 0.01)
+        self.assertAlmostEqual(0.99, h.percentile(99), delta=0.99 * 0.01)
+        self.assertEqual(1.0, h.percentile(100))
+        self.assertEqual(0.001, h.min)
+
+    def test_clamped(self):
+        h = Histogram(lowest=0.001, highest=1.0)
+        h.record(0.0)
+        h.record(50.0)
+        self.assertLess(h.percentile(50), 0.0011)
+        self.assertEqual(50.0, h.percentile(100))
+
+
+class InMemoryCollectorTest(TestCase):
+    def test_noop_default(self):
+        i = Instrumentation()
+        i.on_send(1)
+        i.on_reply(0.1)
+        i.on_error(TimeoutError())
+        i.on_reconnect()
+        i.on_queue_depth(3)
+
+    def test_summary(self):
+        c = InMemoryCollector()
+        c.on_send(2)
+        c.on_reply(0.002)
+        c.on_error(TimeoutError())
+        c.on_reconnect()
+        c.on_queue_depth(5)
+        c.on_queue_depth(1)
+        summary = c.summary(percentiles=[50])
+        self.assertEqual(2, summary['sends'])
+        self.assertEqual(1, summary['replies'])
+        self.assertEqual({'TimeoutError': 1}, summary['errors'])
+        self.assertEqual(1, summary['reconnects'])
+        self.assertEqual(1, summary['queue_depth'])
+        self.assertEqual(5, summary['max_queue_depth'])
+        self.assertAlmostEqual(0.002, summary['latency_p50'], delta=0.0001)
+
+    def test_reset(self):
+        c = InMemoryCollector()
+        c.on_send(2)
+        c.reset()
+        self.assertEqual(0, c.summary()['sends'])
+
+
+class HistogramMergeTest(TestCase):
+    def test_stddev(self):
+        h = Histogram()
+        for v in [2, 4, 4, 4, 5, 5, 7, 9]:
+            h.record(v)
+        self.assertAlmostEqual(5.0, h.mean)
+        self.assertAlmostEqual(2.0, h.stddev)
+
+    def test_merge(self):
+        a, b, both = Histogram(), Histogram(), Histogram()
+        for i in range(1, 100):
+            (a if i % 3 else b).record(i / 10.0)
+            both.record(i / 10.0)
+        a.merge(b)
+        self.assertEqual(both.count, a.count)
+        self.assertAlmostEqual(both.mean, a.mean)
+        self.assertAlmostEqual(both.stddev, a.stddev)
+        self.assertEqual(both.min, a.min)
+        self.assertEqual(both.max, a.max)
+        for pct in (50, 90, 99):
+            self.assertEqual(both.percentile(pct), a.percentile(pct))
+
+    def test_merge_mismatch(self):
+        self.assertRaises(ValueError, Histogram().merge,
+                          Histogram(precision=0.1))
+
+    def test_round_trip(self):
+        h = Histogram()
+        for i in range(1, 100):
+            h.record(i / 10.0)
+        copy = Histogram.from_dict(h.to_dict())
+        self.assertEqual(h.count, copy.count)
+        self.assertEqual(h.stddev, copy.stddev)
+        self.assertEqual(h.percentile(90), copy.percentile(90))
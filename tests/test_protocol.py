@@ -74,3 +74,65 @@ class ParseTest(TestCase):
         self.assertRaises(ParseError, self.t.parse_reply, b'OK foo 550 50\n')
         self.assertRaises(ParseError, self.t.parse_reply, b'OK true foo 50\n')
         self.assertRaises(ParseError, self.t.parse_reply, b'OK true 550 foo\n')
+        self.assertRaises(ParseError, self.t.parse_reply, b'OK true +550 50\n')
+        self.assertRaises(ParseError, self.t.parse_reply, b'OK true  550 50\n')
+        self.assertRaises(ParseError, self.t.parse_reply,
+                          b'OK true 550 50\n\n')
+        self.assertRaises(ParseError, self.t.parse_reply, b'\xff\n')
+
+    def testNegative(self):
+        r = self.t.parse_reply(b'OK false -1 -5')
+        self.assertEqual(Response(False, -1, -5), r)
+
+    def testMemoryview(self):
+        r = self.t.parse_reply(memoryview(b'OK true 575 60\n'))
+        self.assertEqual(Response(True, 575, 60), r)
+
+    def testParseReplies(self):
+        results, remainder = self.t.parse_replies(
+            b'OK true 575 60\nERR unknown "oops"\nfoo\nOK false 0 13\nOK tr')
+        self.assertEqual(4, len(results))
+        self.assertEqual(Response(True, 575, 60), results[0])
+        self.assertIsInstance(results[1], ServerError)
+        self.assertIsInstance(results[2], ParseError)
+        self.assertEqual(Response(False, 0, 13), results[3])
+        self.assertEqual(b'OK tr', remainder)
+
+    def testParseRepliesEmpty(self):
+        self.assertEqual(([], b''), self.t.parse_replies(bytearray()))
+
+
+class TemplateTest(TestCase):
+    def setUp(self):
+        self.t = Translator()
+
+    def test_matches_build_hit(self):
+        template = self.t.template('type', 'ip')
+        self.assertEqual(self.t.build_hit(ip='1.2.3.4', type='login'),
+                         template.build_hit(type='login', ip='1.2.3.4'))
+
+    def test_no_keys(self):
+        self.assertEqual(b'HIT\n', self.t.template().build_hit())
+
+    def test_coerced_arguments(self):
+        template = self.t.template('b', 'i')
+        self.assertEqual(b'HIT "b"="True" "i"="1"\n',
+                         template.build_hit(b=True, i=1))
+        self.assertEqual(b'HIT "b"="1" "i"="True"\n',
+                         template.build_hit(b=1, i=True))
+
+    def test_unhashable_value(self):
+        self.assertEqual(b'HIT "l"="[1]"\n', self.t.build_hit(l=[1]))
+
+    def test_invalid_key(self):
+        self.assertRaises(InputError, self.t.template, 'a"b')
+
+    def test_invalid_value(self):
+        template = self.t.template('method')
+        self.assertRaises(InputError, template.build_hit, method='a"b')
+
+    def test_wrong_keys(self):
+        template = self.t.template('type', 'ip')
+        self.assertRaises(InputError, template.build_hit, type='login')
+        self.assertRaises(InputError, template.build_hit,
+                          type='login', user='alice')
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from divvy.recording import (
+    RecordingClient, TraceRecorder, count_trace, read_trace)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class EchoClient(object):
+    connected = True
+
+    def check_rate_limit(self, **hit_args):
+        return hit_args
+
+    def check_rate_limits(self, hits):
+        return list(hits)
+
+
+class RecordingTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def record(self, name):
+        path = os.path.join(self.dir, name)
+        clock = FakeClock()
+        with TraceRecorder(path, clock=clock) as recorder:
+            client = RecordingClient(EchoClient(), recorder)
+            self.assertEqual({'ip': '1.1.1.1'},
+                             client.check_rate_limit(ip='1.1.1.1'))
+            clock.now += 0.25
+            client.check_rate_limits([{'ip': '2.2.2.2'},
+                                      {'ip': '3.3.3.3', 'path': '/x'}])
+            clock.now += 1.5
+            client.check_rate_limit(ip='4.4.4.4')
+            self.assertTrue(client.connected)
+        self.assertEqual(4, recorder.count)
+        return path
+
+    def test_round_trip(self):
+        for name in ("trace", "trace.gz"):
+            path = self.record(name)
+            self.assertEqual([
+                (0.0, {'ip': '1.1.1.1'}),
+                (0.25, {'ip': '2.2.2.2'}),
+                (0.25, {'ip': '3.3.3.3', 'path': '/x'}),
+                (1.75, {'ip': '4.4.4.4'}),
+            ], list(read_trace(path)))
+            self.assertEqual(4, count_trace(path))
+
+    def test_options_not_recorded(self):
+        path = os.path.join(self.dir, "trace")
+        with TraceRecorder(path, clock=FakeClock()) as recorder:
+            client = RecordingClient(EchoClient(), recorder)
+            self.assertEqual(
+                {'ip': '1.1.1.1', 'timeout': 0.5, 'coalesce': True},
+                client.check_rate_limit(0.5, coalesce=True, ip='1.1.1.1'))
+            self.assertEqual({'ip': '2.2.2.2'},
+                             client.check_rate_limit(ip='2.2.2.2'))
+        self.assertEqual([{'ip': '1.1.1.1'}, {'ip': '2.2.2.2'}],
+                         [hit_args for _, hit_args in read_trace(path)])
+
+    def test_compact(self):
+        path = self.record("trace")
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines[0].startswith("# divvy-trace 1 1000.0"))
+        self.assertEqual('0.250000\t{"ip":"3.3.3.3","path":"/x"}', lines[3])
+
+    def test_shards(self):
+        path = self.record("trace")
+        self.assertEqual(['1.1.1.1', '3.3.3.3'],
+                         [a['ip'] for _, a in read_trace(path, 0, 2)])
+        self.assertEqual(['2.2.2.2', '4.4.4.4'],
+                         [a['ip'] for _, a in read_trace(path, 1, 2)])
+
+    def test_not_a_trace(self):
+        path = os.path.join(self.dir, "other")
+        with open(path, "w") as f:
+            f.write("hello\n")
+        self.assertRaises(ValueError, list, read_trace(path))
@@ -0,0 +1,115 @@
+import socket
+import threading
+from unittest import TestCase
+
+from divvy.resolver import Resolver, interleave_families
+
+
+def _addr(family, host):
+    return (family, socket.SOCK_STREAM, 6, '', (host, 8321))
+
+
+V4_A = _addr(socket.AF_INET, '10.0.0.1')
+V4_B = _addr(socket.AF_INET, '10.0.0.2')
+V6_A = _addr(socket.AF_INET6, '2001:db8::1')
+V6_B = _addr(socket.AF_INET6, '2001:db8::2')
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDNS(object):
+    def __init__(self, answer):
+        self.answer = answer
+        self.lookups = 0
+        self.looked_up = threading.Event()
+
+    def __call__(self, host, port, family, type):
+        self.lookups += 1
+        try:
+            if isinstance(self.answer, Exception):
+                raise self.answer
+            return list(self.answer)
+        finally:
+            self.looked_up.set()
+
+    def wait(self):
+        if not self.looked_up.wait(5):
+            raise AssertionError("no lookup")
+        self.looked_up.clear()
+
+
+class ResolverTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dns = FakeDNS([V4_A, V4_B])
+        self.resolver = Resolver(ttl=60, refresh_ratio=0.5, retry_interval=5,
+                                 clock=self.clock, getaddrinfo=self.dns)
+
+    def lookup(self):
+        return self.resolver.getaddrinfo('divvy', 8321)
+
+    def test_caches(self):
+        self.assertEqual([V4_A, V4_B], self.lookup())
+        self.clock.now += 29
+        self.assertEqual([V4_A, V4_B], self.lookup())
+        self.assertEqual(1, self.dns.lookups)
+
+    def test_refreshes_in_background(self):
+        self.lookup()
+        self.dns.looked_up.clear()
+        self.dns.answer = [V4_B]
+        self.clock.now += 31
+        # the old answer is returned while the refresh runs
+        self.assertEqual([V4_A, V4_B], self.lookup())
+        self.dns.wait()
+        for _ in range(100):
+            if self.lookup() == [V4_B]:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual([V4_B], self.lookup())
+        self.assertEqual(2, self.dns.lookups)
+
+    def test_failed_refresh_keeps_old_answer(self):
+        self.lookup()
+        self.dns.looked_up.clear()
+        self.dns.answer = socket.gaierror("oops")
+        self.clock.now += 58
+        self.lookup()
+        self.dns.wait()
+        for _ in range(100):
+            if not self.resolver._cache[('divvy', 8321, 0, 0)].refreshing:
+                break
+            threading.Event().wait(0.01)
+        # even after the ttl, until the retry
+        self.clock.now += 3
+        self.assertEqual([V4_A, V4_B], self.lookup())
+        self.assertEqual(2, self.dns.lookups)
+
+    def test_expired_lookup_failure_uses_old_answer(self):
+        self.lookup()
+        self.dns.answer = socket.gaierror("oops")
+        self.clock.now += 61
+        self.assertEqual([V4_A, V4_B], self.lookup())
+        self.assertEqual(2, self.dns.lookups)
+
+    def test_first_lookup_failure(self):
+        self.dns.answer = socket.gaierror("oops")
+        self.assertRaises(socket.error, self.lookup)
+
+    def test_last_known_good_first(self):
+        self.lookup()
+        self.resolver.mark_good('divvy', 8321, 0, 0, V4_B)
+        self.assertEqual([V4_B, V4_A], self.lookup())
+        self.resolver.invalidate('divvy')
+        self.assertEqual([V4_A, V4_B], self.lookup())
+
+    def test_interleave_families(self):
+        self.assertEqual([V6_A, V4_A, V6_B, V4_B],
+                         interleave_families([V6_A, V6_B, V4_A, V4_B]))
+        self.assertEqual([V4_A, V4_B], interleave_families([V4_A, V4_B]))
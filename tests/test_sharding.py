@@ -0,0 +1,113 @@
+from unittest import TestCase
+
+from divvy.exceptions import ConnectionError, TimeoutError
+from divvy.protocol import Response
+from divvy.sharding import HashRing, ShardedClient
+
+
+class HashRingTest(TestCase):
+    def setUp(self):
+        self.keys = [str(i).encode('utf-8') for i in range(2000)]
+
+    def test_empty(self):
+        self.assertIsNone(HashRing().get_node(b'key'))
+
+    def test_stable(self):
+        a = HashRing(['a', 'b', 'c'])
+        b = HashRing(['c', 'b', 'a'])
+        for key in self.keys:
+            self.assertEqual(a.get_node(key), b.get_node(key))
+
+    def test_balanced(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = {}
+        for key in self.keys:
+            node = ring.get_node(key)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(4, len(counts))
+        for count in counts.values():
+            self.assertTrue(300 < count < 700, counts)
+
+    def test_minimal_movement(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        before = dict((key, ring.get_node(key)) for key in self.keys)
+        ring.remove('b')
+        for key in self.keys:
+            if before[key] != 'b':
+                self.assertEqual(before[key], ring.get_node(key))
+            else:
+                self.assertNotEqual('b', ring.get_node(key))
+        ring.add('b')
+        for key in self.keys:
+            self.assertEqual(before[key], ring.get_node(key))
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.hits = []
+        self.fail = None
+
+    def check_rate_limit(self, **hit_args):
+        if self.fail is not None:
+            raise self.fail
+        self.hits.append(hit_args)
+        return Response(True, 1, 60)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ShardedClientTest(TestCase):
+    def setUp(self):
+        self.clients = dict((name, FakeClient()) for name in 'abc')
+        self.clock = FakeClock()
+        self.sharded = ShardedClient(self.clients, key_fields=['ip'],
+                                     down_interval=10, clock=self.clock)
+
+    def test_routes_by_key_fields(self):
+        for i in range(50):
+            self.sharded.check_rate_limit(type='login', ip='10.0.0.1',
+                                          request=i)
+        self.assertEqual([50], [len(c.hits) for c in self.clients.values()
+                                if c.hits])
+
+    def test_spreads_actors(self):
+        for i in range(300):
+            self.sharded.check_rate_limit(ip='10.0.0.{}'.format(i))
+        for client in self.clients.values():
+            self.assertTrue(client.hits)
+
+    def test_mark_down_on_connection_error(self):
+        endpoint = self.sharded.get_endpoint({'ip': '10.0.0.1'})
+        self.clients[endpoint].fail = ConnectionError("down")
+        self.assertRaises(ConnectionError, self.sharded.check_rate_limit,
+                          ip='10.0.0.1')
+        self.assertTrue(self.sharded.is_down(endpoint))
+        self.assertTrue(self.sharded.check_rate_limit(ip='10.0.0.1'))
+        self.assertNotEqual(endpoint,
+                            self.sharded.get_endpoint({'ip': '10.0.0.1'}))
+
+        self.clock.now += 10
+        self.assertEqual(endpoint,
+                         self.sharded.get_endpoint({'ip': '10.0.0.1'}))
+        self.assertFalse(self.sharded.is_down(endpoint))
+
+    def test_mark_down_on_timeout(self):
+        endpoint = self.sharded.get_endpoint({'ip': '10.0.0.1'})
+        self.clients[endpoint].fail = TimeoutError("slow")
+        self.assertRaises(TimeoutError, self.sharded.check_rate_limit,
+                          ip='10.0.0.1')
+        self.assertTrue(self.sharded.is_down(endpoint))
+
+    def test_all_down(self):
+        for endpoint in self.clients:
+            self.sharded.mark_down(endpoint, float('inf'))
+        self.assertRaises(ConnectionError, self.sharded.check_rate_limit,
+                          ip='10.0.0.1')
+        self.sharded.mark_up('a')
+        self.assertEqual('a', self.sharded.get_endpoint({'ip': '10.0.0.1'}))
@@ -0,0 +1,170 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest as trial
+
+from divvy import asyncio_client, twisted_client
+from divvy.client import DivvyClient
+from divvy.exceptions import ConnectionError, ServerError, TimeoutError
+from divvy.protocol import Response
+from divvy.testing import FakeDivvyServer, QuotaTracker, Rule, load_rules
+
+
+CONFIG = """
+; two per minute, by IP
+[method=GET path=/api/*]
+creditLimit = 2
+resetSeconds = 60
+actorField = ip
+comment = 'api'
+
+[default]
+creditLimit = 100
+resetSeconds = 10
+"""
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RulesTest(TestCase):
+    def test_load_rules(self):
+        api, default = load_rules(CONFIG)
+        self.assertEqual({'method': 'GET', 'path': '/api/*'}, api.operation)
+        self.assertEqual((2, 60, 'ip', 'api'), (
+            api.credit_limit, api.reset_seconds, api.actor_field, api.label))
+        self.assertEqual({}, default.operation)
+        self.assertEqual((100, 10, None), (
+            default.credit_limit, default.reset_seconds,
+            default.actor_field))
+
+    def test_load_rules_invalid(self):
+        self.assertRaises(ValueError, load_rules, "creditLimit = 2")
+
+    def test_quotas(self):
+        clock = FakeClock()
+        quotas = QuotaTracker(load_rules(CONFIG), clock=clock)
+        hit = {'method': 'GET', 'path': '/api/users', 'ip': '1.1.1.1'}
+        self.assertEqual((True, 1, 60), quotas.hit(hit))
+        clock.now += 0.5
+        self.assertEqual((True, 0, 60), quotas.hit(hit))
+        clock.now += 30
+        self.assertEqual((False, 0, 30), quotas.hit(hit))
+        # other actors have their own quota
+        self.assertEqual((True, 1, 60), quotas.hit(dict(hit, ip='2.2.2.2')))
+        clock.now += 30
+        self.assertEqual((True, 1, 60), quotas.hit(hit))
+
+    def test_shared_quota(self):
+        quotas = QuotaTracker(load_rules(CONFIG), clock=FakeClock())
+        self.assertEqual((True, 99, 10), quotas.hit({'ip': '1.1.1.1'}))
+        self.assertEqual((True, 98, 10), quotas.hit({'ip': '2.2.2.2'}))
+
+    def test_no_matching_rule(self):
+        quotas = QuotaTracker([Rule({'method': 'GET'}, 0, 60)])
+        self.assertEqual((False, 0, 60), quotas.hit({'method': 'GET'}))
+        self.assertEqual((True, 0, 0), quotas.hit({'method': 'POST'}))
+
+
+class ThreadedServerTest(TestCase):
+    def start(self, **kwargs):
+        self.server = FakeDivvyServer(CONFIG, seed=1, **kwargs)
+        self.addCleanup(self.server.stop)
+        host, port = self.server.start()
+        self.client = DivvyClient(host, port, socket_timeout=0.5)
+        self.addCleanup(self.client.disconnect)
+
+    def test_check_rate_limit(self):
+        self.start()
+        hit = {'method': 'GET', 'path': '/api/users', 'ip': '1.1.1.1'}
+        self.assertEqual(Response(True, 1, 60),
+                         self.client.check_rate_limit(**hit))
+        self.assertEqual(Response(True, 0, 60),
+                         self.client.check_rate_limit(**hit))
+        self.assertEqual(Response(False, 0, 60),
+                         self.client.check_rate_limit(**hit))
+        self.assertEqual(3, self.server.request_count)
+        self.assertEqual(1, self.server.connection_count)
+
+    def test_latency_keeps_order(self):
+        self.start(latency=0.001, jitter=0.01)
+        results = self.client.check_rate_limits(
+            [{'ip': '1.1.1.1'}] * 20)
+        self.assertEqual(list(range(99, 79, -1)),
+                         [r.current_credit for r in results])
+
+    def test_errors(self):
+        self.start(error_rate=1.0)
+        self.assertRaises(ServerError, self.client.check_rate_limit,
+                          ip='1.1.1.1')
+
+    def test_drops(self):
+        self.start(drop_rate=1.0)
+        self.assertRaises(TimeoutError, self.client.check_rate_limit,
+                          ip='1.1.1.1')
+
+    def test_resets(self):
+        self.start(reset_rate=1.0)
+        self.assertRaises(ConnectionError, self.client.check_rate_limit,
+                          ip='1.1.1.1')
+
+    def test_reset_connections(self):
+        self.start()
+        self.client.check_rate_limit(ip='1.1.1.1')
+        self.server.reset_connections()
+        self.assertRaises(ConnectionError, self.client.check_rate_limit,
+                          ip='1.1.1.1')
+        # reconnects
+        self.assertTrue(self.client.check_rate_limit(ip='1.1.1.1').is_allowed)
+        self.assertEqual(2, self.server.connection_count)
+
+
+class SubprocessServerTest(TestCase):
+    def test_check_rate_limit(self):
+        server = FakeDivvyServer(CONFIG)
+        host, port = server.start_process()
+        try:
+            client = DivvyClient(host, port)
+            self.assertEqual(Response(True, 99, 10),
+                             client.check_rate_limit(ip='1.1.1.1'))
+            client.disconnect()
+        finally:
+            server.stop()
+
+
+class AsyncioServerTest(IsolatedAsyncioTestCase):
+    async def test_check_rate_limit(self):
+        server = FakeDivvyServer(CONFIG, latency=0.001)
+        aio_server = await server.serve()
+        client = asyncio_client.DivvyClient(*server.address)
+        try:
+            results = await asyncio.gather(*[
+                client.check_rate_limit(ip='1.1.1.1') for _ in range(10)])
+            self.assertEqual(list(range(99, 89, -1)),
+                             [r.current_credit for r in results])
+        finally:
+            client.close()
+            aio_server.close()
+            await aio_server.wait_closed()
+
+
+class TwistedServerTest(trial.TestCase):
+    @defer.inlineCallbacks
+    def test_check_rate_limit(self):
+        server = FakeDivvyServer(CONFIG)
+        port = server.listen_twisted()
+        self.addCleanup(port.stopListening)
+        client = twisted_client.DivvyClient(*server.address)
+        self.addCleanup(client.disconnect)
+        while not client.connected:
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        results = yield defer.gatherResults([
+            client.check_rate_limit(ip='1.1.1.1') for _ in range(10)])
+        self.assertEqual(list(range(99, 89, -1)),
+                         [r.current_credit for r in results])
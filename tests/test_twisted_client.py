@@ -1,9 +1,15 @@
 from twisted.trial import unittest
 from twisted.test import proto_helpers
 from twisted.internet import task
-from twisted.internet.defer import TimeoutError
+from twisted.internet.defer import CancelledError, TimeoutError
+from twisted.internet.error import ConnectionLost, TimeoutError as ConnectTimeoutError
+from twisted.internet.testing import MemoryReactorClock
 
 from divvy import twisted_client
+from divvy.cache import DenialCache
+from divvy.coalescing import Coalescer
+from divvy.instrumentation import InMemoryCollector
+from divvy.circuit_breaker import CircuitBreaker, fail_closed
 from divvy.protocol import Translator
 
 
@@ -41,4 +47,320 @@ class DivvyProtocolTest(unittest.TestCase):
         self.clock.advance(self.factory.timeout)
         return self.assertFailure(d, TimeoutError)
 
-    
+    def test_timeouts_share_one_timer(self):
+        d1 = self.factory.checkRateLimit({})
+        self.clock.advance(10)
+        d2 = self.factory.checkRateLimit({})
+        d3 = self.factory.checkRateLimit({})
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.protocol.dataReceived(b'OK true 575 60\n')
+        self.successResultOf(d1)
+        self.assertEqual([d2, d3], [d for _, d in self.factory.deadlines])
+        self.clock.advance(29)
+        self.assertNoResult(d2)
+        self.clock.advance(1)
+        self.failureResultOf(d2, TimeoutError)
+        self.failureResultOf(d3, TimeoutError)
+        self.assertEqual(0, len(self.factory.deadlines))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_standalone_rotation(self):
+        self.protocol.setReconnectCount(1)
+        d1 = self.factory.checkRateLimit({})
+        d2 = self.factory.checkRateLimit({})
+        self.assertTrue(self.factory.draining)
+        self.failureResultOf(self.factory.checkRateLimit({}), ConnectionLost)
+        self.protocol.dataReceived(b'OK true 575 60\n')
+        self.assertFalse(self.transport.disconnecting)
+        self.protocol.dataReceived(b'OK true 575 60\n')
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_late_reply_discarded(self):
+        d1 = self.factory.checkRateLimit({})
+        d1.addErrback(lambda f: f.trap(TimeoutError))
+        self.clock.advance(self.factory.timeout)
+        d2 = self.factory.checkRateLimit({})
+        self.assertEqual(1, self.factory.tombstones)
+
+        self.protocol.dataReceived(b'OK false 0 60\n')
+        self.assertFalse(d2.called)
+        self.assertEqual(0, self.factory.tombstones)
+
+        response = self.translator.parse_reply(b'OK true 575 60\n')
+        d2.addCallback(self.assertEqual, response)
+        self.protocol.dataReceived(b'OK true 575 60\n')
+        return d2
+
+    def test_recycle_on_tombstones(self):
+        self.factory.max_tombstones = 2
+        for _ in range(2):
+            self.factory.checkRateLimit({}).addErrback(lambda f: f.trap(TimeoutError))
+        self.clock.advance(self.factory.timeout)
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_cancelled_check_is_tombstone(self):
+        self.factory.max_tombstones = 2
+        d = self.factory.checkRateLimit({})
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(1, self.factory.tombstones)
+        self.protocol.dataReceived(b'OK true 575 60\n')
+        self.assertEqual(0, self.factory.tombstones)
+        for _ in range(2):
+            self.factory.checkRateLimit({}).addErrback(lambda f: f.trap(TimeoutError))
+        self.clock.advance(self.factory.timeout)
+        self.assertEqual(2, self.factory.tombstones)
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_drains_before_reconnect(self):
+        self.protocol.setReconnectCount(1)
+        d1 = self.factory.checkRateLimit({})
+        d2 = self.factory.checkRateLimit({})
+        self.assertTrue(self.factory.draining)
+        self.protocol.dataReceived(b'OK true 575 60\n')
+        self.assertFalse(self.transport.disconnecting)
+        self.protocol.dataReceived(b'OK true 574 60\n')
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEqual(574, self.successResultOf(d2).current_credit)
+        self.successResultOf(d1)
+
+
+class DivvyClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.savedReactor = twisted_client.reactor
+        self.reactor = MemoryReactorClock()
+        twisted_client.reactor = self.reactor
+        self.client = twisted_client.DivvyClient('127.0.0.1', 8321, timeout=30, connections=3)
+        self.transports = []
+
+    def tearDown(self):
+        twisted_client.reactor = self.savedReactor
+
+    def _connect(self, factory):
+        transport = proto_helpers.StringTransport()
+        protocol = factory.buildProtocol(('127.0.0.1', 8321))
+        protocol.makeConnection(transport)
+        self.transports.append(transport)
+        return protocol
+
+    def test_opens_connections(self):
+        self.assertEqual(3, len(self.reactor.tcpClients))
+        self.assertFalse(self.client.connected)
+
+    def test_not_connected(self):
+        client = twisted_client.DivvyClient('127.0.0.1', 8321, max_pending=0)
+        self.failureResultOf(client.check_rate_limit(), ConnectionLost)
+
+    def test_pending_until_connected(self):
+        d1 = self.client.check_rate_limit(ip='1.2.3.4')
+        d2 = self.client.check_rate_limit(ip='5.6.7.8')
+        self.assertNoResult(d1)
+        protocol = self._connect(self.client.factories[1])
+        self.assertEqual(b'HIT "ip"="1.2.3.4"\nHIT "ip"="5.6.7.8"\n', self.transports[0].value())
+        protocol.dataReceived(b'OK true 575 60\nOK false 0 60\n')
+        self.assertTrue(self.successResultOf(d1).is_allowed)
+        self.assertFalse(self.successResultOf(d2).is_allowed)
+        self.assertEqual(0, len(self.client.pendingHits))
+
+    def test_pending_deadline(self):
+        d1 = self.client.check_rate_limit()
+        self.reactor.advance(10)
+        d2 = self.client.check_rate_limit(timeout=5)
+        self.reactor.advance(5)
+        self.failureResultOf(d2, ConnectTimeoutError)
+        self.assertNoResult(d1)
+        self.reactor.advance(15)
+        self.failureResultOf(d1, ConnectTimeoutError)
+        self.assertEqual(0, len(self.client.pendingHits))
+
+    def test_pending_deadline_carried(self):
+        d = self.client.check_rate_limit(timeout=5)
+        self.reactor.advance(4)
+        self._connect(self.client.factories[0])
+        self.reactor.advance(1)
+        self.failureResultOf(d, TimeoutError)
+
+    def test_timeout_argument(self):
+        protocol = self._connect(self.client.factories[0])
+        d1 = self.client.check_rate_limit()
+        d2 = self.client.check_rate_limit(timeout=5)
+        self.reactor.advance(5)
+        self.failureResultOf(d2, TimeoutError)
+        self.assertNoResult(d1)
+        protocol.dataReceived(b'OK true 575 60\nOK true 575 60\n')
+        self.successResultOf(d1)
+
+    def test_pending_full(self):
+        client = twisted_client.DivvyClient('127.0.0.1', 8321, max_pending=2)
+        client.check_rate_limit()
+        client.check_rate_limit()
+        self.failureResultOf(client.check_rate_limit(), ConnectionLost)
+        self.assertEqual(2, len(client.pendingHits))
+
+    def test_pending_cancel(self):
+        d = self.client.check_rate_limit()
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self._connect(self.client.factories[0])
+        self.assertEqual(b'', self.transports[0].value())
+
+    def test_disconnect_fails_pending(self):
+        d = self.client.check_rate_limit()
+        self.client.disconnect()
+        self.failureResultOf(d, ConnectionLost)
+        self.failureResultOf(self.client.check_rate_limit(), ConnectionLost)
+
+    def test_rotation(self):
+        client = twisted_client.DivvyClient('127.0.0.1', 8321, timeout=30, count_before_reconnect=2)
+        connects = len(self.reactor.tcpClients)
+        old = client.factories[0]
+        self._connect(old)
+        ds = [client.check_rate_limit() for _ in range(3)]
+        self.assertEqual(connects + 1, len(self.reactor.tcpClients))
+        # the old connection carries on until the new one is up
+        ds.append(client.check_rate_limit())
+        self.assertEqual(4, len(old.deferredResponses))
+
+        new = client.factories[1]
+        self._connect(new)
+        self.assertEqual([new], client.factories)
+        client.check_rate_limit()
+        self.assertEqual(b'HIT\n', self.transports[1].value())
+        self.assertFalse(self.transports[0].disconnecting)
+
+        old.divvyProtocol.dataReceived(b'OK true 575 60\n' * 4)
+        for d in ds:
+            self.assertTrue(self.successResultOf(d).is_allowed)
+        self.assertTrue(self.transports[0].disconnecting)
+        self.assertFalse(old.running)
+
+    def test_rotation_by_age(self):
+        client = twisted_client.DivvyClient('127.0.0.1', 8321, timeout=30, max_age=60)
+        connects = len(self.reactor.tcpClients)
+        protocol = self._connect(client.factories[0])
+        client.check_rate_limit()
+        protocol.dataReceived(b'OK true 575 60\n')
+        self.reactor.advance(60)
+        self.assertEqual(connects, len(self.reactor.tcpClients))
+        client.check_rate_limit()
+        self.assertEqual(connects + 1, len(self.reactor.tcpClients))
+        # an idle connection closes as soon as it is replaced
+        protocol.dataReceived(b'OK true 575 60\n')
+        self._connect(client.factories[1])
+        self.assertTrue(self.transports[0].disconnecting)
+
+    def test_batch_writes(self):
+        client = twisted_client.DivvyClient('127.0.0.1', 8321, timeout=30, batch_writes=True)
+        protocol = self._connect(client.factories[0])
+        ds = [client.check_rate_limit(ip='1.2.3.4') for _ in range(3)]
+        self.assertEqual(b'', self.transports[0].value())
+        self.reactor.advance(0)
+        self.assertEqual(b'HIT "ip"="1.2.3.4"\n' * 3, self.transports[0].value())
+        self.assertEqual((1, 3), (client.batch_sizes.count, client.batch_sizes.max))
+        protocol.dataReceived(b'OK true 575 60\n' * 3)
+        for d in ds:
+            self.successResultOf(d)
+
+    def test_coalescing(self):
+        self.client.coalescer = Coalescer()
+        protocol = self._connect(self.client.factories[0])
+        ds = [self.client.check_rate_limit(coalesce=True, ip='1.2.3.4') for _ in range(3)]
+        d4 = self.client.check_rate_limit(ip='1.2.3.4')
+        self.assertEqual(b'HIT "ip"="1.2.3.4"\n' * 2, self.transports[0].value())
+        protocol.dataReceived(b'OK true 5 60\nOK true 4 60\n')
+        for d in ds:
+            response = self.successResultOf(d)
+            self.assertEqual((True, 5, 60, 3), tuple(response) + (response.weight,))
+        self.assertEqual(4, self.successResultOf(d4).current_credit)
+        self.assertEqual(1, self.client.coalescer.round_trips)
+
+        ds = [self.client.check_rate_limit(coalesce=True) for _ in range(2)]
+        self.reactor.advance(30)
+        for d in ds:
+            self.failureResultOf(d, TimeoutError)
+
+    def test_least_outstanding_dispatch(self):
+        protocols = [self._connect(f) for f in self.client.factories]
+        for _ in range(3):
+            self.client.check_rate_limit()
+        self.assertEqual([b'HIT\n'] * 3, [t.value() for t in self.transports])
+
+        protocols[1].dataReceived(b'OK true 575 60\n')
+        self.transports[1].clear()
+        self.client.check_rate_limit(ip='1.2.3.4')
+        self.assertEqual(b'HIT "ip"="1.2.3.4"\n', self.transports[1].value())
+
+    def test_skips_disconnected(self):
+        self._connect(self.client.factories[2])
+        for _ in range(3):
+            self.client.check_rate_limit()
+        self.assertEqual(3, len(self.client.factories[2].deferredResponses))
+
+    def test_denial_cache(self):
+        self.client.denial_cache = DenialCache()
+        self._connect(self.client.factories[0])
+        d1 = self.client.check_rate_limit(ip='1.2.3.4')
+        self.client.factories[0].divvyProtocol.dataReceived(b'OK false 0 60\n')
+        self.transports[0].clear()
+        d2 = self.client.check_rate_limit(ip='1.2.3.4')
+        self.assertEqual(b'', self.transports[0].value())
+        self.assertFalse(self.successResultOf(d1).is_allowed)
+        self.assertFalse(self.successResultOf(d2).is_allowed)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(minimum_requests=2, window_seconds=100, recovery_timeout=5,
+                                 policy=fail_closed, clock=self.reactor.seconds)
+        wrapped = twisted_client.CircuitBreakerClient(self.client, breaker)
+        for _ in range(3):
+            d = wrapped.check_rate_limit()
+            self.reactor.advance(30)
+            self.assertFalse(self.successResultOf(d).is_allowed)
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+        self.reactor.advance(breaker.recovery_timeout)
+        self._connect(self.client.factories[0])
+        self.assertFalse(self.successResultOf(wrapped.check_rate_limit()).is_allowed)
+        self.reactor.advance(wrapped.probe_interval)
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        wrapped.check_rate_limit()
+        self.assertEqual(b'HIT\n', self.transports[0].value())
+
+    def test_instrumentation(self):
+        collector = InMemoryCollector()
+        factory = twisted_client.DivvyFactory(timeout=30, instrumentation=collector)
+        protocol = factory.buildProtocol(('127.0.0.1', 0))
+        protocol.makeConnection(proto_helpers.StringTransport())
+        factory.checkRateLimit({})
+        factory.checkRateLimit({}).addErrback(lambda f: None)
+        self.reactor.advance(0.25)
+        protocol.dataReceived(b'OK true 575 60\nERR unknown "oops"\n')
+        summary = collector.summary()
+        self.assertEqual(2, summary['sends'])
+        self.assertEqual(2, summary['replies'])
+        self.assertEqual({'ServerError': 1}, summary['errors'])
+        self.assertEqual(2, summary['max_queue_depth'])
+        self.assertEqual(0, summary['queue_depth'])
+        self.assertAlmostEqual(0.25, summary['latency_p50'], delta=0.01)
+
+
+class ShardedDivvyClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.savedReactor = twisted_client.reactor
+        twisted_client.reactor = MemoryReactorClock()
+        self.client = twisted_client.ShardedDivvyClient(
+            [('10.0.0.1', 8321), ('10.0.0.2', 8321)], key_fields=['ip'], timeout=30)
+
+    def tearDown(self):
+        twisted_client.reactor = self.savedReactor
+
+    def test_marks_down_unconnected(self):
+        endpoint = self.client.get_endpoint({'ip': '1.2.3.4'})
+        d = self.client.check_rate_limit(ip='1.2.3.4')
+        twisted_client.reactor.advance(30)
+        self.failureResultOf(d, ConnectTimeoutError)
+        self.assertTrue(self.client.is_down(endpoint))
+        self.assertNotEqual(endpoint, self.client.get_endpoint({'ip': '1.2.3.4'}))